@@ -0,0 +1,79 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AdaptivePollingPolicy:
+    """
+    Tunes a project's polling interval and page size from its recent polls.
+
+    - Full pages (a backlog is building up): poll sooner and ask for bigger pages.
+    - Empty polls: back off geometrically toward ``max_interval``.
+    - Some data but no full page: drift back toward the configured interval.
+    - Page size is additionally steered so Kobo's response time stays near
+      ``target_response_ms``.
+    """
+    base_interval: float = 30.0
+    min_interval: float = 5.0
+    max_interval: float = 300.0
+    min_page_size: int = 50
+    max_page_size: int = 1000
+    target_response_ms: float = 2000.0
+    backoff_factor: float = 1.5
+    smoothing: float = 0.3  # weight of the newest sample in the response-time average
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'AdaptivePollingPolicy':
+        """Build a policy from the dict returned by ``KoboToolboxClient.get_api_config``."""
+        base_interval = float(config.get("polling_interval", 30))
+        min_page_size = int(config.get("batch_size", 50))
+        return cls(
+            base_interval=base_interval,
+            min_interval=min(float(config.get("min_polling_interval", 5)), base_interval),
+            max_interval=max(float(config.get("max_polling_interval", 300)), base_interval),
+            min_page_size=min_page_size,
+            max_page_size=max(int(config.get("max_batch_size", 1000)), min_page_size),
+            target_response_ms=float(config.get("target_response_ms", 2000)),
+        )
+
+    def observe(self, stream, page_sizes: List[int], response_times_ms: List[float]):
+        """Update ``stream.polling_interval`` / ``stream.batch_size`` after a poll."""
+        requested = stream.batch_size
+        fetched = sum(page_sizes)
+        full_pages = sum(1 for size in page_sizes if size >= requested)
+
+        for elapsed in response_times_ms:
+            if stream.avg_response_ms is None:
+                stream.avg_response_ms = elapsed
+            else:
+                stream.avg_response_ms += self.smoothing * (elapsed - stream.avg_response_ms)
+
+        interval = stream.polling_interval
+        page_size = requested
+
+        if full_pages:
+            interval = interval / 2
+            page_size = page_size * 2
+        elif fetched == 0:
+            interval = interval * self.backoff_factor
+        else:
+            interval = (interval + self.base_interval) / 2
+
+        # Keep Kobo's response time near the target regardless of load
+        if stream.avg_response_ms is not None:
+            if stream.avg_response_ms > self.target_response_ms * 1.2:
+                page_size = min(page_size, int(requested * 0.75))
+            elif stream.avg_response_ms > self.target_response_ms:
+                page_size = min(page_size, requested)
+
+        stream.polling_interval = round(min(max(interval, self.min_interval), self.max_interval), 1)
+        stream.batch_size = int(min(max(page_size, self.min_page_size), self.max_page_size))
+
+        if stream.batch_size != requested:
+            logger.debug(
+                f"{stream.project_uid}: page size {requested} -> {stream.batch_size}, "
+                f"interval {stream.polling_interval}s (avg response {stream.avg_response_ms or 0:.0f}ms)"
+            )
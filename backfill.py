@@ -0,0 +1,369 @@
+import copy
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import BackfillJob
+from stream_scheduler import ProjectStream
+
+logger = logging.getLogger(__name__)
+
+# Kobo stores _submission_time as a naive UTC ISO string
+SUBMISSION_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def split_time_range(start: datetime, end: datetime, count: int) -> List[Dict[str, Any]]:
+    """Split ``[start, end)`` into ``count`` equal ``_submission_time`` windows."""
+    count = max(1, count)
+    step = (end - start) / count
+    windows = []
+    for i in range(count):
+        window_start = start + step * i
+        window_end = end if i == count - 1 else start + step * (i + 1)
+        windows.append({
+            "start": window_start.strftime(SUBMISSION_TIME_FORMAT),
+            "end": window_end.strftime(SUBMISSION_TIME_FORMAT),
+            "last_id": None,
+            "fetched": 0,
+            "done": False,
+        })
+    return windows
+
+
+def parse_submission_time(value: str) -> datetime:
+    """Parse a date or a Kobo ``_submission_time`` value (fractions and offsets are dropped)."""
+    value = value.strip().replace("Z", "")
+    return datetime.fromisoformat(value[:19])
+
+
+def parse_range_end(value: str) -> datetime:
+    """
+    Exclusive upper bound for a backfill ``end``.
+
+    A date-only end covers that whole day (``2024-01-31`` -> ``2024-02-01T00:00:00``);
+    a timestamp covers its whole second, fractions included.
+    """
+    end = parse_submission_time(value)
+    if len(value.strip().replace("Z", "")) <= 10:
+        return end + timedelta(days=1)
+    return end + timedelta(seconds=1)
+
+
+@dataclass
+class BackfillRun:
+    """In-memory state of a backfill job while it is running in this process."""
+    job_id: int
+    user_id: int
+    server_url: str
+    api_token: str
+    project_uid: str
+    eventstream_client: Any
+    windows: List[Dict[str, Any]]
+    page_size: int = 500
+    fetched: int = 0
+    sent: int = 0
+    duplicates: int = 0
+    bytes_fetched: int = 0
+    base_elapsed: float = 0.0
+    started: float = field(default_factory=time.monotonic)
+    active: bool = True
+    error: Optional[str] = None
+    streams: List[ProjectStream] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    save_lock: threading.Lock = field(default_factory=threading.Lock)
+    thread: Optional[threading.Thread] = None
+
+    @property
+    def elapsed(self) -> float:
+        return self.base_elapsed + (time.monotonic() - self.started)
+
+
+class BackfillManager:
+    """
+    Replays a project's existing submissions into EventStream.
+
+    The requested ``_submission_time`` range is split into windows that are
+    fetched in parallel by a bounded worker pool. Each window walks its
+    submissions in ``_id`` order and goes through the same send path as live
+    streaming (duplicate filter, transform, send, WebhookLog rows). The last
+    ``_id`` of every window is persisted after each page, so a paused or
+    interrupted job resumes where it stopped. Windows are not re-polled, so a
+    submission that fails to send goes to the dead-letter store at once.
+    """
+
+    def __init__(self, kobo_client, max_concurrency: int = 4):
+        self.kobo_client = kobo_client
+        self.max_concurrency = max_concurrency
+        self._runs: Dict[int, BackfillRun] = {}
+        self._lock = threading.Lock()
+
+    # ------------------------
+    # Public API
+    # ------------------------
+    def create_job(
+        self,
+        user_id: int,
+        server_url: str,
+        api_token: str,
+        project_uid: str,
+        range_start: Optional[str] = None,
+        range_end: Optional[str] = None,
+        window_count: int = 16,
+    ) -> BackfillJob:
+        """Plan a backfill; missing bounds default to the project's first/last submission."""
+        if not range_start or not range_end:
+            first, last = self._submission_time_bounds(server_url, api_token, project_uid)
+            range_start = range_start or first
+            range_end = range_end or last
+
+        if range_start and range_end:
+            start = parse_submission_time(range_start)
+            end = parse_range_end(range_end)
+            if end <= start:
+                raise ValueError("Backfill range end is before its start")
+            windows = split_time_range(start, end, window_count)
+        else:
+            windows = []  # project has no submissions yet
+
+        job = BackfillJob(
+            user_id=user_id,
+            server_url=server_url,
+            project_uid=project_uid,
+            range_start=range_start,
+            range_end=range_end,
+            status="pending" if windows else "completed",
+            windows=windows,
+            submissions_fetched=0,
+            submissions_sent=0,
+            duplicates_skipped=0,
+            bytes_fetched=0,
+            elapsed_seconds=0.0,
+        )
+        self.kobo_client.db_session.add(job)
+        self.kobo_client.db_session.commit()
+        logger.info(f"Planned backfill {job.id} for {project_uid}: {len(windows)} window(s) {range_start} -> {range_end}")
+        return job
+
+    def start_job(self, job_id: int, eventstream_client, api_token: str, page_size: int = 500) -> Tuple[bool, str]:
+        """Start (or resume) a job in a background thread."""
+        job = self.kobo_client.db_session.get(BackfillJob, job_id)
+        if not job:
+            return False, f"Backfill job {job_id} not found"
+        if job.status == "completed":
+            return False, f"Backfill job {job_id} is already completed"
+
+        with self._lock:
+            existing = self._runs.get(job_id)
+            if existing and existing.thread and existing.thread.is_alive():
+                return False, f"Backfill job {job_id} is already running"
+
+            run = BackfillRun(
+                job_id=job.id,
+                user_id=job.user_id,
+                server_url=job.server_url,
+                api_token=api_token,
+                project_uid=job.project_uid,
+                eventstream_client=eventstream_client,
+                windows=copy.deepcopy(job.windows or []),
+                page_size=page_size,
+                fetched=job.submissions_fetched or 0,
+                sent=job.submissions_sent or 0,
+                duplicates=job.duplicates_skipped or 0,
+                bytes_fetched=job.bytes_fetched or 0,
+                base_elapsed=job.elapsed_seconds or 0.0,
+            )
+            run.thread = threading.Thread(target=self._run, args=(run,), name=f"kobo-backfill-{job.id}", daemon=True)
+            self._runs[job_id] = run
+
+        job.status = "running"
+        job.error_message = None
+        self.kobo_client.db_session.commit()
+        run.thread.start()
+
+        remaining = sum(1 for w in run.windows if not w["done"])
+        return True, f"Backfill job {job_id} started ({remaining} window(s) remaining)"
+
+    def pause_job(self, job_id: int) -> Tuple[bool, str]:
+        """Stop a running job after the pages in flight; it can be resumed later."""
+        run = self._runs.get(job_id)
+        if not run or not run.active:
+            return False, f"Backfill job {job_id} is not running"
+        run.active = False
+        for stream in list(run.streams):
+            stream.active = False
+        return True, f"Backfill job {job_id} is pausing"
+
+    def get_status(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Progress and throughput of a job (live figures when it runs in this process)."""
+        job = self.kobo_client.db_session.get(BackfillJob, job_id)
+        if not job:
+            return None
+
+        run = self._runs.get(job_id)
+        if run is not None and run.thread is not None and run.thread.is_alive():
+            with run.lock:
+                windows = copy.deepcopy(run.windows)
+                fetched, sent, duplicates, bytes_fetched = run.fetched, run.sent, run.duplicates, run.bytes_fetched
+            elapsed = run.elapsed
+        else:
+            windows = job.windows or []
+            fetched = job.submissions_fetched or 0
+            sent = job.submissions_sent or 0
+            duplicates = job.duplicates_skipped or 0
+            bytes_fetched = job.bytes_fetched or 0
+            elapsed = job.elapsed_seconds or 0.0
+
+        return {
+            "job_id": job.id,
+            "project_uid": job.project_uid,
+            "status": job.status,
+            "range_start": job.range_start,
+            "range_end": job.range_end,
+            "windows_total": len(windows),
+            "windows_done": sum(1 for w in windows if w["done"]),
+            "submissions_fetched": fetched,
+            "submissions_sent": sent,
+            "duplicates_skipped": duplicates,
+            "bytes_fetched": bytes_fetched,
+            "elapsed_seconds": round(elapsed, 1),
+            "submissions_per_second": round(fetched / elapsed, 2) if elapsed > 0 else 0,
+            "bytes_per_second": round(bytes_fetched / elapsed, 1) if elapsed > 0 else 0,
+            "error_message": job.error_message,
+            "windows": windows,
+        }
+
+    # ------------------------
+    # Internals
+    # ------------------------
+    def _submission_time_bounds(self, server_url: str, api_token: str, project_uid: str) -> Tuple[Optional[str], Optional[str]]:
+        """Earliest and latest ``_submission_time`` of a project (None when it is empty)."""
+        url = f"{server_url.rstrip('/')}/assets/{project_uid}/data/"
+        headers = {"Authorization": f"Token {api_token}"}
+        bounds = []
+        for direction in (1, -1):
+            params = {
+                "format": "json",
+                "limit": 1,
+                "sort": json.dumps({"_submission_time": direction}),
+                "fields": json.dumps(["_submission_time"]),
+            }
+            response = self.kobo_client._request("GET", url, headers=headers, params=params)
+            if response.status_code != 200:
+                raise Exception(
+                    f"Failed to read submission range (status {response.status_code}): {response.text[:200]}"
+                )
+            results = response.json().get("results", [])
+            bounds.append(results[0].get("_submission_time") if results else None)
+        return bounds[0], bounds[1]
+
+    def _run(self, run: BackfillRun):
+        pending = [i for i, window in enumerate(run.windows) if not window["done"]]
+        logger.info(f"Backfill {run.job_id}: {len(pending)} window(s) across {self.max_concurrency} worker(s)")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="kobo-backfill") as pool:
+            futures = [pool.submit(self._run_window, run, index) for index in pending]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    run.error = run.error or str(e)
+                    logger.error(f"Backfill {run.job_id} window failed: {str(e)}")
+
+        if run.error:
+            status = "failed"
+        elif all(window["done"] for window in run.windows):
+            status = "completed"
+        else:
+            status = "paused"
+        run.active = False
+
+        with self.kobo_client._app_context():
+            self._save_progress(run, status=status)
+        logger.info(
+            f"Backfill {run.job_id} {status}: {run.fetched} fetched, {run.sent} sent in {run.elapsed:.1f}s"
+        )
+
+    def _run_window(self, run: BackfillRun, index: int):
+        """Drain one ``_submission_time`` window through the regular send path."""
+        window = run.windows[index]
+        # Windows are half-open; jobs planned before that kept an inclusive last window
+        upper = "$lte" if window.get("inclusive_end") else "$lt"
+        query = {"_submission_time": {"$gte": window["start"], upper: window["end"]}}
+
+        stream = ProjectStream(
+            project_uid=run.project_uid,
+            user_id=run.user_id,
+            server_url=run.server_url,
+            api_token=run.api_token,
+            eventstream_client=run.eventstream_client,
+            batch_size=run.page_size,
+            # A window is never polled again: dead-letter failed sends straight away
+            max_delivery_attempts=1,
+        )
+        stream.last_submission_id = window["last_id"]
+        with run.lock:
+            run.streams.append(stream)
+        if not run.active:
+            return
+
+        sizes: List[int] = []
+        with self.kobo_client._app_context():
+            try:
+                for submissions in self.kobo_client._iter_submission_pages(
+                    run.server_url, run.api_token, run.project_uid, run.page_size,
+                    after_id=stream.last_submission_id, query=query, sizes=sizes,
+                ):
+                    if not run.active:
+                        break
+                    duplicates_before = stream.duplicates_skipped
+                    sent = self.kobo_client._stream_submission_batch(submissions, stream)
+
+                    with run.lock:
+                        window["last_id"] = stream.last_submission_id
+                        window["fetched"] += len(submissions)
+                        run.fetched += len(submissions)
+                        run.sent += sent
+                        run.duplicates += stream.duplicates_skipped - duplicates_before
+                        run.bytes_fetched += sizes[-1] if sizes else 0
+                    self._save_progress(run)
+                    if stream.mark_held:
+                        # A failure that could not be dead-lettered: keep the window
+                        # open so a resume retries it from window["last_id"]
+                        raise Exception(
+                            f"Window {window['start']} -> {window['end']} stopped after _id={window['last_id']}: "
+                            f"a submission could not be delivered or dead-lettered"
+                        )
+                else:
+                    if run.active:
+                        with run.lock:
+                            window["done"] = True
+                        self._save_progress(run)
+            except Exception:
+                self.kobo_client.db_session.rollback()
+                raise
+            finally:
+                with run.lock:
+                    run.streams.remove(stream)
+
+    def _save_progress(self, run: BackfillRun, status: Optional[str] = None):
+        """Persist window cursors and counters (caller is inside an app context)."""
+        with run.save_lock:
+            job = self.kobo_client.db_session.get(BackfillJob, run.job_id)
+            if not job:
+                return
+            with run.lock:
+                job.windows = copy.deepcopy(run.windows)  # new object so the JSON change is detected
+                job.submissions_fetched = run.fetched
+                job.submissions_sent = run.sent
+                job.duplicates_skipped = run.duplicates
+                job.bytes_fetched = run.bytes_fetched
+            job.elapsed_seconds = run.elapsed
+            if status:
+                job.status = status
+                job.error_message = run.error
+            self.kobo_client.db_session.commit()
@@ -1,6 +1,6 @@
 import os
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,6 +12,7 @@ class EventStreamConfig:
     max_retries: int = 3
     retry_delay: float = 1.0
     timeout: int = 30
+    partition_key_field: Optional[str] = None  # e.g. "_xform_id_string"; None = round-robin
     
     @classmethod
     def from_db_or_session(cls, config_source) -> 'EventStreamConfig':
@@ -29,6 +30,7 @@ class EventStreamConfig:
                 max_retries = int(config_source.get("max_retries", 3))
                 retry_delay = float(config_source.get("retry_delay", 1.0))
                 timeout = int(config_source.get("timeout", 30))
+                partition_key_field = config_source.get("partition_key_field") or None
 
             else:  # Assume SQLAlchemy model
                 endpoint = config_source.endpoint
@@ -38,6 +40,7 @@ class EventStreamConfig:
                 max_retries = config_source.max_retries or 3
                 retry_delay = config_source.retry_delay or 1.0
                 timeout = config_source.timeout or 30
+                partition_key_field = getattr(config_source, "partition_key_field", None) or None
 
             if not all([endpoint, sharedaccesskeyname, sharedaccesskey, entitypath]):
                 raise ValueError("Missing one or more required EventStream config fields msg@config")
@@ -54,6 +57,7 @@ class EventStreamConfig:
                 max_retries=max_retries,
                 retry_delay=retry_delay,
                 timeout=timeout,
+                partition_key_field=partition_key_field,
             )
 
         except Exception as e:
@@ -77,9 +81,200 @@ class WebhookConfig:
             max_payload_size=int(os.getenv("MAX_PAYLOAD_SIZE", str(10 * 1024 * 1024)))
         )
 
+@dataclass
+class EventBatchConfig:
+    """Configuration for batching events sent to EventStream."""
+    max_events: int = 500  # flush once a batch holds this many events
+    linger_ms: float = 50.0  # how long the first event of a batch may wait for company
+
+    @classmethod
+    def from_env(cls) -> 'EventBatchConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            max_events=int(os.getenv("EVENTSTREAM_BATCH_MAX_EVENTS", "500")),
+            linger_ms=float(os.getenv("EVENTSTREAM_BATCH_LINGER_MS", "50")),
+        )
+
+@dataclass
+class EventCompressionConfig:
+    """Configuration for compressing EventStream event bodies."""
+    codec: str = "none"  # none, gzip or zstd (needs the zstandard package)
+    threshold_bytes: int = 1024  # smaller bodies are sent uncompressed
+    level: Optional[int] = None  # codec default when unset
+
+    @classmethod
+    def from_env(cls) -> 'EventCompressionConfig':
+        """Create configuration from environment variables."""
+        level = os.getenv("EVENTSTREAM_COMPRESSION_LEVEL")
+        return cls(
+            codec=os.getenv("EVENTSTREAM_COMPRESSION", "none").lower(),
+            threshold_bytes=int(os.getenv("EVENTSTREAM_COMPRESSION_THRESHOLD", "1024")),
+            level=int(level) if level else None,
+        )
+
+@dataclass
+class ProducerPoolConfig:
+    """Configuration for the shared EventHub producer pool."""
+    idle_ttl_seconds: float = 300.0  # close producers unused for this long
+    keepalive_seconds: float = 60.0  # how often idle-but-live producers are pinged
+
+    @classmethod
+    def from_env(cls) -> 'ProducerPoolConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            idle_ttl_seconds=float(os.getenv("EVENTSTREAM_PRODUCER_IDLE_TTL", "300")),
+            keepalive_seconds=float(os.getenv("EVENTSTREAM_PRODUCER_KEEPALIVE", "60")),
+        )
+
+@dataclass
+class WebhookOutboxConfig:
+    """Configuration for the durable outbox between /kobo-webhook and EventStream."""
+    enabled: bool = True
+    path: str = "webhook_outbox.db"  # SQLite file (WAL mode) shared by every worker; relative to the app's instance folder
+    drainers: int = 2
+    batch_size: int = 200
+    claim_seconds: float = 60.0  # renewed while a send is in flight; a dead drainer's rows come back after this
+    max_backoff_seconds: float = 300.0
+    max_attempts: int = 10  # then the payload moves to the dead-letter store
+
+    @classmethod
+    def from_env(cls) -> 'WebhookOutboxConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            enabled=os.getenv("WEBHOOK_OUTBOX", "true").lower() == "true",
+            path=os.getenv("WEBHOOK_OUTBOX_PATH", "webhook_outbox.db"),
+            drainers=int(os.getenv("WEBHOOK_OUTBOX_DRAINERS", "2")),
+            batch_size=int(os.getenv("WEBHOOK_OUTBOX_BATCH_SIZE", "200")),
+            claim_seconds=float(os.getenv("WEBHOOK_OUTBOX_CLAIM_SECONDS", "60")),
+            max_backoff_seconds=float(os.getenv("WEBHOOK_OUTBOX_MAX_BACKOFF", "300")),
+            max_attempts=int(os.getenv("WEBHOOK_OUTBOX_MAX_ATTEMPTS", "10")),
+        )
+
+@dataclass
+class LogWriterConfig:
+    """Configuration for the group-commit writer of WebhookLog/EventStreamMetrics rows."""
+    max_batch: int = 200  # records per transaction
+    max_latency_ms: int = 50  # longest a record waits for its batch to fill
+
+    @classmethod
+    def from_env(cls) -> 'LogWriterConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            max_batch=int(os.getenv("LOG_WRITER_MAX_BATCH", "200")),
+            max_latency_ms=int(os.getenv("LOG_WRITER_MAX_LATENCY_MS", "50")),
+        )
+
+@dataclass
+class HealthSnapshotConfig:
+    """Configuration for persisting the in-memory EventStream health snapshots."""
+    persist_interval_seconds: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> 'HealthSnapshotConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            persist_interval_seconds=float(os.getenv("HEALTH_PERSIST_SECONDS", "30")),
+        )
+
+@dataclass
+class KoboHttpConfig:
+    """Configuration for the pooled KoboToolbox HTTP session and its rate limits."""
+    pool_connections: int = 10  # number of hosts kept in the pool
+    pool_maxsize: int = 20  # keep-alive connections per host
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    rate_limit_per_second: float = 5.0  # per server and API token
+    rate_limit_burst: int = 10
+    max_throttle_retries: int = 2  # retries of a 429 after its Retry-After
+    max_rate_wait: float = 60.0  # longer waits fail the request instead of blocking a worker
+    breaker_failures: int = 5
+    breaker_recovery_seconds: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> 'KoboHttpConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            pool_connections=int(os.getenv("KOBO_HTTP_POOL_CONNECTIONS", "10")),
+            pool_maxsize=int(os.getenv("KOBO_HTTP_POOL_MAXSIZE", "20")),
+            connect_timeout=float(os.getenv("KOBO_HTTP_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("KOBO_HTTP_READ_TIMEOUT", "30")),
+            rate_limit_per_second=float(os.getenv("KOBO_RATE_LIMIT", "5")),
+            rate_limit_burst=int(os.getenv("KOBO_RATE_BURST", "10")),
+            max_throttle_retries=int(os.getenv("KOBO_MAX_THROTTLE_RETRIES", "2")),
+            max_rate_wait=float(os.getenv("KOBO_MAX_RATE_WAIT", "60")),
+            breaker_failures=int(os.getenv("KOBO_BREAKER_FAILURES", "5")),
+            breaker_recovery_seconds=float(os.getenv("KOBO_BREAKER_RECOVERY", "60")),
+        )
+
+@dataclass
+class StreamWorkerConfig:
+    """Configuration for the standalone streaming worker (``python -m stream_worker``)."""
+    user_id: Optional[int] = None  # owner of the WebhookLog/checkpoint rows
+    server_url: Optional[str] = None  # KoboToolbox base URL, e.g. https://kf.kobotoolbox.org
+    api_token: Optional[str] = None
+    project_ids: List[str] = field(default_factory=list)
+    eventstream_connection_string: Optional[str] = None  # default: the user's saved config
+    eventstream_partition_key_field: Optional[str] = None
+    engine: str = "threaded"
+
+    @classmethod
+    def from_env(cls) -> 'StreamWorkerConfig':
+        """Create configuration from environment variables."""
+        user_id = os.getenv("KOBO_WORKER_USER_ID")
+        return cls(
+            user_id=int(user_id) if user_id else None,
+            server_url=os.getenv("KOBO_SERVER_URL"),
+            api_token=os.getenv("KOBO_API_TOKEN"),
+            project_ids=[uid.strip() for uid in os.getenv("KOBO_PROJECT_IDS", "").split(",") if uid.strip()],
+            eventstream_connection_string=os.getenv("EVENTSTREAM_CONNECTION_STRING"),
+            eventstream_partition_key_field=os.getenv("EVENTSTREAM_PARTITION_KEY_FIELD") or None,
+            engine=os.getenv("KOBO_STREAMING_ENGINE", "threaded").lower(),
+        )
+
+    @property
+    def api_url(self) -> str:
+        """Base of the v2 API, as the web app builds it from the session."""
+        base = (self.server_url or "").rstrip("/")
+        return base if base.endswith("/api/v2") else f"{base}/api/v2"
+
+@dataclass
+class StreamLeaseConfig:
+    """Configuration for coordinating project streams across processes."""
+    enabled: bool = True
+    ttl_seconds: float = 15.0  # a lease not renewed for this long can be taken over
+    heartbeat_seconds: float = 5.0
+    stop_margin_seconds: float = 1.0  # an owner that cannot renew stops this long before others may take over
+
+    @classmethod
+    def from_env(cls) -> 'StreamLeaseConfig':
+        """Create configuration from environment variables."""
+        return cls(
+            enabled=os.getenv("KOBO_STREAM_LEASES", "true").lower() == "true",
+            ttl_seconds=float(os.getenv("KOBO_LEASE_TTL", "15")),
+            heartbeat_seconds=float(os.getenv("KOBO_LEASE_HEARTBEAT", "5")),
+            stop_margin_seconds=float(os.getenv("KOBO_LEASE_STOP_MARGIN", "1")),
+        )
+
+    @property
+    def local_ttl_seconds(self) -> float:
+        """
+        How long after a renewal attempt started the owner may keep streaming
+        without another one: it only checks once per heartbeat, so it must
+        stop a heartbeat (plus a margin) before the database lease expires.
+        """
+        return self.ttl_seconds - self.heartbeat_seconds - self.stop_margin_seconds
+
 # Global configuration instances
 #eventstream_config = EventStreamConfig.from_db_or_session()
 webhook_config = WebhookConfig.from_env()
+kobo_http_config = KoboHttpConfig.from_env()
+event_batch_config = EventBatchConfig.from_env()
+producer_pool_config = ProducerPoolConfig.from_env()
+event_compression_config = EventCompressionConfig.from_env()
+webhook_outbox_config = WebhookOutboxConfig.from_env()
+log_writer_config = LogWriterConfig.from_env()
+health_snapshot_config = HealthSnapshotConfig.from_env()
+stream_lease_config = StreamLeaseConfig.from_env()
 
 
 
@@ -16,6 +16,11 @@ class ConfigurationService:
     def __init__(self):
         self._encryption_key = self._get_or_create_encryption_key()
         self._cipher = Fernet(self._encryption_key)
+        self._session = None  # set by bind_session() outside the Flask app
+    
+    def bind_session(self, session) -> None:
+        """Read settings through ``session`` (e.g. a WorkerRuntime session) instead of db.session."""
+        self._session = session
     
     def _get_or_create_encryption_key(self) -> bytes:
         """Get or create encryption key for sensitive data."""
@@ -28,6 +33,18 @@ class ConfigurationService:
         logger.info("Generated new encryption key for configuration")
         return key
     
+    def encrypt(self, value: str) -> str:
+        """Encrypt a value with the configuration key (shared by all processes via CONFIG_ENCRYPTION_KEY)."""
+        return self._cipher.encrypt(value.encode()).decode()
+    
+    def decrypt(self, value: str) -> str:
+        return self._cipher.decrypt(value.encode()).decode()
+    
+    @property
+    def has_shared_key(self) -> bool:
+        """False when the key was generated by this process and other processes cannot decrypt."""
+        return bool(os.getenv('CONFIG_ENCRYPTION_KEY'))
+    
     def set_setting(self, name: str, value: str, encrypted: bool = True) -> bool:
         """Store a configuration setting."""
         try:
@@ -61,7 +78,8 @@ class ConfigurationService:
     def get_setting(self, name: str, default: Optional[str] = None) -> Optional[str]:
         """Retrieve a configuration setting."""
         try:
-            setting = AppConfiguration.query.filter_by(setting_name=name).first()
+            query = self._session.query(AppConfiguration) if self._session is not None else AppConfiguration.query
+            setting = query.filter_by(setting_name=name).first()
             
             if not setting:
                 return default
@@ -139,6 +157,7 @@ class ConfigurationService:
                         "max_retries": user_cfg.max_retries,
                         "retry_delay": user_cfg.retry_delay,
                         "timeout": user_cfg.timeout,
+                        "partition_key_field": user_cfg.partition_key_field,
                     })
                 except Exception as e:
                     logger.error(f"Invalid DB EventStream config for user {current_user.id}: {e}")
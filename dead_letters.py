@@ -0,0 +1,238 @@
+import logging
+import threading
+import zlib
+from concurrent.futures import wait
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import kobo_http_config
+from models import DeadLetter, DeadLetterReplay, db
+from serialized_event import SerializedEvent, loads
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterStore:
+    """
+    Payloads that still failed after every retry, kept for replay.
+
+    Bodies are stored zlib-compressed with the failure reason, attempt count
+    and first/last failure times. ``replay()`` pushes a selection back
+    through an ``EventStreamClient``'s batching producer with at most
+    ``concurrency`` events in flight; by default as many as the Kobo rate
+    limiter's burst (``KOBO_RATE_BURST``).
+
+    Every dead letter belongs to one user: a webhook payload to the user
+    whose EventStream config received it. Rows without an owner are listed
+    to nobody.
+    """
+
+    def __init__(self, replay_chunk_size: int = 1000, replay_concurrency: int = kobo_http_config.rate_limit_burst):
+        self.replay_chunk_size = replay_chunk_size
+        self.replay_concurrency = max(1, replay_concurrency)
+
+    @classmethod
+    def add(cls, session, event: SerializedEvent, error: Any, source: str, attempts: int = 1,
+            first_failed_at: Optional[datetime] = None, **fields) -> DeadLetter:
+        """Record a failed payload (``fields``: user_id, webhook_log_id, project_uid); caller commits."""
+        letter = cls.build(event, error, source, attempts, first_failed_at, **fields)
+        session.add(letter)
+        return letter
+
+    @staticmethod
+    def build(event: SerializedEvent, error: Any, source: str, attempts: int = 1,
+              first_failed_at: Optional[datetime] = None, **fields) -> DeadLetter:
+        """A dead letter not yet added to any session (e.g. for the group-commit log writer)."""
+        payload = event.payload if isinstance(event.payload, dict) else {}
+        now = datetime.utcnow()
+        return DeadLetter(
+            source=source,
+            kobo_form_id=fields.pop("kobo_form_id", None) or payload.get("_xform_id_string"),
+            submission_uuid=fields.pop("submission_uuid", None) or payload.get("_uuid"),
+            payload=zlib.compress(event.body),
+            payload_size=event.size,
+            error_type=type(error).__name__ if isinstance(error, BaseException) else "EventStreamError",
+            error_message=str(error)[:1000] if error else None,
+            attempts=attempts,
+            first_failed_at=first_failed_at or now,
+            last_failed_at=now,
+            **fields,
+        )
+
+    @staticmethod
+    def load(letter: DeadLetter) -> SerializedEvent:
+        body = zlib.decompress(letter.payload)
+        return SerializedEvent(loads(body), body)
+
+    @staticmethod
+    def query(session, user_id: Optional[int] = None, form_id: Optional[str] = None,
+              error_type: Optional[str] = None, status: Optional[str] = "pending",
+              ids: Optional[List[int]] = None):
+        """Dead letters of a user (all of them without ``user_id``), oldest first."""
+        query = session.query(DeadLetter)
+        if user_id is not None:
+            query = query.filter(DeadLetter.user_id == user_id)
+        if form_id:
+            query = query.filter(DeadLetter.kobo_form_id == form_id)
+        if error_type:
+            query = query.filter(DeadLetter.error_type == error_type)
+        if status:
+            query = query.filter(DeadLetter.status == status)
+        if ids:
+            query = query.filter(DeadLetter.id.in_(ids))
+        return query.order_by(DeadLetter.id)
+
+    def replay(self, session, eventstream_client, concurrency: Optional[int] = None, limit: Optional[int] = None,
+               on_chunk: Optional[Callable[[int, int], None]] = None, **filters) -> Dict[str, Any]:
+        """
+        Re-send pending dead letters matching ``filters`` (see ``query``).
+
+        Works through them in chunks, committing each chunk's outcome, so
+        a replay of tens of thousands of events keeps memory bounded.
+        ``on_chunk(replayed, failed)`` is called with the running totals
+        before each chunk is committed.
+        """
+        started = datetime.utcnow()
+        replayed = failed = 0
+        last_id = 0
+        in_flight = threading.BoundedSemaphore(max(1, concurrency or self.replay_concurrency))
+
+        while limit is None or replayed + failed < limit:
+            chunk_size = self.replay_chunk_size if limit is None else min(self.replay_chunk_size, limit - replayed - failed)
+            letters = self.query(session, **filters).filter(DeadLetter.id > last_id).limit(chunk_size).all()
+            if not letters:
+                break
+            last_id = letters[-1].id
+
+            sends = []
+            for letter in letters:
+                in_flight.acquire()
+                try:
+                    future = eventstream_client.submit(self.load(letter))
+                except Exception as e:
+                    in_flight.release()
+                    sends.append((letter, e))
+                    continue
+                future.add_done_callback(lambda _: in_flight.release())
+                sends.append((letter, future))
+            wait([f for _, f in sends if not isinstance(f, Exception)])
+
+            now = datetime.utcnow()
+            for letter, future in sends:
+                error = future if isinstance(future, Exception) else future.exception()
+                if error is None:
+                    letter.status = "replayed"
+                    letter.replayed_at = now
+                    replayed += 1
+                else:
+                    letter.attempts = (letter.attempts or 0) + 1
+                    letter.last_failed_at = now
+                    letter.error_type = type(error).__name__
+                    letter.error_message = str(error)[:1000]
+                    failed += 1
+            if on_chunk is not None:
+                on_chunk(replayed, failed)
+            session.commit()
+
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        logger.info(f"Dead-letter replay: {replayed} delivered, {failed} failed in {elapsed:.1f}s")
+        return {"replayed": replayed, "failed": failed, "elapsed_seconds": round(elapsed, 2)}
+
+
+class DeadLetterReplayManager:
+    """
+    Runs bulk replays in a background thread, tracked as DeadLetterReplay rows.
+
+    The HTTP request only records the job and returns its id; progress is
+    written to the row after every chunk, so any worker can report it.
+    """
+
+    def __init__(self, app, store: Optional[DeadLetterStore] = None):
+        self.app = app
+        self.store = store or dead_letter_store
+        self._threads: Dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def start_job(self, user_id: int, eventstream_client, concurrency: Optional[int] = None,
+                  limit: Optional[int] = None, **filters) -> Tuple[Optional[DeadLetterReplay], str]:
+        """Record a replay and start it; one replay runs at a time in a process."""
+        concurrency = concurrency or self.store.replay_concurrency
+        with self._lock:
+            running = [job_id for job_id, thread in self._threads.items() if thread.is_alive()]
+            if running:
+                return None, f"Dead-letter replay {running[0]} is already running"
+
+            job = DeadLetterReplay(
+                user_id=user_id,
+                filters={**filters, "limit": limit, "concurrency": concurrency},
+                status="running",
+                replayed=0,
+                failed=0,
+                elapsed_seconds=0.0,
+            )
+            db.session.add(job)
+            db.session.commit()
+
+            thread = threading.Thread(
+                target=self._run,
+                args=(job.id, user_id, eventstream_client, concurrency, limit, filters),
+                name=f"dead-letter-replay-{job.id}",
+                daemon=True,
+            )
+            self._threads = {job_id: t for job_id, t in self._threads.items() if t.is_alive()}
+            self._threads[job.id] = thread
+        thread.start()
+        return job, f"Dead-letter replay {job.id} started"
+
+    @staticmethod
+    def get_status(job: DeadLetterReplay) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "filters": job.filters,
+            "replayed": job.replayed or 0,
+            "failed": job.failed or 0,
+            "elapsed_seconds": round(job.elapsed_seconds or 0.0, 2),
+            "error_message": job.error_message,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        }
+
+    def _run(self, job_id: int, user_id: int, eventstream_client, concurrency: int, limit: Optional[int],
+             filters: Dict[str, Any]):
+        started = datetime.utcnow()
+        with self.app.app_context():
+            job = db.session.get(DeadLetterReplay, job_id)
+
+            def progress(replayed: int, failed: int):
+                # Committed together with the chunk's dead-letter updates
+                job.replayed = replayed
+                job.failed = failed
+                job.elapsed_seconds = (datetime.utcnow() - started).total_seconds()
+
+            try:
+                result = self.store.replay(
+                    db.session, eventstream_client, concurrency=concurrency, limit=limit,
+                    on_chunk=progress, user_id=user_id, **filters,
+                )
+                job.replayed = result["replayed"]
+                job.failed = result["failed"]
+                job.status = "completed"
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Dead-letter replay {job_id} failed: {str(e)}")
+                job = db.session.get(DeadLetterReplay, job_id)
+                job.status = "failed"
+                job.error_message = str(e)[:1000]
+            finally:
+                job.elapsed_seconds = (datetime.utcnow() - started).total_seconds()
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to save dead-letter replay {job_id}: {str(e)}")
+                eventstream_client.shutdown()
+
+
+# Global store instance
+dead_letter_store = DeadLetterStore()
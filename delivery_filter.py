@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on blake2b)."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value: str):
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class DeliveredFilter:
+    """
+    Memory-bounded "already delivered" set of submission ``_uuid`` values.
+
+    Recent ids live in an exact LRU. Older ids fall back to two rotating
+    Bloom filter generations: when the current one reaches capacity it
+    becomes the previous one and the oldest generation is discarded, so
+    memory stays fixed. A Bloom hit outside the LRU may be a false positive;
+    when a ``confirm`` callback is given it decides, otherwise the id is
+    treated as delivered.
+    """
+
+    def __init__(self, lru_size: int = 100_000, bloom_capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.lru_size = lru_size
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._current = BloomFilter(bloom_capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+        self.seeded = False
+
+        self.checked = 0
+        self.duplicates = 0
+        self.confirmations = 0
+        self.false_positives = 0
+        self.rotations = 0
+
+    def add(self, uuid: Optional[str]):
+        """Record a submission as delivered."""
+        if not uuid:
+            return
+        with self._lock:
+            self._add_locked(uuid)
+
+    def seed(self, uuids: Iterable[str]) -> int:
+        """Bulk-load previously delivered ids (oldest first, so the newest stay in the LRU)."""
+        added = 0
+        with self._lock:
+            for uuid in uuids:
+                if uuid:
+                    self._add_locked(uuid)
+                    added += 1
+            self.seeded = True
+        return added
+
+    def is_delivered(self, uuid: Optional[str], confirm: Optional[Callable[[str], bool]] = None) -> bool:
+        """True if ``uuid`` was already delivered; counts duplicates."""
+        if not uuid:
+            return False
+
+        with self._lock:
+            self.checked += 1
+            if uuid in self._recent:
+                self._recent.move_to_end(uuid)
+                self.duplicates += 1
+                return True
+            maybe = uuid in self._current or (self._previous is not None and uuid in self._previous)
+
+        if not maybe:
+            return False
+
+        if confirm is not None:
+            self.confirmations += 1
+            if not confirm(uuid):
+                self.false_positives += 1
+                return False
+
+        with self._lock:
+            self.duplicates += 1
+            self._remember_locked(uuid)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "duplicates_suppressed": self.duplicates,
+            "bloom_confirmations": self.confirmations,
+            "bloom_false_positives": self.false_positives,
+            "recent_ids": len(self._recent),
+            "bloom_generation_fill": self._current.count,
+            "bloom_capacity": self.bloom_capacity,
+            "bloom_rotations": self.rotations,
+            "seeded": self.seeded,
+        }
+
+    # ------------------------
+    # Internals (caller holds the lock)
+    # ------------------------
+    def _add_locked(self, uuid: str):
+        self._remember_locked(uuid)
+        if self._current.count >= self.bloom_capacity:
+            self._previous = self._current
+            self._current = BloomFilter(self.bloom_capacity, self.error_rate)
+            self.rotations += 1
+        self._current.add(uuid)
+
+    def _remember_locked(self, uuid: str):
+        self._recent[uuid] = None
+        self._recent.move_to_end(uuid)
+        while len(self._recent) > self.lru_size:
+            self._recent.popitem(last=False)
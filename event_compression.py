@@ -0,0 +1,100 @@
+import gzip
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional dependency: pip install .[compression] (zstandard)
+    zstandard = None
+
+from config import EventCompressionConfig, event_compression_config
+
+logger = logging.getLogger(__name__)
+
+# Application property naming the codec of a compressed event body
+CONTENT_ENCODING = "content_encoding"
+
+
+class EventCompressor:
+    """
+    Compresses event bodies above a size threshold.
+
+    Compressed events carry a ``content_encoding`` application property
+    (``gzip`` or ``zstd``); smaller bodies, and bodies that would not shrink,
+    are sent as plain JSON. Consumers use ``decode_event_body``.
+    """
+
+    def __init__(self, compression_config: EventCompressionConfig = event_compression_config):
+        codec = (compression_config.codec or "none").lower()
+        if codec == "zstd" and zstandard is None:
+            logger.warning("EVENTSTREAM_COMPRESSION=zstd needs the 'zstandard' package; falling back to gzip")
+            codec = "gzip"
+        self.codec = codec if codec in ("gzip", "zstd") else None
+        self.threshold = compression_config.threshold_bytes
+        self.level = compression_config.level
+        self._local = threading.local()  # zstd compressors are not thread-safe
+        self._lock = threading.Lock()
+        self.events_compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, body: bytes) -> Tuple[bytes, Optional[str]]:
+        """``(body, encoding)``; encoding is None when the body is sent as is."""
+        if self.codec is None or len(body) < self.threshold:
+            return body, None
+        if self.codec == "zstd":
+            compressed = self._zstd().compress(body)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.level or 6)
+        if len(compressed) >= len(body):
+            return body, None
+        with self._lock:
+            self.events_compressed += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+        return compressed, self.codec
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "codec": self.codec or "none",
+            "threshold_bytes": self.threshold,
+            "events_compressed": self.events_compressed,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "compression_ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+        }
+
+    def _zstd(self):
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level or 3)
+        return compressor
+
+
+def decode_event_body(body: bytes, properties: Optional[Dict[Any, Any]] = None) -> bytes:
+    """Undo ``EventCompressor`` for a received event (properties may have bytes keys/values)."""
+    encoding = None
+    for key, value in (properties or {}).items():
+        if (key.decode() if isinstance(key, bytes) else key) == CONTENT_ENCODING:
+            encoding = value.decode() if isinstance(value, bytes) else value
+    if not encoding:
+        return body
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Event is zstd-compressed; install the 'zstandard' package to decode it")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    raise ValueError(f"Unknown event content encoding: {encoding}")
+
+
+def decode_event(event_data) -> Dict[str, Any]:
+    """JSON payload of a received ``EventData``."""
+    body = event_data.body
+    raw = bytes(body) if isinstance(body, (bytes, bytearray)) else b"".join(body)
+    return json.loads(decode_event_body(raw, event_data.properties))
+
+
+# Global compressor instance
+event_compressor = EventCompressor()
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from azure.eventhub import EventData
+from azure.eventhub.aio import EventHubProducerClient as AsyncEventHubProducerClient
+
+from config import EventBatchConfig, EventStreamConfig, event_batch_config
+from event_compression import event_compressor
+from eventstream_client import PartitionCounters, build_event_data, resolve_partition_key
+from health_snapshot import health_registry
+from log_writer import log_writer
+from models import EventStreamMetrics
+from retry_handler import CircuitBreaker
+from serialized_event import SerializedEvent
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEventStreamClient:
+    """
+    asyncio variant of ``EventStreamClient`` built on the aio producer.
+
+    ``send()`` queues an event and returns once the batch carrying it has
+    been sent, so callers that gather many sends share batches. Batches are
+    filled up to ``max_events`` (or until ``create_batch()`` is full) or for
+    ``linger_ms``, and up to ``max_in_flight`` of them are sent concurrently
+    over the single AMQP connection. Metrics and the health snapshot are
+    recorded inline on the loop after each batch; both only hand the record
+    to a background writer, so no database I/O runs on the loop. Metrics
+    rows are kept only for a client created with a ``user_id``. Events are
+    grouped by partition key (see ``EventStreamConfig.partition_key_field``)
+    and each key's batches are sent in order.
+
+    An instance belongs to the event loop it is first used on.
+    """
+
+    def __init__(self, config: Optional[EventStreamConfig], app=None,
+                 batch_config: EventBatchConfig = event_batch_config, max_in_flight: int = 8,
+                 user_id: Optional[int] = None):
+        self.config = config
+        self.app = app
+        self.user_id = user_id
+        if app is not None and log_writer.app is None:
+            log_writer.init_app(app)
+        self.health = health_registry.get("eventstream_async", user_id)
+        self.max_events = max(1, batch_config.max_events)
+        self.linger = max(0.0, batch_config.linger_ms) / 1000
+        self.max_in_flight = max_in_flight
+        self.producer: Optional[AsyncEventHubProducerClient] = None
+        self.connection_status = 'unknown'
+        self.last_successful_send = None
+        self.circuit_breaker = CircuitBreaker()
+        self._pending: List[Tuple[Optional[str], EventData, asyncio.Future]] = []
+        self._partition_locks: Dict[Optional[str], asyncio.Lock] = {}
+        self._in_flight: Set[asyncio.Task] = set()
+        self._linger_task: Optional[asyncio.Task] = None
+        self._send_slots: Optional[asyncio.Semaphore] = None
+        self._closed = False
+        self.batches_sent = 0
+        self.events_sent = 0
+        self.events_failed = 0
+        self.partitions = PartitionCounters()
+
+    async def send(self, payload: Union[Dict[str, Any], SerializedEvent]) -> bool:
+        """Send one payload as part of a shared batch; raises the send error on failure."""
+        if self._closed:
+            raise Exception("Client is shutting down")
+        future = asyncio.get_running_loop().create_future()
+        event = SerializedEvent.of(payload)
+        partition_key = resolve_partition_key(event.payload, self.config.partition_key_field if self.config else None)
+        self._pending.append((partition_key, build_event_data(event), future))
+        if len(self._pending) >= self.max_events:
+            self._dispatch()
+        elif self._linger_task is None:
+            self._linger_task = asyncio.create_task(self._linger())
+        return await future
+
+    async def send_many(self, payloads: List[Union[Dict[str, Any], SerializedEvent]]) -> List[Any]:
+        """Send payloads concurrently; each result is ``True`` or the exception for that payload."""
+        return await asyncio.gather(*(self.send(payload) for payload in payloads), return_exceptions=True)
+
+    async def flush(self):
+        """Send whatever is queued and wait for every batch in flight."""
+        self._dispatch()
+        if self._in_flight:
+            await asyncio.gather(*list(self._in_flight), return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+        self._closed = True
+        if self.producer is not None:
+            try:
+                await self.producer.close()
+            except Exception as e:
+                logger.warning(f"Error while closing async producer: {e}")
+            finally:
+                self.producer = None
+        self.connection_status = "shutdown"
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connection_status": self.connection_status,
+            "last_successful_send": self.last_successful_send.isoformat() if self.last_successful_send else None,
+            "queued": len(self._pending),
+            "batches_in_flight": len(self._in_flight),
+            "batches_sent": self.batches_sent,
+            "events_sent": self.events_sent,
+            "events_failed": self.events_failed,
+            "circuit_breaker_state": self.circuit_breaker.state,
+            "partitions": self.partitions.get_stats(),
+            "compression": event_compressor.get_stats(),
+        }
+
+    # ------------------------
+    # Batching
+    # ------------------------
+    async def _linger(self):
+        await asyncio.sleep(self.linger)
+        self._linger_task = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand the queued events to a send task; several can be in flight at once."""
+        if self._linger_task is not None:
+            self._linger_task.cancel()
+            self._linger_task = None
+        items, self._pending = self._pending, []
+        groups: Dict[Optional[str], List[Tuple[EventData, asyncio.Future]]] = {}
+        for partition_key, event_data, future in items:
+            groups.setdefault(partition_key, []).append((event_data, future))
+        for partition_key, group in groups.items():
+            task = asyncio.create_task(self._send_items(partition_key, group))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send_items(self, partition_key: Optional[str], items: List[Tuple[EventData, asyncio.Future]]):
+        if self._send_slots is None:
+            self._send_slots = asyncio.Semaphore(self.max_in_flight)
+        # One key's batches go out one after another so the partition keeps submission order
+        lock = self._partition_locks.setdefault(partition_key, asyncio.Lock())
+        async with lock, self._send_slots:
+            try:
+                producer = await self._ensure_producer()
+                batch = await self._create_batch(producer, partition_key)
+                members: List[asyncio.Future] = []
+                for event_data, future in items:
+                    try:
+                        batch.add(event_data)
+                    except ValueError:
+                        if members:
+                            await self._send_batch(partition_key, batch, members)
+                        batch = await self._create_batch(producer, partition_key)
+                        members = []
+                        try:
+                            batch.add(event_data)
+                        except ValueError:
+                            self.events_failed += 1
+                            if not future.done():
+                                future.set_exception(ValueError("Event is larger than the maximum EventHub batch size"))
+                            continue
+                    members.append(future)
+                if members:
+                    await self._send_batch(partition_key, batch, members)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    @staticmethod
+    async def _create_batch(producer: AsyncEventHubProducerClient, partition_key: Optional[str]):
+        if partition_key is not None:
+            return await producer.create_batch(partition_key=partition_key)
+        return await producer.create_batch()
+
+    async def _send_batch(self, partition_key: Optional[str], batch, futures: List[asyncio.Future]):
+        """Send one batch with the configured retries and resolve its callers."""
+        retries = self.config.max_retries if self.config else 0
+        delay = self.config.retry_delay if self.config else 1.0
+        start = time.perf_counter()
+        error: Optional[Exception] = None
+
+        for attempt in range(retries + 1):
+            if not self.circuit_breaker.allow_request():
+                error = Exception(f"Circuit breaker OPEN. Last failure: {self.circuit_breaker.last_failure_time}")
+                break
+            try:
+                producer = await self._ensure_producer()
+                await producer.send_batch(batch)
+                self.circuit_breaker.record_success()
+                error = None
+                break
+            except Exception as e:
+                self.circuit_breaker.record_failure()
+                error = e
+                if attempt < retries:
+                    logger.warning(f"Async EventStream batch send failed on attempt {attempt + 1}/{retries + 1}: {str(e)}")
+                    await asyncio.sleep(delay * (2 ** attempt))
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.partitions.record(partition_key, len(futures), elapsed_ms, failed=error is not None)
+        if error is None:
+            self.batches_sent += 1
+            self.events_sent += len(futures)
+            self.last_successful_send = datetime.utcnow()
+            self.connection_status = 'healthy'
+            for future in futures:
+                if not future.done():
+                    future.set_result(True)
+        else:
+            self.events_failed += len(futures)
+            self.connection_status = 'error'
+            logger.error(f"Failed to send batch of {len(futures)} events to EventStream: {str(error)}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+        self._record_metrics(len(futures), elapsed_ms, error)
+
+    async def _ensure_producer(self) -> AsyncEventHubProducerClient:
+        if self.producer is None:
+            if not self.config:
+                self.connection_status = "not_configured"
+                raise Exception("No EventStream configuration provided")
+            self.producer = AsyncEventHubProducerClient.from_connection_string(
+                conn_str=self.config.connection_string
+            )
+            self.connection_status = 'connected'
+        return self.producer
+
+    # ------------------------
+    # Metrics (queued for the group-commit writer)
+    # ------------------------
+    def _record_metrics(self, event_count: int, elapsed_ms: float, error: Optional[Exception]):
+        self.health.record(self.connection_status, error is None, {"batch_events": event_count},
+                           str(error)[:1000] if error else None)
+        # Metrics rows belong to a user; a client shared across users (the hub-wide one) keeps none
+        if self.app is None or self.user_id is None:
+            return
+        try:
+            log_writer.write(EventStreamMetrics(
+                user_id=self.user_id,
+                success=error is None,
+                transmission_time_ms=elapsed_ms,
+                payload_preview={"batch_events": event_count},
+                error_type=type(error).__name__ if error else None,
+                error_message=str(error)[:1000] if error else None,
+            ))
+        except Exception as log_error:
+            logger.error(f"Failed to queue EventStream metrics: {str(log_error)}")
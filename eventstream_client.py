@@ -1,46 +1,290 @@
 import json
 import logging
 import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
 from datetime import datetime
-from typing import Dict, Any, Optional
-from azure.eventhub import EventHubProducerClient, EventData
-from azure.eventhub.exceptions import EventHubError
+from typing import Deque, Dict, Any, List, Optional, Tuple, Union
+from azure.eventhub import EventData
+from azure.eventhub.exceptions import AuthenticationError, ClientClosedError, EventHubError
+from config import EventBatchConfig, event_batch_config
 from config_service import EventStreamConfig
-from sqlalchemy.exc import IntegrityError
+from event_compression import CONTENT_ENCODING, event_compressor
+from health_snapshot import health_registry
+from log_writer import log_writer
+from producer_pool import producer_pool
+from serialized_event import SerializedEvent
 
 from retry_handler import default_retry_handler, eventstream_circuit_breaker
-from models import EventStreamMetrics, SystemHealth
+from models import EventStreamMetrics
 from extensions import db
 
 logger = logging.getLogger(__name__)
 
 
+def build_event_data(payload: Union[Dict[str, Any], SerializedEvent]) -> EventData:
+    """Wrap a payload in an EventData with the standard KoboBridge properties."""
+    body, encoding = event_compressor.compress(SerializedEvent.of(payload).body)
+    event_data = EventData(body)
+    event_data.properties = {
+        'source': 'kobodata',
+        'timestamp': datetime.utcnow().isoformat(),
+        'content_type': 'application/json'
+    }
+    if encoding:
+        event_data.properties[CONTENT_ENCODING] = encoding
+    return event_data
+
+
+def resolve_partition_key(payload: Dict[str, Any], field: Optional[str]) -> Optional[str]:
+    """
+    Partition key for a payload: the value of ``field``, or None (round-robin).
+
+    Kobo keys group questions with ``/`` (``group/question``), so the field
+    is looked up as a top-level key first and otherwise followed as a dotted
+    path into nested objects.
+    """
+    if not field:
+        return None
+    value = payload.get(field)
+    if value is None and "." in field:
+        value = payload
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+    return None if value is None or value == "" else str(value)
+
+
+class PartitionCounters:
+    """Thread-safe per-partition-key send counters."""
+
+    UNKEYED = "(round-robin)"
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, partition_key: Optional[str], events: int, elapsed_ms: float, failed: bool = False):
+        with self._lock:
+            counters = self._counters.setdefault(partition_key or self.UNKEYED, {
+                "batches_sent": 0, "events_sent": 0, "events_failed": 0, "send_time_ms": 0.0,
+            })
+            if failed:
+                counters["events_failed"] += events
+            else:
+                counters["batches_sent"] += 1
+                counters["events_sent"] += events
+                counters["send_time_ms"] += elapsed_ms
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                key: {
+                    "batches_sent": c["batches_sent"],
+                    "events_sent": c["events_sent"],
+                    "events_failed": c["events_failed"],
+                    "events_per_second": round(c["events_sent"] / (c["send_time_ms"] / 1000), 1)
+                    if c["send_time_ms"] else 0,
+                }
+                for key, c in self._counters.items()
+            }
+
+
+class BatchingProducer:
+    """
+    Coalesces events from many callers into shared EventHub batches.
+
+    ``submit()`` queues an event and returns a ``Future`` that resolves to
+    ``True`` once the batch carrying it was sent, or to the send error. A
+    background thread fills a batch until ``create_batch()`` reports it is
+    full or it holds ``max_events`` events, waiting at most ``linger_ms``
+    after the first queued event before sending what it has.
+
+    With a ``partition_key_field`` configured, events are grouped by key so
+    each form (or other key) lands on one partition in submission order.
+    The groups are sent one after another: the SDK sends every batch of a
+    producer over the same link under one lock, so sending them from
+    several threads would not overlap the sends.
+    """
+
+    def __init__(self, client: 'EventStreamClient', batch_config: EventBatchConfig = event_batch_config):
+        self.client = client
+        self.max_events = max(1, batch_config.max_events)
+        self.linger = max(0.0, batch_config.linger_ms) / 1000
+        self._pending: Deque[Tuple[Optional[str], EventData, Future]] = deque()
+        self._in_flight: List[Future] = []
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.batches_sent = 0
+        self.events_sent = 0
+        self.events_failed = 0
+        self.send_time_ms = 0.0
+        self.partitions = PartitionCounters()
+
+    def submit(self, payload: Union[Dict[str, Any], SerializedEvent]) -> Future:
+        """Queue a payload; the future resolves when its batch has been sent."""
+        future: Future = Future()
+        event = SerializedEvent.of(payload)
+        event_data = build_event_data(event)
+        config = self.client.config
+        partition_key = resolve_partition_key(event.payload, config.partition_key_field if config else None)
+        with self._cond:
+            if self._closed:
+                raise Exception("Batching producer is closed")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="eventstream-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append((partition_key, event_data, future))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_events:
+                self._cond.notify()
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything queued so far now; True once all of it has been resolved."""
+        with self._cond:
+            futures = [future for _, _, future in self._pending] + self._in_flight
+            self._flush_requested = True
+            self._cond.notify()
+        if not futures:
+            return True
+        _, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def close(self, timeout: Optional[float] = None):
+        """Flush queued events and stop the sender thread."""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._pending),
+            "batches_sent": self.batches_sent,
+            "events_sent": self.events_sent,
+            "events_failed": self.events_failed,
+            "avg_batch_size": round(self.events_sent / self.batches_sent, 1) if self.batches_sent else 0,
+            "avg_send_time_ms": round(self.send_time_ms / self.batches_sent, 2) if self.batches_sent else 0,
+            "partitions": self.partitions.get_stats(),
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Linger so concurrent callers can share the batch
+                deadline = time.monotonic() + self.linger
+                while len(self._pending) < self.max_events and not self._flush_requested and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                items = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_events))]
+                if not self._pending:
+                    self._flush_requested = False
+                self._in_flight = [future for _, _, future in items]
+            try:
+                self._send_grouped(items)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._in_flight = []
+
+    def _send_grouped(self, items: List[Tuple[Optional[str], EventData, Future]]):
+        """Send each partition key's events in order, one key after another."""
+        groups: Dict[Optional[str], List[Tuple[EventData, Future]]] = {}
+        for partition_key, event_data, future in items:
+            groups.setdefault(partition_key, []).append((event_data, future))
+        for partition_key, group in groups.items():
+            try:
+                self._send(partition_key, group)
+            except Exception as e:
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _send(self, partition_key: Optional[str], items: List[Tuple[EventData, Future]]):
+        """Pack items into as few batches as the size limit allows and send them in order."""
+        batch = None
+        members: List[Future] = []
+        for event_data, future in items:
+            if not future.set_running_or_notify_cancel():
+                continue
+            if batch is None:
+                batch = self.client._create_event_batch(partition_key)
+            try:
+                batch.add(event_data)
+            except ValueError:
+                if members:
+                    self._send_batch(partition_key, batch, members)
+                batch = self.client._create_event_batch(partition_key)
+                members = []
+                try:
+                    batch.add(event_data)
+                except ValueError:
+                    self.events_failed += 1
+                    future.set_exception(ValueError("Event is larger than the maximum EventHub batch size"))
+                    continue
+            members.append(future)
+        if members:
+            self._send_batch(partition_key, batch, members)
+
+    def _send_batch(self, partition_key: Optional[str], batch, futures: List[Future]):
+        start = time.perf_counter()
+        try:
+            self.client._send_event_batch(batch)
+        except Exception as e:
+            self.events_failed += len(futures)
+            self.partitions.record(partition_key, len(futures), 0.0, failed=True)
+            for future in futures:
+                future.set_exception(e)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.partitions.record(partition_key, len(futures), elapsed_ms)
+        self.send_time_ms += elapsed_ms
+        self.batches_sent += 1
+        self.events_sent += len(futures)
+        for future in futures:
+            future.set_result(True)
+
+
 class EventStreamClient:
-    def __init__(self, app=None, config: EventStreamConfig | None = None):
+    def __init__(self, app=None, config: EventStreamConfig | None = None, user_id: Optional[int] = None):
         self.producer = None
         self.connection_status = 'unknown'
         self.last_successful_send = None
         self.config = config
+        self.user_id = user_id  # whose config this is; owns the webhook logs and dead letters it sends
         self._lock = threading.Lock()  # thread safety
         self._shutdown = False
         self.app = app
+        if app is not None and log_writer.app is None:
+            log_writer.init_app(app)
+        self._batcher: Optional[BatchingProducer] = None
+        self.health = health_registry.get("eventstream", user_id)
         logger.info("EventStreamClient initialized with config snapshot")
 
     def _initialize_producer(self):
-        """Initialize EventHub producer client with stored config."""
-        if self.producer:
-            return  # already initialized
+        """Take the hub's producer from the shared pool (also marks it as in use)."""
         try:
             if not self.config:
                 logger.warning("No EventStream configuration provided")
                 self.connection_status = "not_configured"
                 return
 
-            self.producer = EventHubProducerClient.from_connection_string(
-                conn_str=self.config.connection_string
-            )
-            self.connection_status = 'connected'
-            logger.info("EventStream producer client initialized successfully")
+            self.producer = producer_pool.acquire(self.config)
+            if self.connection_status in ('unknown', 'not_configured', 'failed'):
+                self.connection_status = 'connected'
         except Exception as e:
             self.connection_status = 'failed'
             logger.error(f"Failed to initialize EventStream producer: {str(e)}")
@@ -50,17 +294,29 @@ class EventStreamClient:
         with self._lock:
             if self._shutdown:
                 raise Exception("Client is shutting down")
-            if not self.producer:
-                self._initialize_producer()
+            self._initialize_producer()
+
+    def _on_send_error(self, error: Exception):
+        """
+        Keep the pooled producer across transient errors (the SDK reconnects
+        its link); only a closed or unauthorized producer is dropped.
+        """
+        if isinstance(error, (ClientClosedError, AuthenticationError)):
+            with self._lock:
+                if self.producer is not None and self.config:
+                    producer_pool.discard(self.config, self.producer)
+                self.producer = None
 
     #@default_retry_handler.retry_with_backoff("EventStream send")
     @default_retry_handler.retry_with_backoff("EventStream send")
     def send_to_eventstream(
         self,
-        payload: Dict[str, Any],
+        payload: Union[Dict[str, Any], SerializedEvent],
         webhook_log_id: Optional[int] = None
     ) -> bool:
         """Send payload to EventStream with retry logic and monitoring."""
+        event = SerializedEvent.of(payload)
+        payload = event.payload
 
         # Abort immediately if shutdown is in progress
         if getattr(self, "_shutdown", False):
@@ -80,7 +336,7 @@ class EventStreamClient:
 
         try:
             # Use circuit breaker for additional protection
-            eventstream_circuit_breaker.call(self._send_single_event, payload)
+            eventstream_circuit_breaker.call(self._send_single_event, event)
 
             # Reset breaker after success
             eventstream_circuit_breaker.reset()
@@ -92,8 +348,7 @@ class EventStreamClient:
             self.last_successful_send = end_time
             self.connection_status = 'healthy'
 
-            payload_size = len(json.dumps(payload, default=str))
-            logger.info(f"Successfully sent payload to EventStream. Size: {payload_size} bytes")
+            logger.info(f"Successfully sent payload to EventStream. Size: {event.size} bytes")
             logger.debug(f"[SEND] attempt {attempt_number} for webhook_log_id={webhook_log_id}")
 
             return True
@@ -113,77 +368,32 @@ class EventStreamClient:
             self.connection_status = 'error'
             logger.error(f"Failed to send payload to EventStream: {str(e)}")
 
-            # try reconnect if producer is broken
-            with self._lock:
-                #self.producer = None
-                if self.producer:
-                    try:
-                        self.producer.close()
-                    except Exception as e:
-                        logger.warning(f"Error while closing producer: {e}")
-                    finally:
-                        self.producer = None
-
+            self._on_send_error(e)
             raise
 
         finally:
+            # In-memory only; the health registry persists it in the background
+            self.health.record(self.connection_status, bool(metrics.success), metrics.payload_preview,
+                               metrics.error_message, webhook_log_id)
             if self.app:
-                with self.app.app_context():
-                    try:
-                        # --- Save metrics history ---
-                        existing = None
-                        if webhook_log_id:
-                            existing = EventStreamMetrics.query.filter_by(
-                                webhook_log_id=webhook_log_id
-                            ).first()
-
-                        if existing:
-                            existing.success = metrics.success
-                            existing.error_type = metrics.error_type
-                            existing.error_message = metrics.error_message
-                            existing.transmission_time_ms = metrics.transmission_time_ms
-                            existing.payload_preview = metrics.payload_preview
-                        else:
-                            db.session.add(metrics)
-
-                        # --- Update rolling system health snapshot ---
-                        health = SystemHealth.query.order_by(SystemHealth.timestamp.desc()).first()
-                        if not health:
-                            health = SystemHealth()
-                            db.session.add(health)
-
-                        health.eventstream_connection_status = self.connection_status
-                        health.last_webhook_log_id = webhook_log_id
-                        health.last_payload_preview = metrics.payload_preview
-                        health.last_error_message = metrics.error_message
-                        health.last_attempt_time = datetime.utcnow()
-                        if metrics.success:
-                            health.last_successful_transmission = self.last_successful_send
-
-                        db.session.commit()
-
-                    except IntegrityError:
-                        db.session.rollback()
-                        logger.warning(f"Duplicate metrics for webhook_log_id={webhook_log_id}, skipped insert")
-                    except Exception as db_error:
-                        db.session.rollback()
-                        logger.error(f"Failed to save EventStream metrics/SystemHealth: {str(db_error)}")
-
-
-    def _send_single_event(self, payload: Dict[str, Any]):
+                # Queued for the group-commit writer: no lookup or commit on the send path
+                try:
+                    log_writer.write(metrics)
+                except Exception as log_error:
+                    logger.error(f"Failed to queue EventStream metrics: {str(log_error)}")
+
+    def _send_single_event(self, event: SerializedEvent):
         """Send single event to EventHub (internal method)."""
         if not self.producer:
             raise Exception("EventHub producer not initialized")
 
         try:
-            event_data = EventData(json.dumps(payload, default=str))
-            event_data.properties = {
-                'source': 'kobodata',
-                'timestamp': datetime.utcnow().isoformat(),
-                'content_type': 'application/json'
-            }
+            payload = event.payload
+            event_data = build_event_data(event)
 
-            event_batch = self.producer.create_batch()
+            event_batch = self._create_event_batch(
+                resolve_partition_key(payload, self.config.partition_key_field if self.config else None)
+            )
             event_batch.add(event_data)
             self.producer.send_batch(event_batch)
 
@@ -196,6 +406,54 @@ class EventStreamClient:
             logger.error(f"Unexpected error sending event: {str(e)}")
             raise
 
+    def submit(self, payload: Union[Dict[str, Any], SerializedEvent]) -> Future:
+        """
+        Queue a payload on the client's batching producer.
+
+        Returns a future that resolves to ``True`` once the payload's batch
+        is sent or raises the send error. Unlike ``send_to_eventstream`` no
+        metrics row is written; callers record the outcome themselves.
+        """
+        if self._shutdown:
+            raise Exception("Client is shutting down")
+        with self._lock:
+            if self._batcher is None:
+                self._batcher = BatchingProducer(self)
+            batcher = self._batcher
+        return batcher.submit(payload)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send every queued payload now."""
+        return self._batcher.flush(timeout) if self._batcher else True
+
+    def get_batch_stats(self) -> Dict[str, Any]:
+        return self._batcher.get_stats() if self._batcher else {}
+
+    def _create_event_batch(self, partition_key: Optional[str] = None):
+        self._ensure_producer()
+        if not self.producer:
+            raise Exception("EventHub producer not initialized")
+        if partition_key is not None:
+            return self.producer.create_batch(partition_key=partition_key)
+        return self.producer.create_batch()
+
+    @default_retry_handler.retry_with_backoff("EventStream batch send")
+    def _send_event_batch(self, batch):
+        """Send a filled batch through the circuit breaker (internal method)."""
+        self._ensure_producer()
+        if not self.producer:
+            raise Exception("EventHub producer not initialized")
+        try:
+            eventstream_circuit_breaker.call(self.producer.send_batch, batch)
+            self.last_successful_send = datetime.utcnow()
+            self.connection_status = "healthy"
+            logger.debug(f"Sent batch of {len(batch)} events to EventStream")
+        except Exception as e:
+            self.connection_status = 'error'
+            logger.error(f"Failed to send batch to EventStream: {str(e)}")
+            self._on_send_error(e)
+            raise
+
     def _create_payload_preview(self, payload: Dict[str, Any], max_fields: int = 5) -> Dict[str, Any]:
         """Create a preview of the payload for storage (first few fields only)."""
         preview = {}
@@ -248,6 +506,8 @@ class EventStreamClient:
             "producer_initialized": self.producer is not None,
             "circuit_breaker_state": eventstream_circuit_breaker.state,
             "circuit_breaker_failures": eventstream_circuit_breaker.failure_count,
+            "producer_pool": producer_pool.get_stats(),
+            "compression": event_compressor.get_stats(),
         }
 
         try:
@@ -302,36 +562,31 @@ class EventStreamClient:
 
 
     def shutdown(self):
-        """Cleanly stop retries and close the producer."""
+        """Cleanly stop retries and release the producer (the pool closes it once idle)."""
         logger.info("Shutting down EventStream client...")
+        if self._batcher is not None:
+            self._batcher.close(timeout=self.config.timeout if self.config else None)
         print("Print self.producer:",self.producer)
         with self._lock:
             self._shutdown = True
 
             print("Print self.producer:",self.producer)
             
-            if self.producer is None:
-                logger.debug("No active producer to close")
-            else:
-                try:
-                    self.producer.close()
-                    logger.info("EventStream producer closed cleanly")
-                except Exception as e:
-                    logger.warning(f"Error closing EventStream producer: {e}")
-                finally:
-                    self.producer = None
+            # The producer is shared with other clients on the same hub
+            self.producer = None
 
             self.connection_status = "shutdown"
 
 _eventstream_client = None
 
 
-def get_eventstream_client(config: EventStreamConfig | None = None) -> EventStreamClient:
+def get_eventstream_client(config: EventStreamConfig | None = None, user_id: Optional[int] = None) -> EventStreamClient:
     global _eventstream_client
     if _eventstream_client is None:
-        _eventstream_client = EventStreamClient(config=config)
+        _eventstream_client = EventStreamClient(config=config, user_id=user_id)
     elif config:
-        # if config changed, re-init producer
+        _eventstream_client.user_id = user_id
+        # if config changed, pick up the new hub's pooled producer
         if _eventstream_client.config != config:
             _eventstream_client.config = config
             with _eventstream_client._lock:
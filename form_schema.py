@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# XLSForm question types and the cast applied to their values
+NUMERIC_TYPES = {"integer": "integer", "decimal": "decimal", "range": "decimal"}
+DATE_TYPES = {"date": "date", "datetime": "datetime", "dateTime": "datetime", "start": "datetime", "end": "datetime"}
+GEOPOINT_SUFFIXES = ("latitude", "longitude", "altitude", "accuracy")
+
+GROUP_STARTS = {"begin_group", "begin group", "begin_repeat", "begin repeat"}
+GROUP_ENDS = {"end_group", "end group", "end_repeat", "end repeat"}
+
+
+def _cast_integer(value):
+    return int(value)
+
+
+def _cast_decimal(value):
+    return float(value)
+
+
+def _cast_date(value):
+    return date.fromisoformat(str(value)[:10]).isoformat()
+
+
+def _cast_datetime(value):
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).isoformat()
+
+
+CASTS: Dict[str, Callable[[Any], Any]] = {
+    "integer": _cast_integer,
+    "decimal": _cast_decimal,
+    "date": _cast_date,
+    "datetime": _cast_datetime,
+}
+
+
+class FormTransformer:
+    """
+    Submission transformer compiled from one version of a form.
+
+    The form's questions are resolved once into a ``{xpath: (flat_name, kind)}``
+    table, so transforming a submission is a single dict lookup per key:
+    ``group/question`` keys are flattened to ``question`` (or to
+    ``group_question`` when the short name is ambiguous), numbers and dates
+    are cast, and geopoints are split into ``<name>_latitude``/``_longitude``/
+    ``_altitude``/``_accuracy``. Values that fail to cast are passed through
+    unchanged.
+    """
+
+    def __init__(self, version_id: Optional[str], fields: Dict[str, Tuple[str, Optional[str]]]):
+        self.version_id = version_id
+        self.fields = fields
+
+    @classmethod
+    def compile(cls, content: Dict[str, Any], version_id: Optional[str] = None) -> 'FormTransformer':
+        """Build the lookup table from an asset's ``content.survey``."""
+        questions: List[Tuple[str, str, Optional[str]]] = []  # (xpath, short name, kind)
+        path: List[str] = []
+
+        for row in content.get("survey", []):
+            row_type = str(row.get("type", "")).strip()
+            name = row.get("name") or row.get("$autoname")
+            if row_type in GROUP_STARTS:
+                if name and "repeat" in row_type:
+                    # Repeats appear in submissions as a list under their own xpath
+                    questions.append((row.get("$xpath") or "/".join([p for p in path if p] + [name]), name, None))
+                path.append(name or "")
+                continue
+            if row_type in GROUP_ENDS:
+                if path:
+                    path.pop()
+                continue
+            if not name:
+                continue
+
+            base_type = row_type.split(" ")[0]
+            kind = NUMERIC_TYPES.get(base_type) or DATE_TYPES.get(base_type)
+            if base_type == "geopoint":
+                kind = "geopoint"
+            xpath = row.get("$xpath") or "/".join([p for p in path if p] + [name])
+            questions.append((xpath, name, kind))
+
+        short_names: Dict[str, int] = {}
+        for _, name, _ in questions:
+            short_names[name] = short_names.get(name, 0) + 1
+
+        fields = {}
+        for xpath, name, kind in questions:
+            flat_name = name if short_names[name] == 1 else xpath.replace("/", "_")
+            fields[xpath] = (flat_name, kind)
+        return cls(version_id, fields)
+
+    def apply(self, submission: Dict[str, Any]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for key, value in submission.items():
+            spec = self.fields.get(key)
+            if spec is None:
+                flat_name, kind = (key.replace("/", "_") if "/" in key else key), None
+            else:
+                flat_name, kind = spec
+
+            if isinstance(value, list) and value and isinstance(value[0], dict):
+                # Repeat group: each entry carries full xpaths of its own
+                out[flat_name] = [self.apply(entry) for entry in value]
+            elif kind == "geopoint":
+                out.update(self._split_geopoint(flat_name, value))
+            elif kind is not None and value not in (None, ""):
+                try:
+                    out[flat_name] = CASTS[kind](value)
+                except (TypeError, ValueError):
+                    out[flat_name] = value
+            else:
+                out[flat_name] = value
+        return out
+
+    @staticmethod
+    def _split_geopoint(name: str, value: Any) -> Dict[str, Any]:
+        try:
+            parts = [float(part) for part in str(value).split()]
+        except ValueError:
+            return {name: value}
+        if not parts:
+            return {name: value}
+        return {f"{name}_{suffix}": part for suffix, part in zip(GEOPOINT_SUFFIXES, parts)}
+
+
+@dataclass
+class CachedForm:
+    """Compiled transformers of one asset, by form version."""
+    deployed_version_id: Optional[str] = None
+    transformers: Dict[Optional[str], FormTransformer] = field(default_factory=dict)
+    fetched_at: float = 0.0
+    failed_at: Optional[float] = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class FormSchemaCache:
+    """
+    Per-asset cache of compiled form transformers.
+
+    Submissions name their form version in ``__version__``. A version that
+    has not been seen yet triggers one fetch of ``/assets/{uid}/`` (which
+    yields the current ``deployed_version_id``); older versions are fetched
+    from ``/assets/{uid}/versions/{id}/`` and fall back to the deployed form
+    when that is unavailable. Each version is compiled exactly once.
+    """
+
+    def __init__(self, request_fn: Callable[..., Any], ttl_seconds: float = 600.0, retry_seconds: float = 60.0):
+        self.request_fn = request_fn
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._forms: Dict[Tuple[str, str], CachedForm] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.compiles = 0
+        self.fetch_errors = 0
+
+    def get_transformer(
+        self, server_url: str, api_token: str, project_uid: str, version_id: Optional[str] = None
+    ) -> Optional[FormTransformer]:
+        """Transformer for a submission's form version; None if the form cannot be loaded."""
+        key = (server_url.rstrip("/"), project_uid)
+        with self._lock:
+            form = self._forms.setdefault(key, CachedForm())
+
+        transformer = self._lookup(form, version_id)
+        if transformer is not None:
+            self.hits += 1
+            return transformer
+
+        with form.lock:
+            # Another thread may have loaded it while we waited
+            transformer = self._lookup(form, version_id)
+            if transformer is not None:
+                return transformer
+            if form.failed_at is not None and time.monotonic() - form.failed_at < self.retry_seconds:
+                return form.transformers.get(form.deployed_version_id)
+
+            try:
+                self._load(form, key[0], api_token, project_uid, version_id)
+                form.failed_at = None
+            except Exception as e:
+                form.failed_at = time.monotonic()
+                self.fetch_errors += 1
+                logger.warning(f"Could not load form definition of {project_uid}: {str(e)}")
+            return form.transformers.get(version_id) or form.transformers.get(form.deployed_version_id)
+
+    def warm(self, server_url: str, api_token: str, project_uid: str, submissions: List[Dict[str, Any]]):
+        """Load every form version used by ``submissions`` (call before a non-blocking send loop)."""
+        for version_id in {s.get("__version__") for s in submissions}:
+            self.get_transformer(server_url, api_token, project_uid, version_id)
+
+    def invalidate(self, project_uid: Optional[str] = None):
+        with self._lock:
+            for key in [k for k in self._forms if project_uid is None or k[1] == project_uid]:
+                del self._forms[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "forms": len(self._forms),
+            "versions_compiled": self.compiles,
+            "hits": self.hits,
+            "fetch_errors": self.fetch_errors,
+        }
+
+    # ------------------------
+    # Internals
+    # ------------------------
+    def _lookup(self, form: CachedForm, version_id: Optional[str]) -> Optional[FormTransformer]:
+        if version_id is not None:
+            return form.transformers.get(version_id)
+        # No __version__: use the deployed form while it is fresh
+        if time.monotonic() - form.fetched_at < self.ttl_seconds:
+            return form.transformers.get(form.deployed_version_id)
+        return None
+
+    def _load(self, form: CachedForm, server_url: str, api_token: str, project_uid: str, version_id: Optional[str]):
+        headers = {"Authorization": f"Token {api_token}"}
+        asset = self._get_json(f"{server_url}/assets/{project_uid}/", headers)
+        deployed = asset.get("deployed_version_id") or asset.get("version_id")
+        form.deployed_version_id = deployed
+        form.fetched_at = time.monotonic()
+        if deployed not in form.transformers:
+            form.transformers[deployed] = self._compile(asset.get("content") or {}, deployed, project_uid)
+
+        if version_id is None or version_id in form.transformers:
+            return
+        try:
+            version = self._get_json(f"{server_url}/assets/{project_uid}/versions/{version_id}/", headers)
+            form.transformers[version_id] = self._compile(version.get("content") or {}, version_id, project_uid)
+        except Exception as e:
+            # Old version not retrievable: its questions rarely differ from the deployed form
+            logger.debug(f"Using deployed form for {project_uid} version {version_id}: {str(e)}")
+            form.transformers[version_id] = form.transformers[deployed]
+
+    def _get_json(self, url: str, headers: Dict[str, str]) -> Dict[str, Any]:
+        response = self.request_fn("GET", url, headers=headers, params={"format": "json"})
+        if response.status_code != 200:
+            raise Exception(f"status {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def _compile(self, content: Dict[str, Any], version_id: Optional[str], project_uid: str) -> FormTransformer:
+        transformer = FormTransformer.compile(content, version_id)
+        self.compiles += 1
+        logger.info(f"Compiled transformer for {project_uid} version {version_id} ({len(transformer.fields)} fields)")
+        return transformer
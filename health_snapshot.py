@@ -0,0 +1,210 @@
+import atexit
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from config import HealthSnapshotConfig, health_snapshot_config
+from models import SystemHealth, db
+
+logger = logging.getLogger(__name__)
+
+
+class HealthSnapshot:
+    """
+    Latest EventStream connection state of one client kind and user.
+
+    Updated by plain attribute assignment on the send path (no lock, no
+    database); a concurrent update may interleave fields, which only ever
+    mixes two equally recent states.
+    """
+
+    __slots__ = (
+        "client", "user_id", "connection_status", "last_webhook_log_id", "last_payload_preview",
+        "last_error_message", "last_attempt_time", "last_successful_transmission", "dirty",
+    )
+
+    def __init__(self, client: str, user_id: Optional[int] = None):
+        self.client = client
+        self.user_id = user_id
+        self.connection_status = "unknown"
+        self.last_webhook_log_id: Optional[int] = None
+        self.last_payload_preview: Optional[Dict[str, Any]] = None
+        self.last_error_message: Optional[str] = None
+        self.last_attempt_time: Optional[datetime] = None
+        self.last_successful_transmission: Optional[datetime] = None
+        self.dirty = False
+
+    def record(self, connection_status: str, success: bool, payload_preview: Optional[Dict[str, Any]] = None,
+               error_message: Optional[str] = None, webhook_log_id: Optional[int] = None):
+        now = datetime.utcnow()
+        self.connection_status = connection_status
+        self.last_webhook_log_id = webhook_log_id
+        self.last_payload_preview = payload_preview
+        self.last_error_message = error_message
+        self.last_attempt_time = now
+        if success:
+            self.last_successful_transmission = now
+        self.dirty = True
+
+    def apply_to(self, health: SystemHealth):
+        health.eventstream_connection_status = self.connection_status
+        health.last_webhook_log_id = self.last_webhook_log_id
+        health.last_payload_preview = self.last_payload_preview
+        health.last_error_message = self.last_error_message
+        health.last_attempt_time = self.last_attempt_time
+        if self.last_successful_transmission:
+            health.last_successful_transmission = self.last_successful_transmission
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "client": self.client,
+            "user_id": self.user_id,
+            "connection_status": self.connection_status,
+            "last_webhook_log_id": self.last_webhook_log_id,
+            "last_payload_preview": self.last_payload_preview,
+            "last_error_message": self.last_error_message,
+            "last_attempt_time": self.last_attempt_time.isoformat() if self.last_attempt_time else None,
+            "last_successful_transmission": (
+                self.last_successful_transmission.isoformat() if self.last_successful_transmission else None
+            ),
+        }
+
+
+class HealthRegistry:
+    """
+    In-memory health snapshots, persisted to SystemHealth in the background.
+
+    ``/health`` and ``/api/stats`` read the snapshots directly; a thread
+    writes the changed ones every ``persist_interval_seconds`` (and once
+    more at shutdown), one SystemHealth row per user, so the send path never
+    touches the database for health.
+    """
+
+    def __init__(self, snapshot_config: HealthSnapshotConfig = health_snapshot_config):
+        self.interval = snapshot_config.persist_interval_seconds
+        self.app = None
+        self.runtime = None
+        self._snapshots: Dict[Tuple[str, Optional[int]], HealthSnapshot] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.persists = 0
+        self.last_persisted_at: Optional[datetime] = None
+
+    def init_app(self, app=None, runtime=None):
+        """Persist through a Flask app's database, or a worker's ``WorkerRuntime``."""
+        if self.app is None and self.runtime is None:
+            atexit.register(self.shutdown)
+        self.app = app
+        self.runtime = runtime
+        self._ensure_persister()
+
+    def get(self, client: str, user_id: Optional[int] = None) -> HealthSnapshot:
+        """The snapshot a client updates for ``user_id`` (created on first use)."""
+        key = (client, user_id)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            snapshot = self._snapshots.setdefault(key, HealthSnapshot(client, user_id))
+            self._ensure_persister()
+        return snapshot
+
+    def get_stats(self, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Snapshots visible to a user (their own and shared clients'); all of them without a user."""
+        snapshots = {
+            f"{client}:{owner}" if owner is not None else client: snapshot.to_dict()
+            for (client, owner), snapshot in list(self._snapshots.items())
+            if user_id is None or owner is None or owner == user_id
+        }
+        return {
+            "snapshots": snapshots,
+            "persist_interval_seconds": self.interval,
+            "last_persisted_at": self.last_persisted_at.isoformat() if self.last_persisted_at else None,
+        }
+
+    def persist(self) -> int:
+        """Write changed snapshots to SystemHealth; returns the number of rows updated."""
+        if self.app is None and self.runtime is None:
+            return 0
+        dirty = [snapshot for snapshot in list(self._snapshots.values()) if snapshot.dirty]
+        if not dirty:
+            return 0
+        for snapshot in dirty:
+            snapshot.dirty = False
+
+        # One row per user: the most recent of that user's clients wins
+        latest: Dict[Optional[int], HealthSnapshot] = {}
+        for snapshot in dirty:
+            current = latest.get(snapshot.user_id)
+            if current is None or (snapshot.last_attempt_time or datetime.min) > (current.last_attempt_time or datetime.min):
+                latest[snapshot.user_id] = snapshot
+
+        per_user = any(owner is not None for _, owner in list(self._snapshots))
+        with self._scope() as session:
+            try:
+                for user_id, snapshot in latest.items():
+                    # system_health rows belong to a user: a shared client only
+                    # updates the latest row while no per-user snapshot exists
+                    if user_id is None and per_user:
+                        continue
+                    query = session.query(SystemHealth)
+                    if user_id is not None:
+                        query = query.filter(SystemHealth.user_id == user_id)
+                    health = query.order_by(SystemHealth.timestamp.desc()).first()
+                    if health is None and user_id is None:
+                        continue
+                    if health is None:
+                        health = SystemHealth(user_id=user_id)
+                        session.add(health)
+                    snapshot.apply_to(health)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                for snapshot in dirty:
+                    snapshot.dirty = True
+                logger.error(f"Failed to persist system health: {str(e)}")
+                return 0
+        self.persists += 1
+        self.last_persisted_at = datetime.utcnow()
+        return len(latest)
+
+    def shutdown(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.persist()
+
+    def _ensure_persister(self):
+        if self.app is None and self.runtime is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="health-persister", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.persist()
+            except Exception as e:
+                logger.error(f"Health persister failed: {str(e)}")
+
+    @contextmanager
+    def _scope(self):
+        """The worker runtime's session scope, or an app context with Flask-SQLAlchemy's session."""
+        if self.runtime is not None:
+            with self.runtime.session_scope() as session:
+                yield session
+        else:
+            with self.app.app_context():
+                yield db.session
+
+
+# Global registry instance
+health_registry = HealthRegistry()
@@ -0,0 +1,344 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency: pip install .[async] (aiohttp)
+    aiohttp = None
+
+from eventstream_async import AsyncEventStreamClient
+from adaptive_polling import AdaptivePollingPolicy
+from kobo_client import DeliveryResult, KoboToolboxClient
+from models import SyncCheckpoint
+from rate_limiter import KoboServerUnavailable
+from serialized_event import SerializedEvent
+from stream_scheduler import ProjectStream, StreamKey, stream_status_map
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncKoboStreamer:
+    """
+    asyncio implementation of the Kobo streaming worker.
+
+    All project streams run as tasks on one event loop (hosted by a single
+    background thread), sharing one aiohttp connection pool and one
+    ``AsyncEventStreamClient`` per hub. Blocking database writes go through the
+    loop's default executor. Exposes the same start/stop/status surface as
+    ``KoboToolboxClient`` so routes can use either engine.
+    """
+
+    def __init__(self, kobo_client: KoboToolboxClient, max_concurrency: int = 100):
+        self.kobo_client = kobo_client
+        self.max_concurrency = max_concurrency
+        self._streams: Dict[StreamKey, ProjectStream] = {}
+        self._tasks: Dict[StreamKey, asyncio.Task] = {}
+        self._eventstream_clients: Dict[str, AsyncEventStreamClient] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._http: Optional["aiohttp.ClientSession"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    # ------------------------
+    # Public API (mirrors KoboToolboxClient)
+    # ------------------------
+    def start_streaming(
+        self, eventstream_client, webhook_handler=None, project_id: Optional[str] = None,
+        config: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[bool, str]:
+        """Schedule a project (default: the session's project) on the event loop."""
+        if aiohttp is None:
+            return False, "The asyncio streaming engine requires the 'aiohttp' package"
+
+        config = config or self.kobo_client.get_api_config()
+        server_url = (config.get("server_url") or "").strip()
+        api_token = (config.get("api_token") or "").strip()
+        project_id = project_id or config.get("project_id")
+
+        if not server_url:
+            return False, "Missing or invalid KoboToolbox server URL"
+        if not api_token:
+            return False, "Missing or invalid KoboToolbox API token"
+        if not project_id:
+            return False, "Missing KoboToolbox project ID"
+        if not getattr(eventstream_client, "config", None):
+            return False, "No EventStream config available"
+
+        existing = self._streams.get((config["user_id"], server_url, project_id))
+        if existing and existing.active:
+            return False, f"Streaming is already active for project {project_id}"
+
+        stream = ProjectStream(
+            project_uid=project_id,
+            user_id=config["user_id"],
+            server_url=server_url,
+            api_token=api_token,
+            eventstream_client=eventstream_client,
+            polling_interval=config.get("polling_interval", 30),
+            batch_size=config.get("batch_size", 50),
+            policy=AdaptivePollingPolicy.from_config(config) if config.get("adaptive_polling") else None,
+            typed_payloads=bool(config.get("typed_payloads")),
+            max_delivery_attempts=int(config.get("max_delivery_attempts", 5)),
+        )
+        self._streams[stream.key] = stream
+        asyncio.run_coroutine_threadsafe(self._start_task(stream), self._ensure_loop()).result(timeout=10)
+
+        logger.info(f"Started asyncio streaming for project {project_id}")
+        return True, f"Real-time streaming started for project {project_id}"
+
+    def stop_streaming(self, project_id: Optional[str] = None, user_id: Optional[int] = None,
+                       server_url: Optional[str] = None) -> Tuple[bool, str]:
+        """Stop one project's stream, or every stream when no project is given (``user_id``'s only when given)."""
+        active = [key for key, stream in list(self._streams.items())
+                  if stream.active and stream.matches(project_id, user_id, server_url)]
+        if not active:
+            return False, "Streaming is not active"
+
+        for key in active:
+            self._streams.pop(key).active = False
+
+        future = asyncio.run_coroutine_threadsafe(self._cancel_tasks(active), self._loop)
+        future.result(timeout=10)
+
+        logger.info(f"Stopped asyncio streaming for {len(active)} project(s)")
+        return True, "Real-time streaming stopped"
+
+    def get_streaming_status(self, project_id: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Report streaming status for one project or for all of them (``user_id``'s only when given)."""
+        streams = [s for s in list(self._streams.values()) if s.matches(project_id, user_id)]
+        if project_id is not None:
+            return streams[0].to_status() if streams else {"project_uid": project_id, "active": False}
+
+        return {
+            "engine": "asyncio",
+            "active": any(s.active for s in streams),
+            "stream_count": len(streams),
+            "polls_in_flight": sum(1 for s in streams if s.running),
+            "max_concurrency": self.max_concurrency,
+            "dedup": self.kobo_client.delivered_filter.get_stats(),
+            "form_schemas": self.kobo_client.form_schemas.get_stats(),
+            "rate_limits": self.kobo_client.rate_limiter.get_stats(),
+            "eventstream": [client.get_stats() for client in self._eventstream_clients.values()],
+            "loop_alive": self._loop_thread.is_alive() if self._loop_thread else False,
+            "streams": stream_status_map(streams, by_project=user_id is not None),
+        }
+
+    # ------------------------
+    # Event loop plumbing
+    # ------------------------
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or not self._loop_thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="kobo-asyncio", daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+
+    async def _start_task(self, stream: ProjectStream):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._http is None or self._http.closed:
+            http_config = self.kobo_client.http_config
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=http_config.pool_maxsize, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=http_config.connect_timeout, sock_read=http_config.read_timeout
+                ),
+                headers={"Accept": "application/json", "Accept-Encoding": "gzip, deflate"},
+            )
+        self._tasks[stream.key] = asyncio.create_task(
+            self._stream_project(stream), name=f"kobo-stream-{stream.project_uid}"
+        )
+
+    async def _cancel_tasks(self, keys: List[StreamKey]):
+        tasks = [self._tasks.pop(key) for key in keys if key in self._tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if not self._tasks:
+            # Last stream gone: release the HTTP pool and hub connections
+            for client in self._eventstream_clients.values():
+                await client.close()
+            self._eventstream_clients.clear()
+            if self._http is not None:
+                await self._http.close()
+                self._http = None
+
+    async def _run_blocking(self, func, *args):
+        """Run a blocking (database) call in the loop's executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    # ------------------------
+    # Streaming
+    # ------------------------
+    async def _stream_project(self, stream: ProjectStream):
+        logger.info(f"Asyncio stream started for {stream.project_uid} (interval={stream.polling_interval}s)")
+        while stream.active:
+            delay = stream.polling_interval
+            try:
+                async with self._semaphore:
+                    stream.running = True
+                    processed = await self._poll_project(stream)
+                stream.polls += 1
+                stream.submissions_streamed += processed
+                stream.last_sync_time = datetime.utcnow()
+                stream.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stream.last_error = str(e)
+                logger.error(f"Error polling project {stream.project_uid}: {str(e)}")
+                delay = getattr(e, "retry_after", None) or min(stream.polling_interval, 60)
+            finally:
+                stream.running = False
+            await asyncio.sleep(delay)
+
+    async def _poll_project(self, stream: ProjectStream) -> int:
+        """Drain every submission newer than the project's high-water mark."""
+        checkpoint_id = await self._run_blocking(self._load_checkpoint_id, stream)
+
+        processed = 0
+        page_sizes: List[int] = []
+        response_times: List[float] = []
+        async for submissions in self._iter_submission_pages(stream, response_times):
+            if not stream.active:
+                break
+            page_sizes.append(len(submissions))
+            # The mark may only pass a submission once everything before it settled: keep page (_id) order
+            order = {submission.get("_id"): i for i, submission in enumerate(submissions)}
+            submissions, duplicates = await self._run_blocking(self._split_duplicates, stream, submissions)
+            if stream.typed_payloads:
+                # Form definitions are fetched over blocking HTTP; keep that off the loop
+                await self._run_blocking(
+                    self.kobo_client.form_schemas.warm,
+                    stream.server_url, stream.api_token, stream.project_uid, submissions,
+                )
+            results = await self._send_page(stream, submissions)
+            self.kobo_client._mark_delivered(results)
+            page_results = sorted(duplicates + results, key=lambda r: order.get(r.submission_id, len(order)))
+            await self._run_blocking(self._record_page, stream, page_results, checkpoint_id)
+            processed += sum(1 for r in results if r.success)
+
+        if stream.policy is not None:
+            stream.policy.observe(stream, page_sizes, response_times)
+        if processed > 0:
+            logger.info(f"Streamed {processed} submissions from {stream.project_uid} to EventStream")
+        return processed
+
+    async def _iter_submission_pages(self, stream: ProjectStream, timings: Optional[List[float]] = None):
+        """Async counterpart of ``KoboToolboxClient._iter_submission_pages``."""
+        url = f"{stream.server_url.rstrip('/')}/assets/{stream.project_uid}/data/"
+        headers = {"Authorization": f"Token {stream.api_token}"}
+
+        after_id = stream.last_submission_id
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        params = {
+            "format": "json",
+            "limit": str(stream.batch_size),
+            "sort": json.dumps({"_id": 1}),
+            "query": json.dumps(query),
+        }
+
+        limiter = self.kobo_client.rate_limiter
+        http_config = self.kobo_client.http_config
+        key = limiter.key_for(url, headers)
+        throttle_retries = 0
+
+        while url:
+            # Same per server/token budget as the threaded client
+            wait = limiter.reserve(key)
+            if wait > http_config.max_rate_wait:
+                raise KoboServerUnavailable(key[0], wait, reason="rate limited")
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            start = time.perf_counter()
+            try:
+                response = await self._http.get(url, headers=headers, params=params)
+            except aiohttp.ClientError:
+                limiter.record_error(key)
+                raise
+            async with response:
+                if timings is not None:
+                    timings.append((time.perf_counter() - start) * 1000)
+                backoff = limiter.record_response(key, response.status, response.headers.get("Retry-After"))
+                if backoff and throttle_retries < http_config.max_throttle_retries:
+                    throttle_retries += 1
+                    continue  # the paused bucket delays the retry
+                throttle_retries = 0
+                if response.status != 200:
+                    text = await response.text()
+                    raise Exception(f"Failed to fetch submissions (status {response.status}): {text[:200]}")
+                data = await response.json(content_type=None)
+
+            submissions = data.get("results", [])
+            if submissions:
+                yield submissions
+
+            url = data.get("next")
+            params = None
+
+    def _get_eventstream_client(self, eventstream_config) -> AsyncEventStreamClient:
+        key = eventstream_config.connection_string
+        client = self._eventstream_clients.get(key)
+        if client is None:
+            client = AsyncEventStreamClient(eventstream_config)
+            self._eventstream_clients[key] = client
+        return client
+
+    async def _send_page(self, stream: ProjectStream, submissions: List[Dict]) -> List[DeliveryResult]:
+        """Send a page concurrently; pages from every stream on the hub share batches."""
+        client = self._get_eventstream_client(stream.eventstream_client.config)
+        results: List[DeliveryResult] = []
+        events: List[SerializedEvent] = []
+        for submission in submissions:
+            webhook_data = self.kobo_client._transform_submission_to_webhook(submission, stream)
+            event = SerializedEvent.of(webhook_data)
+            results.append(DeliveryResult.for_submission(
+                submission, webhook_data, payload_size=event.size, started=time.time(), event=event
+            ))
+            events.append(event)
+
+        outcomes = await client.send_many(events)
+        for result, outcome in zip(results, outcomes):
+            if isinstance(outcome, BaseException):
+                result.error_message = str(outcome)
+            else:
+                result.success = bool(outcome)
+            result.elapsed_ms = (time.time() - result.started) * 1000
+            if result.success:
+                result.event = None  # failed payloads are kept in case they end up as dead letters
+        failed = sum(1 for r in results if not r.success)
+        if failed:
+            logger.error(f"Failed to send {failed} of {len(results)} events for {stream.project_uid}")
+        return results
+
+    # ------------------------
+    # Blocking helpers (run in the executor)
+    # ------------------------
+    def _load_checkpoint_id(self, stream: ProjectStream) -> int:
+        with self.kobo_client._app_context():
+            return self.kobo_client._load_checkpoint(stream).id
+
+    def _split_duplicates(self, stream: ProjectStream, submissions: List[Dict]):
+        with self.kobo_client._app_context():
+            return self.kobo_client._split_duplicates(stream, submissions)
+
+    def _record_page(self, stream: ProjectStream, results: List[DeliveryResult], checkpoint_id: int):
+        with self.kobo_client._app_context():
+            try:
+                checkpoint = self.kobo_client.db_session.get(SyncCheckpoint, checkpoint_id)
+                self.kobo_client._record_page(stream, results, checkpoint)
+            except Exception:
+                self.kobo_client.db_session.rollback()
+                raise
+
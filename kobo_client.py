@@ -3,23 +3,195 @@ import logging
 import time
 import json
 import threading
+import itertools
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from requests.adapters import HTTPAdapter
 from datetime import datetime,  timedelta
-from typing import Dict, List, Optional, Any, Tuple
-from models import WebhookLog, SystemHealth, EventStreamMetrics, db
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple
+from models import WebhookLog, SystemHealth, EventStreamMetrics, SyncCheckpoint, db
 
-from app import create_app
+try:
+    import ijson
+except ImportError:  # optional dependency: pip install .[streaming-parse] (ijson)
+    ijson = None
+
+from config import KoboHttpConfig, kobo_http_config
 from config_service import config_service
+from adaptive_polling import AdaptivePollingPolicy
+from project_cache import ProjectListCache
+from dead_letters import dead_letter_store
+from delivery_filter import DeliveredFilter
+from form_schema import FormSchemaCache
+from rate_limiter import KoboRateLimiter, KoboServerUnavailable
+from serialized_event import SerializedEvent
+from streaming_pipeline import SubmissionPipeline
+from stream_scheduler import ProjectStream, StreamScheduler
 logger = logging.getLogger(__name__)
 
+# Assets requested per page when listing projects
+ASSET_PAGE_SIZE = 200
+
+
+@dataclass
+class DeliveryResult:
+    """
+    Outcome of sending one streamed submission to EventStream.
+
+    Only the fields needed for logging and the high-water mark are kept, so
+    the submission itself can be released as soon as it has been sent.
+    """
+    submission_id: Optional[int]
+    submission_time: Optional[str]
+    submission_uuid: Optional[str]
+    form_id: Optional[str]
+    success: bool
+    payload_size: int = 0
+    payload_preview: Optional[Dict[str, Any]] = None
+    error_message: Optional[str] = None
+    elapsed_ms: float = 0.0
+    duplicate: bool = False  # already delivered earlier; not sent again
+    future: Optional[Future] = field(default=None, repr=False)  # set while the send is in flight
+    event: Optional[SerializedEvent] = field(default=None, repr=False)  # kept only for dead-lettering
+    started: float = field(default=0.0, repr=False)
+
+    @classmethod
+    def for_submission(
+        cls, submission: Dict[str, Any], webhook_data: Optional[Dict[str, Any]] = None, **kwargs
+    ) -> 'DeliveryResult':
+        if webhook_data is not None:
+            if "payload_size" not in kwargs:
+                kwargs["payload_size"] = SerializedEvent.of(webhook_data).size
+            kwargs.setdefault("payload_preview", {k: webhook_data[k] for k in list(webhook_data)[:5]})
+        kwargs.setdefault("success", False)
+        return cls(
+            submission_id=submission.get("_id"),
+            submission_time=submission.get("_submission_time"),
+            submission_uuid=submission.get("_uuid"),
+            form_id=submission.get("_xform_id_string"),
+            **kwargs,
+        )
+
 
 class KoboToolboxClient:
     """Client for KoboToolbox API integration with streaming support"""
 
-    def __init__(self, config_service_instance=config_service):
+    def __init__(self, config_service_instance=config_service, app=None,
+                 http_config: KoboHttpConfig = kobo_http_config, runtime=None):
         self.config_service = config_service_instance
-        self.streaming_active = False
-        self.streaming_thread = None
-        self.last_sync_time: Optional[datetime] = None
+        self.app = app
+        self.runtime = runtime  # WorkerRuntime when running outside the web app
+        self.scheduler: Optional[StreamScheduler] = None
+        self.project_cache = ProjectListCache()
+        self.delivered_filter = DeliveredFilter()
+        self._filter_seed_lock = threading.Lock()
+        self.http_config = http_config
+        self.http = self._build_http_session(http_config)
+        self.rate_limiter = KoboRateLimiter(
+            rate_per_second=http_config.rate_limit_per_second,
+            burst=http_config.rate_limit_burst,
+            failure_threshold=http_config.breaker_failures,
+            recovery_timeout=http_config.breaker_recovery_seconds,
+        )
+        self._http_stats_lock = threading.Lock()
+        self._http_stats = {"requests": 0, "errors": 0, "total_time_ms": 0.0, "max_time_ms": 0.0}
+        self.form_schemas = FormSchemaCache(self._request)
+
+    # ------------------------
+    # HTTP
+    # ------------------------
+    @staticmethod
+    def _build_http_session(http_config: KoboHttpConfig) -> requests.Session:
+        """Shared keep-alive session so polls reuse TCP/TLS connections."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=http_config.pool_connections,
+            pool_maxsize=http_config.pool_maxsize,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        return session
+
+    def _request(self, method: str, url: str, read_timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        Issue a rate-limited request on the pooled session.
+
+        Every call (polls, listings, backfills, form definitions) draws from
+        the server/token bucket of ``rate_limiter``. A ``429`` is retried
+        after its ``Retry-After`` up to ``max_throttle_retries`` times; a wait
+        longer than ``max_rate_wait`` raises ``KoboServerUnavailable`` so the
+        caller reschedules instead of blocking a worker thread.
+        """
+        kwargs.setdefault(
+            "timeout",
+            (self.http_config.connect_timeout, read_timeout or self.http_config.read_timeout),
+        )
+        key = self.rate_limiter.key_for(url, kwargs.get("headers"))
+
+        attempt = 0
+        while True:
+            wait = self.rate_limiter.reserve(key)
+            if wait > self.http_config.max_rate_wait:
+                raise KoboServerUnavailable(key[0], wait, reason="rate limited")
+            if wait > 0:
+                time.sleep(wait)
+
+            response = self._send(method, url, key, **kwargs)
+            backoff = self.rate_limiter.record_response(
+                key, response.status_code, response.headers.get("Retry-After")
+            )
+            if not backoff or attempt >= self.http_config.max_throttle_retries:
+                return response
+            response.close()
+            attempt += 1
+
+    def _send(self, method: str, url: str, key: Tuple[str, str], **kwargs) -> requests.Response:
+        """Send one request and record its wall time."""
+        start = time.perf_counter()
+        failed = False
+        try:
+            return self.http.request(method, url, **kwargs)
+        except requests.RequestException:
+            failed = True
+            self.rate_limiter.record_error(key)
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._http_stats_lock:
+                self._http_stats["requests"] += 1
+                self._http_stats["errors"] += int(failed)
+                self._http_stats["total_time_ms"] += elapsed_ms
+                self._http_stats["max_time_ms"] = max(self._http_stats["max_time_ms"], elapsed_ms)
+            logger.debug(f"{method} {url.split('?')[0]} took {elapsed_ms:.1f}ms")
+
+    def get_http_stats(self) -> Dict[str, Any]:
+        """Request timings plus connection reuse figures from the urllib3 pools."""
+        with self._http_stats_lock:
+            stats = dict(self._http_stats)
+
+        connections_opened = 0
+        pooled_requests = 0
+        for adapter in set(self.http.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections_opened += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        stats["average_time_ms"] = round(stats["total_time_ms"] / stats["requests"], 2) if stats["requests"] else 0
+        stats["total_time_ms"] = round(stats["total_time_ms"], 2)
+        stats["max_time_ms"] = round(stats["max_time_ms"], 2)
+        stats["connections_opened"] = connections_opened
+        # Every pooled request beyond the first on a connection skipped a TCP/TLS handshake
+        stats["connections_reused"] = max(pooled_requests - connections_opened, 0)
+        return stats
 
     # ------------------------
        # Configuration
@@ -34,8 +206,25 @@ class KoboToolboxClient:
             "server_url": api_cfg.get("server_url"),
             "api_token": api_cfg.get("api_token"),
             "project_id": api_cfg.get("project_id"),
+            **self.get_stream_settings(),
+        }
+
+    def get_stream_settings(self) -> Dict[str, Any]:
+        """Polling/streaming tunables stored in AppConfiguration (no session needed)."""
+        return {
             "polling_interval": int(self.config_service.get_setting("kobo_polling_interval", "30")),
             "batch_size": int(self.config_service.get_setting("kobo_batch_size", "50")),
+            "adaptive_polling": self.config_service.get_setting("kobo_adaptive_polling", "true").lower() == "true",
+            "min_polling_interval": float(self.config_service.get_setting("kobo_min_polling_interval", "5")),
+            "max_polling_interval": float(self.config_service.get_setting("kobo_max_polling_interval", "300")),
+            "max_batch_size": int(self.config_service.get_setting("kobo_max_batch_size", "1000")),
+            "target_response_ms": float(self.config_service.get_setting("kobo_target_response_ms", "2000")),
+            "incremental_parse": self.config_service.get_setting("kobo_incremental_parse", "false").lower() == "true",
+            "pipelined": self.config_service.get_setting("kobo_pipeline_enabled", "true").lower() == "true",
+            # Opt-in: typed payloads change the event shape (flattened groups, split geopoints)
+            # and the webhook path still sends submissions as received
+            "typed_payloads": self.config_service.get_setting("kobo_typed_payloads", "false").lower() == "true",
+            "max_delivery_attempts": int(self.config_service.get_setting("kobo_max_delivery_attempts", "5")),
         }
 
     # ------------------------
@@ -51,7 +240,7 @@ class KoboToolboxClient:
             headers = {"Authorization": f'Token {api_token}'}
             url = f"{server_url.rstrip('/')}/api/v2/assets/"
             params = {"format": "json"}
-            response = requests.get(url, headers=headers, params=params, timeout=10)
+            response = self._request("GET", url, headers=headers, params=params, read_timeout=10)
 
             logger.debug(f"Response status: {response.status_code}")
             logger.debug(f"Response content (first 200 chars): {response.text[:200]}")
@@ -80,42 +269,91 @@ class KoboToolboxClient:
             logger.error(f"KoboToolbox connection test failed: {str(e)}")
             return False, f"Connection test failed: {str(e)}"
 
-    def get_projects(self) -> List[Dict[str, Any]]:
-        """Get list of projects/forms from KoboToolbox."""
+    def get_projects(self, force_refresh: bool = False) -> List[Dict[str, Any]]:
+        """Get list of projects/forms from KoboToolbox (all pages, cached per user/server)."""
         try:
             config = self.get_api_config()
-            if not config.get("server_url") or not config.get("api_token"):
+            server_url = config.get("server_url")
+            api_token = config.get("api_token")
+            if not server_url or not api_token:
                 return []
 
-            headers = {
-                "Authorization": f'Token {config["api_token"]}',
-                "Accept": "application/json",
-            }
-            url = f"{config['server_url'].rstrip('/')}/assets/"
-            response = requests.get(url, headers=headers, timeout=15)
-
-            if response.status_code == 200:
-                projects = []
-                for asset in response.json().get("results", []):
-                    if asset.get("asset_type") == "survey":
-                        uid = asset.get("uid") or asset.get("url", "").rstrip("/").split("/")[-1]
-                        projects.append(
-                            {
-                                "uid": uid,
-                                "name": asset.get("name") or asset.get("title") or uid,
-                                "date_created": asset.get("date_created"),
-                                "deployment_count": asset.get("num_submissions", 0),
-                            }
-                        )
-                return projects
-            else:
+            self.project_cache.ttl_seconds = float(
+                self.config_service.get_setting("kobo_projects_cache_ttl", "300")
+            )
+            entry, fresh = self.project_cache.lookup(config["user_id"], server_url, api_token)
+            if entry and fresh and not force_refresh:
+                return entry.projects
+
+            auth_headers = {"Authorization": f"Token {api_token}"}
+            headers = dict(auth_headers)
+            # Validators only exist for single-page listings (a 304 covers page 1 only)
+            if entry and not force_refresh:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+            url = f"{server_url.rstrip('/')}/assets/"
+            params = {"format": "json", "limit": ASSET_PAGE_SIZE, "q": "asset_type:survey"}
+            response = self._request("GET", url, headers=headers, params=params, read_timeout=15)
+
+            if response.status_code == 304 and entry:
+                self.project_cache.mark_revalidated(entry)
+                return entry.projects
+
+            if response.status_code != 200:
                 logger.error(f"Failed to fetch projects: {response.status_code} - {response.text}")
-                return []
+                return entry.projects if entry else []
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            projects = []
+            data = response.json()
+            if data.get("next"):
+                # Page 1's validators say nothing about later pages: refetch the whole list once stale
+                etag = last_modified = None
+            while True:
+                projects.extend(self._parse_projects(data.get("results", [])))
+                next_url = data.get("next")
+                if not next_url:
+                    break
+                response = self._request("GET", next_url, headers=auth_headers, read_timeout=15)
+                if response.status_code != 200:
+                    # Never cache a partial listing
+                    logger.error(f"Failed to fetch projects page: {response.status_code} - {response.text}")
+                    return entry.projects if entry else projects
+                data = response.json()
+
+            self.project_cache.store(
+                config["user_id"], server_url, api_token, projects, etag=etag, last_modified=last_modified
+            )
+            return projects
 
         except Exception as e:
             logger.error(f"Failed to get KoboToolbox projects: {str(e)}")
             return []
 
+    @staticmethod
+    def _parse_projects(assets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        projects = []
+        for asset in assets:
+            if asset.get("asset_type") == "survey":
+                uid = asset.get("uid") or asset.get("url", "").rstrip("/").split("/")[-1]
+                projects.append(
+                    {
+                        "uid": uid,
+                        "name": asset.get("name") or asset.get("title") or uid,
+                        "date_created": asset.get("date_created"),
+                        "deployment_count": asset.get("num_submissions", 0),
+                    }
+                )
+        return projects
+
+    def invalidate_project_cache(self, user_id=None, server_url: Optional[str] = None) -> int:
+        """Forget cached project listings, e.g. after the Kobo credentials change."""
+        return self.project_cache.invalidate(user_id, server_url)
+
 
     # ------------------------
     # Submissions
@@ -143,7 +381,7 @@ class KoboToolboxClient:
             '''if since:
                 params["query"] = f'{{"_submission_time": {{"$gte": "{since.isoformat()}"}}}}'
                 '''
-            response = requests.get(url, headers=headers, params=params, timeout=30)
+            response = self._request("GET", url, headers=headers, params=params)
 
             if response.status_code == 200:
                 submissions = response.json().get("results", [])
@@ -159,173 +397,583 @@ class KoboToolboxClient:
     # ------------------------
     # Streaming
     # ------------------------
-    def start_streaming(self, eventstream_client, webhook_handler=None) -> Tuple[bool, str]:
-        """Start background thread to stream Kobo submissions into EventStream."""
-        print("When STARTING EVENTSTREAM@koboclient start streaming")
-        if self.streaming_active:
-            return False, "Streaming is already active"
-
-        config = self.get_api_config()
-        
+    def start_streaming(
+        self, eventstream_client, webhook_handler=None, project_id: Optional[str] = None,
+        config: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[bool, str]:
+        """Schedule a project (default: the session's project) for streaming into EventStream."""
+        config = config or self.get_api_config()
+
         server_url = (config.get("server_url") or "").strip()
-        
         api_token = (config.get("api_token") or "").strip()
-        
-        print("BBIG url: ", server_url, "api :", api_token)
-        if not server_url or not server_url.strip():
+        project_id = project_id or config.get("project_id")
+
+        if not server_url:
             return False, "Missing or invalid KoboToolbox server URL"
-        if not api_token or not api_token.strip():
+        if not api_token:
             return False, "Missing or invalid KoboToolbox API token"
-
-        
-
-        self.streaming_active = True
-        self.last_sync_time = datetime.utcnow()
-
-        self.streaming_thread = threading.Thread(
-            target=self._streaming_worker,
-            args=(eventstream_client, webhook_handler, config),
-            daemon=True,
+        if not project_id:
+            return False, "Missing KoboToolbox project ID"
+
+        stream = ProjectStream(
+            project_uid=project_id,
+            user_id=config["user_id"],
+            server_url=server_url,
+            api_token=api_token,
+            eventstream_client=eventstream_client,
+            polling_interval=config.get("polling_interval", 30),
+            batch_size=config.get("batch_size", 50),
+            policy=AdaptivePollingPolicy.from_config(config) if config.get("adaptive_polling") else None,
+            incremental_parse=bool(config.get("incremental_parse")),
+            pipelined=bool(config.get("pipelined")),
+            typed_payloads=bool(config.get("typed_payloads")),
+            max_delivery_attempts=int(config.get("max_delivery_attempts", 5)),
         )
-        self.streaming_thread.start()
+        if stream.incremental_parse and ijson is None:
+            logger.warning("kobo_incremental_parse is on but 'ijson' is not installed; parsing whole pages")
+            stream.incremental_parse = False
+        return self._get_scheduler().start_stream(stream)
+
+    def stop_streaming(self, project_id: Optional[str] = None, user_id: Optional[int] = None,
+                       server_url: Optional[str] = None) -> Tuple[bool, str]:
+        """Stop one project's stream, or every stream when no project is given (``user_id``'s only when given)."""
+        if self.scheduler is None:
+            return False, "Streaming is not active"
 
-        logger.info("Started KoboToolbox real-time streaming")
-        return True, "Real-time streaming started"
+        if project_id:
+            return self.scheduler.stop_stream(project_id, user_id=user_id, server_url=server_url)
 
-    def stop_streaming(self) -> Tuple[bool, str]:
-        """Stop streaming thread."""
-        if not self.streaming_active:
+        stopped = self.scheduler.stop_all(user_id=user_id)
+        if not stopped:
             return False, "Streaming is not active"
 
-        self.streaming_active = False
-        if self.streaming_thread and self.streaming_thread.is_alive():
-            self.streaming_thread.join(timeout=5)
-
-        logger.info("Stopped KoboToolbox real-time streaming")
+        logger.info(f"Stopped KoboToolbox real-time streaming for {stopped} project(s)")
         return True, "Real-time streaming stopped"
 
-    def get_streaming_status(self) -> Dict[str, Any]:
-        """Report streaming worker status."""
-        return {
-            "active": self.streaming_active,
-            "last_sync": self.last_sync_time.isoformat() if self.last_sync_time else None,
-            "thread_alive": self.streaming_thread.is_alive() if self.streaming_thread else False,
+    def get_streaming_status(self, project_id: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Report streaming status for one project or for all of them (``user_id``'s only when given)."""
+        if self.scheduler is None:
+            if project_id:
+                return {"project_uid": project_id, "active": False}
+            return {"engine": "threaded", "active": False, "stream_count": 0, "streams": {},
+                    "http": self.get_http_stats(), "dedup": self.delivered_filter.get_stats(),
+                    "form_schemas": self.form_schemas.get_stats(),
+                    "rate_limits": self.rate_limiter.get_stats()}
+
+        status = self.scheduler.get_status(project_id, user_id=user_id)
+        if project_id is None:
+            status["engine"] = "threaded"
+            status["http"] = self.get_http_stats()
+            status["dedup"] = self.delivered_filter.get_stats()
+            status["form_schemas"] = self.form_schemas.get_stats()
+            status["rate_limits"] = self.rate_limiter.get_stats()
+        return status
+
+    def _get_scheduler(self) -> StreamScheduler:
+        """Create the shared scheduler on first use (needs app context for settings)."""
+        if self.scheduler is None:
+            max_workers = int(self.config_service.get_setting("kobo_max_concurrent_polls", "4"))
+            self.scheduler = StreamScheduler(self._poll_in_app_context, max_workers=max_workers)
+        return self.scheduler
+
+    @property
+    def db_session(self):
+        """Session for the current thread: the worker runtime's, or Flask-SQLAlchemy's."""
+        if self.runtime is not None:
+            return self.runtime.session
+        return db.session
+
+    def _app_context(self):
+        """Scope for background work; the session is bound to it and removed on exit."""
+        if self.runtime is not None:
+            return self.runtime.session_scope()
+        if self.app is None:
+            from app import app as flask_app  # reuse the application instance, never build another
+            self.app = flask_app
+        return self.app.app_context()
+
+    def _poll_in_app_context(self, stream: ProjectStream) -> int:
+        """Run one poll inside an application context so db.session is scoped to it."""
+        with self._app_context():
+            try:
+                return self.poll_project(stream)
+            except Exception:
+                self.db_session.rollback()
+                raise
+
+    def poll_project(self, stream: ProjectStream) -> int:
+        """Drain every submission newer than the project's high-water mark."""
+        checkpoint = self._load_checkpoint(stream)
+
+        processed = 0
+        page_sizes: List[int] = []
+        response_times: List[float] = []
+        if stream.pipelined:
+            processed = self._poll_pipelined(stream, self._iter_submissions(stream, page_sizes, response_times))
+        elif stream.incremental_parse:
+            # One submission in memory at a time; logs still commit every batch_size
+            submissions = self._iter_submissions_incrementally(
+                stream.server_url, stream.api_token, stream.project_uid,
+                stream.batch_size, after_id=stream.last_submission_id,
+                page_sizes=page_sizes, timings=response_times,
+            )
+            for chunk in self._chunks(submissions, stream.batch_size):
+                if not stream.active:
+                    break
+                processed += self._stream_submission_batch(chunk, stream, checkpoint)
+        else:
+            for submissions in self._iter_submission_pages(
+                stream.server_url, stream.api_token, stream.project_uid,
+                stream.batch_size, after_id=stream.last_submission_id, timings=response_times
+            ):
+                if not stream.active:
+                    break
+                page_sizes.append(len(submissions))
+                processed += self._stream_submission_batch(submissions, stream, checkpoint)
+
+        fetched = sum(page_sizes)
+        if stream.policy is not None:
+            stream.policy.observe(stream, page_sizes, response_times)
+
+        if processed > 0:
+            logger.info(f"Streamed {processed}/{fetched} submissions from {stream.project_uid} to EventStream")
+        elif fetched == 0:
+            logger.debug(f"No new submissions for {stream.project_uid}.")
+        return processed
+
+    def _iter_submissions(
+        self, stream: ProjectStream, page_sizes: List[int], timings: List[float]
+    ) -> Iterator[Dict[str, Any]]:
+        """Flat stream of new submissions for a project, parsed per the stream's settings."""
+        if stream.incremental_parse:
+            yield from self._iter_submissions_incrementally(
+                stream.server_url, stream.api_token, stream.project_uid,
+                stream.batch_size, after_id=stream.last_submission_id,
+                page_sizes=page_sizes, timings=timings,
+            )
+            return
+
+        for submissions in self._iter_submission_pages(
+            stream.server_url, stream.api_token, stream.project_uid,
+            stream.batch_size, after_id=stream.last_submission_id, timings=timings
+        ):
+            page_sizes.append(len(submissions))
+            yield from submissions
+
+    def _iter_submission_pages(
+        self,
+        server_url: str,
+        api_token: str,
+        project_id: str,
+        page_size: int,
+        after_id: Optional[int] = None,
+        timings: Optional[List[float]] = None,
+        query: Optional[Dict[str, Any]] = None,
+        sizes: Optional[List[int]] = None,
+    ):
+        """
+        Yield pages of submissions newer than ``after_id``, oldest first.
+
+        Results are ordered by ``_id`` and the ``next`` link is followed until
+        the project is drained, so a burst larger than ``page_size`` is picked
+        up in the same cycle instead of being skipped. Kobo's response time
+        and body size for each page are appended to ``timings``/``sizes``
+        when given; ``query`` adds further Mongo-style filters.
+        """
+        url = f"{server_url.rstrip('/')}/assets/{project_id}/data/"
+        headers = {"Authorization": f"Token {api_token}"}
+
+        query = dict(query or {})
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        params = {
+            "format": "json",
+            "limit": page_size,
+            "sort": json.dumps({"_id": 1}),
+            "query": json.dumps(query),
         }
 
-    
-    def _streaming_worker(self, eventstream_client, webhook_handler, config: Dict[str, Any]):
-        """Background loop: poll KoboToolbox and forward new submissions to EventStream."""
-        app = create_app()  # or import the already initialized app
-
-        with app.app_context():
-            polling_interval = config.get("polling_interval", 30)
-            batch_size = config.get("batch_size", 50)
+        while url:
+            response = self._request("GET", url, headers=headers, params=params)
+            if timings is not None:
+                timings.append(response.elapsed.total_seconds() * 1000)
+            if response.status_code != 200:
+                raise Exception(
+                    f"Failed to fetch submissions (status {response.status_code}): {response.text[:200]}"
+                )
+            if sizes is not None:
+                sizes.append(len(response.content))
+
+            data = response.json()
+            submissions = data.get("results", [])
+            if submissions:
+                yield submissions
+
+            # `next` already carries limit/start/sort/query
+            url = data.get("next")
+            params = None
+
+    def _iter_submissions_incrementally(
+        self,
+        server_url: str,
+        api_token: str,
+        project_id: str,
+        page_size: int,
+        after_id: Optional[int] = None,
+        page_sizes: Optional[List[int]] = None,
+        timings: Optional[List[float]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Like ``_iter_submission_pages`` but parses each response body as it
+        streams in and yields one submission at a time, so a page of
+        thousands of large submissions is never held in memory at once.
+        """
+        url = f"{server_url.rstrip('/')}/assets/{project_id}/data/"
+        headers = {"Authorization": f"Token {api_token}"}
+
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        params = {
+            "format": "json",
+            "limit": page_size,
+            "sort": json.dumps({"_id": 1}),
+            "query": json.dumps(query),
+        }
 
-            server_url = config.get("server_url")
-            api_token = config.get("api_token")
-            project_id = config.get("project_id")
-            user_id = config.get("user_id")
-            
-            print("USER_ID1", dict(config))
-            user_id = config["user_id"]
-            print("USER_ID2", user_id)
-
-            logger.info(f"Streaming worker started (interval={polling_interval}s, batch={batch_size})")
-            first_run = True
-
-            while self.streaming_active:
-                try:
-                    # ✅ build request directly with config (no Flask session)
-                    url = f"{server_url.rstrip('/')}/assets/{project_id}/data/"
-                    headers = {"Authorization": f"Token {api_token}"}
-
-                    if first_run or not self.last_sync_time:
-                        query = {}
-                    else:
-                        query = {"_submission_time": {"$gte": self.last_sync_time.isoformat()}}
-
-                    params = {"format": "json", "limit": batch_size, "query": json.dumps(query)}
-
-                    response = requests.get(url, headers=headers, params=params, timeout=30)
-
-                    if response.status_code == 200:
-                        submissions = response.json().get("results", [])
-                    else:
-                        logger.error(f"Failed to fetch submissions (status {response.status_code}): {response.text}")
-                        submissions = []
-
-                    if submissions:
-                        processed = 0
-                        for submission in submissions:
-                            if not self.streaming_active:
-                                break
-                            webhook_data = self._transform_submission_to_webhook(submission)
-                            start_time = time.time()
-                            status = "success"
-                            error_message = None
-
-                            try:
-                                if eventstream_client.send_to_eventstream(webhook_data):
-                                    processed += 1
-                            except Exception as e:
-                                status = "failed"
-                                logger.error(f"Failed to stream submission: {str(e)}")
-                            
-                            # 🔹 Log webhook activity
-                            log = WebhookLog(
-
-                                user_id = user_id,  # or current_user.id if available
-                                source_ip="kobo_client",
-                                user_agent="streaming_worker",
-                                payload_size=len(json.dumps(webhook_data)),
-                                kobo_form_id=submission.get("_xform_id_string"),
-                                submission_uuid=submission.get("_uuid"),
-                                status=status,
-                                error_message=error_message,
-                                retry_count=0,
-                                eventstream_sent=(status == "success"),
-                                #eventstream_sent='sent' if status == "success" else 'failed',
-                                processing_time_ms=(time.time() - start_time) * 1000
-                            )
-                            db.session.add(log)
-                            db.session.flush()  # so log.id is available
-
-                            # 🔹 Log eventstream attempt
-                            metrics = EventStreamMetrics(
-                                user_id= user_id,
-                                webhook_log=log,
-                                attempt_number=1,
-                                success=(status == "success"),
-                                error_type=(type(error_message).__name__ if error_message else None),
-                                error_message=error_message,
-                                transmission_time_ms=(time.time() - start_time) * 1000,
-                                payload_preview={k: webhook_data[k] for k in list(webhook_data)[:5]}
-                            )
-                            db.session.add(metrics)
-                        # 🔹 Commit once per batch
-                        db.session.commit()
-                        if processed > 0:
-                            logger.info(f"Streamed {processed} submissions to EventStream")
-                    else:
-                        logger.warning("No new submissions.")
-
-                    self.last_sync_time = datetime.utcnow()
-                    first_run = False
-                    time.sleep(polling_interval)
-
-                except Exception as e:
-                    logger.error(f"Error in streaming worker: {str(e)}")
-                    time.sleep(min(polling_interval, 60))
-
-            logger.info("Streaming worker stopped")
+        while url:
+            page = {"next": None, "count": 0}
+            with self._request("GET", url, headers=headers, params=params, stream=True) as response:
+                if timings is not None:
+                    timings.append(response.elapsed.total_seconds() * 1000)
+                if response.status_code != 200:
+                    raise Exception(
+                        f"Failed to fetch submissions (status {response.status_code}): {response.text[:200]}"
+                    )
+                for submission in self._parse_results_stream(response, page):
+                    page["count"] += 1
+                    yield submission
+
+            if page_sizes is not None:
+                page_sizes.append(page["count"])
+            url = page["next"]
+            params = None
+
+    @staticmethod
+    def _parse_results_stream(response: requests.Response, page: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Yield each item of ``results`` from a streamed response; records ``next`` into ``page``."""
+        response.raw.decode_content = True  # let urllib3 undo gzip
+        builder = None
+        for prefix, event, value in ijson.parse(response.raw, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == "results.item" and event in ("end_map", "end_array"):
+                    yield builder.value
+                    builder = None
+            elif prefix == "results.item":
+                if event in ("start_map", "start_array"):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                else:
+                    yield value
+            elif prefix == "next" and event in ("string", "null"):
+                page["next"] = value
+
+    @staticmethod
+    def _chunks(items: Iterator[Dict[str, Any]], size: int) -> Iterator[Iterable[Dict[str, Any]]]:
+        """Split an iterator into lazy chunks of ``size`` without materializing them."""
+        while True:
+            first = next(items, None)
+            if first is None:
+                return
+            yield itertools.chain([first], itertools.islice(items, size - 1))
+
+    def _load_checkpoint(self, stream: ProjectStream) -> SyncCheckpoint:
+        """
+        Return the stream's persisted checkpoint, creating it if needed.
+
+        On the first poll the in-memory high-water mark is resumed from it;
+        afterwards the stream's own state is authoritative.
+        """
+        stream.mark_held = False  # each poll resumes from the mark, failed submissions included
+        if stream.checkpoint_id is not None:
+            checkpoint = self.db_session.get(SyncCheckpoint, stream.checkpoint_id)
+            if checkpoint:
+                return checkpoint
+
+        checkpoint = self.db_session.query(SyncCheckpoint).filter_by(
+            user_id=stream.user_id, server_url=stream.server_url, project_uid=stream.project_uid
+        ).first()
+
+        if not checkpoint:
+            checkpoint = SyncCheckpoint(
+                user_id=stream.user_id, server_url=stream.server_url, project_uid=stream.project_uid
+            )
+            self.db_session.add(checkpoint)
+            self.db_session.commit()
+
+        stream.checkpoint_id = checkpoint.id
+        stream.last_submission_id = checkpoint.last_submission_id
+        stream.last_submission_time = checkpoint.last_submission_time
+        logger.info(f"Resuming {stream.project_uid} after _id={stream.last_submission_id}")
+        return checkpoint
+
+    def _stream_submission_batch(
+        self, submissions: Iterable[Dict], stream: ProjectStream, checkpoint: Optional[SyncCheckpoint] = None
+    ) -> int:
+        """Send a batch of submissions, log each attempt and advance the high-water mark."""
+        self._ensure_delivered_filter_seeded()
+        results = []
+
+        # Queue the whole page on the batching producer first so it goes out in
+        # as few EventHub batches as possible, then collect the outcomes.
+        for submission in submissions:
+            if not stream.active:
+                break
+            if self._is_duplicate(stream, submission):
+                results.append(DeliveryResult.for_submission(submission, duplicate=True))
+                continue
+            webhook_data = self._transform_submission_to_webhook(submission, stream)
+            results.append(self._submit_submission(stream, submission, webhook_data))
+        results = [self._await_delivery(result) for result in results]
+
+        self._mark_delivered(results)
+        self._record_page(stream, results, checkpoint)
+        return sum(1 for r in results if r.success)
+
+    def _submit_submission(self, stream: ProjectStream, submission: Dict, webhook_data: Dict) -> DeliveryResult:
+        """Queue one transformed submission for sending; resolve it with ``_await_delivery``."""
+        event = SerializedEvent.of(webhook_data)  # encoded once for both the send and the log row
+        result = DeliveryResult.for_submission(
+            submission, webhook_data, payload_size=event.size, started=time.time(), event=event
+        )
+        try:
+            result.future = stream.eventstream_client.submit(event)
+        except Exception as e:
+            result.error_message = str(e)
+            logger.error(f"Failed to stream submission: {str(e)}")
+        return result
+
+    def _await_delivery(self, result: DeliveryResult) -> DeliveryResult:
+        """Wait for a submitted send and capture the outcome."""
+        if result.future is None:
+            return result
+        try:
+            result.success = bool(result.future.result())
+        except Exception as e:
+            result.error_message = str(e)
+            logger.error(f"Failed to stream submission: {str(e)}")
+        result.elapsed_ms = (time.time() - result.started) * 1000
+        result.future = None
+        if result.success:
+            result.event = None
+        return result
+
+    def _poll_pipelined(self, stream: ProjectStream, submissions: Iterator[Dict]) -> int:
+        """
+        Stream submissions through fetch -> transform -> send -> log stages so
+        Kobo downloads, Event Hubs sends and database writes overlap.
+        """
+        self._ensure_delivered_filter_seeded()
+        pending: List[DeliveryResult] = []
+        totals = {"processed": 0}
+
+        def transform(submission):
+            if self._is_duplicate(stream, submission):
+                return DeliveryResult.for_submission(submission, duplicate=True)
+            return submission, self._transform_submission_to_webhook(submission, stream)
+
+        def send(item):
+            if isinstance(item, DeliveryResult):
+                return item  # duplicates pass through to keep the log stage in _id order
+            return self._submit_submission(stream, *item)
+
+        def flush():
+            if not pending:
+                return
+            checkpoint = self.db_session.get(SyncCheckpoint, stream.checkpoint_id)
+            try:
+                self._record_page(stream, pending, checkpoint)
+            except Exception:
+                self.db_session.rollback()
+                raise
+            totals["processed"] += sum(1 for r in pending if r.success)
+            pending.clear()
+
+        def record(result):
+            # Sends complete in the batcher while later submissions are queued behind them
+            result = self._await_delivery(result)
+            self._mark_delivered([result])
+            pending.append(result)
+            if len(pending) >= stream.batch_size:
+                flush()
+
+        pipeline = SubmissionPipeline(
+            submissions,
+            [("transform", transform, None), ("send", send, None), ("log", record, flush)],
+            queue_size=max(stream.batch_size, 10),
+            context_factory=self._app_context,
+        )
+        stream.pipeline = pipeline
+        pipeline.run(should_stop=lambda: not stream.active)
+        return totals["processed"]
 
+    # ------------------------
+    # Duplicate suppression
+    # ------------------------
+    def _ensure_delivered_filter_seeded(self):
+        """Load recently delivered _uuid values from WebhookLog once per process."""
+        if self.delivered_filter.seeded:
+            return
+        with self._filter_seed_lock:
+            if self.delivered_filter.seeded:
+                return
+            rows = (
+                self.db_session.query(WebhookLog.submission_uuid)
+                .filter(WebhookLog.eventstream_sent.is_(True))
+                .filter(WebhookLog.submission_uuid.isnot(None))
+                .order_by(WebhookLog.id.desc())
+                .limit(self.delivered_filter.bloom_capacity)
+                .all()
+            )
+            seeded = self.delivered_filter.seed(row[0] for row in reversed(rows))
+            logger.info(f"Seeded duplicate filter with {seeded} delivered submission ids")
+
+    def _was_delivered(self, uuid: str) -> bool:
+        """Authoritative check used to settle Bloom filter hits."""
+        return self.db_session.query(WebhookLog.id).filter_by(
+            submission_uuid=uuid, eventstream_sent=True
+        ).first() is not None
+
+    def _split_duplicates(
+        self, stream: ProjectStream, submissions: List[Dict]
+    ) -> Tuple[List[Dict], List[DeliveryResult]]:
+        """Separate already-delivered submissions (by _uuid) from the ones to send."""
+        self._ensure_delivered_filter_seeded()
+        fresh = []
+        duplicates = []
+        for submission in submissions:
+            if self._is_duplicate(stream, submission):
+                duplicates.append(DeliveryResult.for_submission(submission, duplicate=True))
+            else:
+                fresh.append(submission)
+        return fresh, duplicates
+
+    def _is_duplicate(self, stream: ProjectStream, submission: Dict) -> bool:
+        if self.delivered_filter.is_delivered(submission.get("_uuid"), confirm=self._was_delivered):
+            stream.duplicates_skipped += 1
+            logger.debug(f"Skipped already delivered submission {submission.get('_uuid')} from {stream.project_uid}")
+            return True
+        return False
+
+    def _mark_delivered(self, results: List[DeliveryResult]):
+        for result in results:
+            if result.success:
+                self.delivered_filter.add(result.submission_uuid)
+
+    def _record_page(
+        self, stream: ProjectStream, results: List["DeliveryResult"], checkpoint: Optional[SyncCheckpoint] = None
+    ):
+        """
+        Write log rows for one page and advance the high-water mark in the same commit.
+
+        The mark only moves over the contiguous run of delivered (or
+        duplicate) submissions. From the first failure on it holds for the
+        rest of the poll, so the next poll fetches the failed submission
+        again; the ones delivered after it are then skipped as duplicates.
+        A submission still failing after ``max_delivery_attempts`` polls goes
+        to the dead-letter store, and the mark may pass it.
+        """
+        max_id = stream.last_submission_id
+        max_time = stream.last_submission_time
+
+        for result in results:
+            settled = result.success or result.duplicate or self._dead_letter_if_exhausted(stream, result)
+            if result.success:
+                stream.delivery_attempts.pop(result.submission_id, None)
+            if not settled:
+                stream.mark_held = True
+            elif not stream.mark_held:
+                if isinstance(result.submission_id, int) and (max_id is None or result.submission_id > max_id):
+                    max_id = result.submission_id
+                if result.submission_time and (max_time is None or result.submission_time > max_time):
+                    max_time = result.submission_time
+
+            if result.duplicate:
+                continue  # delivered and logged the first time round
+
+            status = "success" if result.success else "failed"
+
+            # 🔹 Log webhook activity
+            log = WebhookLog(
+                user_id=stream.user_id,
+                source_ip="kobo_client",
+                user_agent="streaming_worker",
+                payload_size=result.payload_size,
+                kobo_form_id=result.form_id,
+                submission_uuid=result.submission_uuid,
+                status=status,
+                error_message=result.error_message,
+                retry_count=0,
+                eventstream_sent=result.success,
+                processing_time_ms=result.elapsed_ms
+            )
+            self.db_session.add(log)
+
+            # 🔹 Log eventstream attempt
+            metrics = EventStreamMetrics(
+                user_id=stream.user_id,
+                webhook_log=log,
+                attempt_number=1,
+                success=result.success,
+                error_type=("EventStreamError" if result.error_message else None),
+                error_message=result.error_message,
+                transmission_time_ms=result.elapsed_ms,
+                payload_preview=result.payload_preview
+            )
+            self.db_session.add(metrics)
+
+        # 🔹 Commit logs and checkpoint together, once per page
+        if checkpoint is not None:
+            checkpoint.last_submission_id = max_id
+            checkpoint.last_submission_time = max_time
+        self.db_session.commit()
+        stream.last_submission_id = max_id
+        stream.last_submission_time = max_time
+
+
+    def _dead_letter_if_exhausted(self, stream: ProjectStream, result: "DeliveryResult") -> bool:
+        """Count a failed delivery; after the last attempt keep the payload for replay and let the mark pass."""
+        attempts = stream.delivery_attempts.get(result.submission_id, 0) + 1
+        if attempts < stream.max_delivery_attempts or result.event is None:
+            # Without its payload it cannot be replayed later, so keep retrying it
+            stream.delivery_attempts[result.submission_id] = attempts
+            return False
+        stream.delivery_attempts.pop(result.submission_id, None)
+        dead_letter_store.add(
+            self.db_session, result.event, result.error_message, source="stream", attempts=attempts,
+            user_id=stream.user_id, project_uid=stream.project_uid,
+            kobo_form_id=result.form_id, submission_uuid=result.submission_uuid,
+        )
+        result.event = None
+        logger.error(f"Submission {result.submission_id} of {stream.project_uid} failed {attempts} times; "
+                     f"moved to dead letters")
+        return True
 
     # ------------------------
     # Helpers
     # ------------------------
-    def _transform_submission_to_webhook(self, submission: Dict) -> Dict:
-        """Transform submission to webhook-compatible format with metadata."""
-        data = submission.copy()
+    def _transform_submission_to_webhook(self, submission: Dict, stream: Optional[ProjectStream] = None) -> Dict:
+        """
+        Transform submission to webhook-compatible format with metadata.
+
+        With typed payloads on, the stream's compiled form transformer casts
+        values and flattens group paths; otherwise the submission is copied as is.
+        """
+        transformer = None
+        if stream is not None and stream.typed_payloads:
+            transformer = self.form_schemas.get_transformer(
+                stream.server_url, stream.api_token, stream.project_uid, submission.get("__version__")
+            )
+        data = transformer.apply(submission) if transformer is not None else submission.copy()
         if "_submission_time" not in data:
             data["_submission_time"] = datetime.utcnow().isoformat()
 
@@ -0,0 +1,189 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import LogWriterConfig, log_writer_config
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """
+    Single writer for log and metric rows (WebhookLog, EventStreamMetrics,
+    DeadLetter).
+
+    Request and send threads hand their rows to ``write()`` and carry on; a
+    background thread inserts whatever is queued every ``max_batch`` records
+    or ``max_latency_ms``, in one transaction, so concurrent requests share a
+    commit instead of serializing on the database. A batch the database
+    rejects is retried row by row, so one bad record does not take its
+    neighbours with it.
+    """
+
+    def __init__(self, writer_config: LogWriterConfig = log_writer_config):
+        self.max_batch = max(1, writer_config.max_batch)
+        self.max_latency = writer_config.max_latency_ms / 1000.0
+        self.app = None
+        self._queue: "queue.Queue[Tuple[Any, Optional[Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.records_written = 0
+        self.records_failed = 0
+        self.commits = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+
+    def init_app(self, app):
+        """Remember the app whose database receives the rows; the writer thread starts on first use."""
+        if self.app is None:
+            atexit.register(self.shutdown)
+        self.app = app
+
+    def write(self, record) -> Future:
+        """Queue a model instance for insert; the future resolves to its id once committed."""
+        if self.app is None:
+            raise RuntimeError("Log writer used before init_app()")
+        future = Future()
+        self._ensure_writer()
+        self._queue.put((record, future))
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is committed."""
+        if self.app is None or self._thread is None:
+            return True
+        barrier = Future()
+        self._queue.put((None, barrier))
+        try:
+            barrier.result(timeout)
+            return True
+        except Exception:
+            return False
+
+    def shutdown(self, timeout: float = 10.0):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.flush(timeout)
+        self._stop.set()
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "records_written": self.records_written,
+            "records_failed": self.records_failed,
+            "commits": self.commits,
+            "last_batch_size": self.last_batch_size,
+            "last_commit_ms": round(self.last_commit_ms, 2),
+            "avg_commit_ms": round(self.total_commit_ms / self.commits, 2) if self.commits else 0,
+            "max_commit_ms": round(self.max_commit_ms, 2),
+            "writer_alive": self._thread is not None and self._thread.is_alive(),
+        }
+
+    # ------------------------
+    # Writer thread
+    # ------------------------
+    def _ensure_writer(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's thread and queued rows stay with the parent
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+            elif self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logger.error(f"Log writer batch failed: {str(e)}")
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, batch: List[Tuple[Any, Optional[Future]]]):
+        rows = [(record, future) for record, future in batch if record is not None]
+        if rows:
+            self._write_rows(rows)
+        for record, future in batch:
+            if record is None and future is not None:
+                future.set_result(None)
+
+    def _write_rows(self, rows: List[Tuple[Any, Future]]):
+        with self.app.app_context():
+            start = time.perf_counter()
+            try:
+                ids = self._insert([record for record, _ in rows])
+            except Exception as e:
+                db.session.rollback()
+                if len(rows) > 1:
+                    logger.warning(f"Log writer batch of {len(rows)} rejected ({str(e)}); retrying row by row")
+                    ids = self._insert_each(rows)
+                else:
+                    logger.error(f"Log writer failed to save {type(rows[0][0]).__name__}: {str(e)}")
+                    ids = [e] * len(rows)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.commits += 1
+        self.last_batch_size = len(rows)
+        self.last_commit_ms = elapsed_ms
+        self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+        self.total_commit_ms += elapsed_ms
+        for (_, future), record_id in zip(rows, ids):
+            if isinstance(record_id, Exception):
+                self.records_failed += 1
+                future.set_exception(record_id)
+            else:
+                self.records_written += 1
+                future.set_result(record_id)
+
+    @staticmethod
+    def _insert(records: List[Any]) -> List[int]:
+        """Add the rows in one transaction; returns their ids."""
+        db.session.add_all(records)
+        db.session.flush()
+        ids = [record.id for record in records]
+        db.session.commit()
+        return ids
+
+    def _insert_each(self, rows: List[Tuple[Any, Future]]) -> List[Any]:
+        results: List[Any] = []
+        for record, _ in rows:
+            try:
+                results.append(self._insert([record])[0])
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Log writer dropped {type(record).__name__}: {str(e)}")
+                results.append(e)
+        return results
+
+
+# Global writer instance
+log_writer = GroupCommitWriter()
@@ -1,4 +1,9 @@
 from app import app
 
+# Serving entry point (python main.py, gunicorn main:app): only a serving
+# process renews stream leases and adopts orphaned project streams
+if "stream_leases" in app.extensions:
+    app.extensions["stream_leases"].start()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", use_reloader=False, port=5000, debug=True)
@@ -71,6 +71,112 @@ class EventStreamMetrics(db.Model):
     def __repr__(self):
         return f'<EventStreamMetrics {self.id}: {"success" if self.success else "failed"}>'
 
+class SyncCheckpoint(db.Model):
+    """Model to persist the streaming high-water mark of each Kobo project."""
+    __tablename__ = 'sync_checkpoints'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'server_url', 'project_uid', name='uq_sync_checkpoint_project'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    server_url = db.Column(db.String(255), nullable=False)
+    project_uid = db.Column(db.String(100), nullable=False)
+    last_submission_id = db.Column(db.BigInteger)
+    last_submission_time = db.Column(db.String(40))  # as returned by Kobo (ISO 8601)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<SyncCheckpoint {self.project_uid}: {self.last_submission_id}>'
+
+class BackfillJob(db.Model):
+    """Model to track a historical backfill of one Kobo project and its resumable progress."""
+    __tablename__ = 'backfill_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    server_url = db.Column(db.String(255), nullable=False)
+    project_uid = db.Column(db.String(100), nullable=False)
+    range_start = db.Column(db.String(40))  # _submission_time bounds (ISO 8601)
+    range_end = db.Column(db.String(40))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, paused, completed, failed
+    windows = db.Column(JSON)  # [{start, end, last_id, fetched, done}, ...]
+    submissions_fetched = db.Column(db.Integer, default=0)
+    submissions_sent = db.Column(db.Integer, default=0)
+    duplicates_skipped = db.Column(db.Integer, default=0)
+    bytes_fetched = db.Column(db.BigInteger, default=0)
+    elapsed_seconds = db.Column(db.Float, default=0.0)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<BackfillJob {self.id}: {self.project_uid} {self.status}>'
+
+class StreamLease(db.Model):
+    """Model to elect the single process that streams a Kobo project (lease with heartbeat)."""
+    __tablename__ = 'stream_leases'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'server_url', 'project_uid', name='uq_stream_lease_project'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    server_url = db.Column(db.String(255), nullable=False)
+    project_uid = db.Column(db.String(100), nullable=False)
+    desired_state = db.Column(db.String(20), nullable=False, default='running')  # running, stopped
+    owner_id = db.Column(db.String(100))  # host:pid:nonce of the owning process
+    expires_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    api_token = db.Column(db.Text)  # encrypted, so any process can take the stream over
+    eventstream_config = db.Column(db.Text)  # encrypted JSON
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<StreamLease {self.project_uid}: {self.owner_id}>'
+
+class DeadLetter(db.Model):
+    """Model to keep payloads that could not be delivered to EventStream, for replay."""
+    __tablename__ = 'dead_letters'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)  # None if no owner was known when it failed
+    source = db.Column(db.String(20), nullable=False)  # webhook, stream
+    webhook_log_id = db.Column(db.Integer, db.ForeignKey("webhook_logs.id"), nullable=True)
+    project_uid = db.Column(db.String(100))
+    kobo_form_id = db.Column(db.String(100), index=True)
+    submission_uuid = db.Column(db.String(100))
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON body
+    payload_size = db.Column(db.Integer)  # uncompressed bytes
+    error_type = db.Column(db.String(100), index=True)
+    error_message = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=1, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending, replayed
+    first_failed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_failed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    replayed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<DeadLetter {self.id}: {self.kobo_form_id} {self.status}>'
+
+class DeadLetterReplay(db.Model):
+    """Model to track a bulk dead-letter replay running in the background."""
+    __tablename__ = 'dead_letter_replays'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    filters = db.Column(JSON)  # {form_id, error_type, ids, limit, concurrency}
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, completed, failed
+    replayed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    elapsed_seconds = db.Column(db.Float, default=0.0)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<DeadLetterReplay {self.id}: {self.status}>'
+
 class AppConfiguration(db.Model):
     """Model to store application configuration settings."""
     __tablename__ = 'app_configuration'
@@ -100,6 +206,7 @@ class UserEventStreamConfig(db.Model):
     max_retries = db.Column(db.Integer, default=3)
     retry_delay = db.Column(db.Float, default=1.0)
     timeout = db.Column(db.Integer, default=30)
+    partition_key_field = db.Column(db.String(255), nullable=True)  # payload field used as partition key
 
     user = db.relationship("User", back_populates="eventstream_config")
 
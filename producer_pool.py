@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from azure.eventhub import EventHubProducerClient
+
+from config import EventStreamConfig, ProducerPoolConfig, producer_pool_config
+
+logger = logging.getLogger(__name__)
+
+
+class SharedProducer:
+    """
+    A pooled producer used by many threads at once.
+
+    The SDK's producer clients are not thread-safe, so ``create_batch``,
+    ``send_batch`` and ``close`` go through one lock per hub. A send holds
+    the lock for its round trip, which the SDK would serialize on the
+    hub's single send link anyway; other attributes pass through unlocked.
+    """
+
+    def __init__(self, producer: EventHubProducerClient):
+        self.producer = producer
+        self._lock = threading.Lock()
+
+    def create_batch(self, **kwargs):
+        with self._lock:
+            return self.producer.create_batch(**kwargs)
+
+    def send_batch(self, batch, **kwargs):
+        with self._lock:
+            return self.producer.send_batch(batch, **kwargs)
+
+    def close(self):
+        with self._lock:
+            self.producer.close()
+
+    def __getattr__(self, name):
+        return getattr(self.producer, name)
+
+
+class ProducerPool:
+    """
+    Process-wide pool of EventHub producers.
+
+    Producers are keyed by connection string and entity path, so every
+    ``EventStreamClient`` (and every user) sending to the same hub shares
+    one AMQP connection. A background thread keeps idle-but-recent
+    producers' links open and closes producers unused for ``idle_ttl``
+    seconds. ``warm()`` opens a producer ahead of the first send.
+    Callers get a ``SharedProducer`` that serializes batch creation and
+    sends, rather than a producer per thread, so the pool keeps one
+    connection per hub.
+    """
+
+    def __init__(self, pool_config: ProducerPoolConfig = producer_pool_config):
+        self.idle_ttl = pool_config.idle_ttl_seconds
+        self.keepalive_interval = pool_config.keepalive_seconds
+        self._producers: Dict[Tuple[str, str], SharedProducer] = {}
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self.created = 0
+        self.reused = 0
+        self.reaped = 0
+        self.discarded = 0
+
+    @staticmethod
+    def key_for(config: EventStreamConfig) -> Tuple[str, str]:
+        """``(connection string, entity path)`` identifying a hub."""
+        entity_path = ""
+        for part in config.connection_string.split(";"):
+            name, _, value = part.partition("=")
+            if name.strip().lower() == "entitypath":
+                entity_path = value.strip()
+        return config.connection_string, entity_path
+
+    def acquire(self, config: EventStreamConfig) -> SharedProducer:
+        """The shared producer for a hub, created on first use."""
+        key = self.key_for(config)
+        with self._lock:
+            producer = self._producers.get(key)
+            if producer is None:
+                producer = SharedProducer(
+                    EventHubProducerClient.from_connection_string(conn_str=config.connection_string)
+                )
+                self._producers[key] = producer
+                self.created += 1
+                logger.info(f"Opened EventHub producer for {key[1] or 'hub'}")
+            else:
+                self.reused += 1
+            self._last_used[key] = time.monotonic()
+            self._ensure_reaper()
+        return producer
+
+    def discard(self, config: EventStreamConfig, producer: SharedProducer):
+        """Drop a producer that can no longer be used (closed, bad credentials)."""
+        key = self.key_for(config)
+        with self._lock:
+            if self._producers.get(key) is not producer:
+                return
+            del self._producers[key]
+            self._last_used.pop(key, None)
+            self.discarded += 1
+        self._close(key, producer)
+
+    def warm(self, config: EventStreamConfig):
+        """Open the hub's producer and its send link in the background (e.g. when config is saved)."""
+        def connect():
+            try:
+                self.acquire(config).create_batch()
+                logger.info(f"Pre-connected EventHub producer for {self.key_for(config)[1] or 'hub'}")
+            except Exception as e:
+                logger.warning(f"EventHub producer warm-up failed: {str(e)}")
+
+        threading.Thread(target=connect, name="eventstream-warmup", daemon=True).start()
+
+    def close_all(self):
+        self._stop.set()
+        with self._lock:
+            producers = list(self._producers.items())
+            self._producers.clear()
+            self._last_used.clear()
+        for key, producer in producers:
+            self._close(key, producer)
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            idle = {key[1] or "hub": round(now - used, 1) for key, used in self._last_used.items()}
+        return {
+            "producers": len(idle),
+            "idle_seconds": idle,
+            "created": self.created,
+            "reused": self.reused,
+            "reaped": self.reaped,
+            "discarded": self.discarded,
+            "idle_ttl_seconds": self.idle_ttl,
+        }
+
+    def _ensure_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._stop.clear()
+            self._reaper = threading.Thread(target=self._maintain, name="eventstream-pool", daemon=True)
+            self._reaper.start()
+
+    def _maintain(self):
+        while not self._stop.wait(self.keepalive_interval):
+            now = time.monotonic()
+            with self._lock:
+                expired = [key for key, used in self._last_used.items() if now - used > self.idle_ttl]
+                reaped = [(key, self._producers.pop(key)) for key in expired]
+                for key in expired:
+                    del self._last_used[key]
+                live = list(self._producers.items())
+            for key, producer in reaped:
+                self.reaped += 1
+                logger.info(f"Closing EventHub producer for {key[1] or 'hub'} after {self.idle_ttl:.0f}s idle")
+                self._close(key, producer)
+            for key, producer in live:
+                try:
+                    # Reopens the send link if the service dropped it while idle
+                    producer.create_batch()
+                except Exception as e:
+                    logger.warning(f"EventHub keep-alive failed for {key[1] or 'hub'}: {str(e)}")
+
+    @staticmethod
+    def _close(key: Tuple[str, str], producer: SharedProducer):
+        try:
+            producer.close()
+        except Exception as e:
+            logger.warning(f"Error closing EventHub producer for {key[1] or 'hub'}: {e}")
+
+
+# Global pool instance
+producer_pool = ProducerPool()
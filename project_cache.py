@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedProjectList:
+    """One user's asset list on one server, with its HTTP validators."""
+    projects: List[Dict[str, Any]]
+    token_hash: str
+    fetched_at: float = field(default_factory=time.monotonic)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    revalidations: int = 0
+
+
+class ProjectListCache:
+    """
+    TTL cache of Kobo project listings keyed by user and server.
+
+    Fresh entries are served without touching Kobo. Stale entries are kept
+    with their ``ETag``/``Last-Modified`` so the caller can revalidate with a
+    conditional request and reuse them on ``304 Not Modified``. Listings that
+    span several pages are stored without validators, since a 304 for the
+    first page does not cover the others. An entry is dropped as soon as it
+    is looked up with a different API token.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[Any, str], CachedProjectList] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def hash_token(api_token: str) -> str:
+        return hashlib.sha256((api_token or "").encode()).hexdigest()
+
+    def lookup(self, user_id, server_url: str, api_token: str) -> Tuple[Optional[CachedProjectList], bool]:
+        """Return ``(entry, is_fresh)``; ``entry`` is None on a miss."""
+        key = (user_id, server_url.rstrip("/"))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.token_hash != self.hash_token(api_token):
+                # Credentials changed: the old listing may not be visible any more
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            fresh = time.monotonic() - entry.fetched_at < self.ttl_seconds
+            if fresh:
+                self.hits += 1
+            return entry, fresh
+
+    def store(self, user_id, server_url: str, api_token: str, projects: List[Dict[str, Any]],
+              etag: Optional[str] = None, last_modified: Optional[str] = None) -> CachedProjectList:
+        entry = CachedProjectList(
+            projects=projects,
+            token_hash=self.hash_token(api_token),
+            etag=etag,
+            last_modified=last_modified,
+        )
+        with self._lock:
+            self._entries[(user_id, server_url.rstrip("/"))] = entry
+        return entry
+
+    def mark_revalidated(self, entry: CachedProjectList):
+        """A 304 came back: the cached list is good for another TTL."""
+        with self._lock:
+            entry.fetched_at = time.monotonic()
+            entry.revalidations += 1
+            self.not_modified += 1
+
+    def invalidate(self, user_id=None, server_url: Optional[str] = None) -> int:
+        """Drop entries for a user (and optionally one server); everything when no user is given."""
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (user_id is None or key[0] == user_id)
+                and (server_url is None or key[1] == server_url.rstrip("/"))
+            ]
+            for key in keys:
+                del self._entries[key]
+        if keys:
+            logger.debug(f"Invalidated {len(keys)} cached project list(s)")
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from retry_handler import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class KoboServerUnavailable(Exception):
+    """Raised instead of calling a Kobo server that is down or has throttled us for too long."""
+
+    def __init__(self, server: str, retry_after: float, reason: str = "unavailable"):
+        super().__init__(f"KoboToolbox server {server} is {reason}; retrying in {retry_after:.0f}s")
+        self.server = server
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that hands out reservations.
+
+    ``reserve()`` takes a token immediately and returns how long the caller
+    must wait before using it, so concurrent callers are spaced out at
+    ``rate`` per second after an initial ``burst``. ``pause()`` empties the
+    bucket until a point in time (used for ``Retry-After``).
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()  # refill starts here (may be in the future while paused)
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, self._updated - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait
+
+    def pause(self, seconds: float):
+        with self._lock:
+            resume = time.monotonic() + seconds
+            if resume > self._updated:
+                self._tokens = min(self._tokens, 0.0)
+                self._updated = resume
+
+
+class KoboRateLimiter:
+    """
+    Request budget for the KoboToolbox API, shared by every caller of a client.
+
+    Kobo throttles per API token, so there is one token bucket per server
+    and token; a ``429`` pauses that bucket for ``Retry-After``. Server
+    failures (5xx, connection errors) feed one circuit breaker per server,
+    and while it is open requests fail fast with ``KoboServerUnavailable``.
+    """
+
+    def __init__(self, rate_per_second: float = 5.0, burst: int = 10, default_retry_after: float = 30.0,
+                 failure_threshold: int = 5, recovery_timeout: float = 60.0):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.default_retry_after = default_retry_after
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+        self.rejected = 0
+
+    @staticmethod
+    def key_for(url: str, headers: Optional[Dict[str, str]] = None) -> Tuple[str, str]:
+        """``(server, token hash)`` for a request; the token is read from the Authorization header."""
+        auth = (headers or {}).get("Authorization", "")
+        return urlparse(url).netloc, hashlib.sha256(auth.encode()).hexdigest()[:16]
+
+    def reserve(self, key: Tuple[str, str]) -> float:
+        """Seconds to wait before sending; raises if the server's breaker is open."""
+        breaker = self._breaker(key[0])
+        if not breaker.allow_request():
+            self.rejected += 1
+            raise KoboServerUnavailable(key[0], breaker.seconds_until_retry())
+        wait = self._bucket(key).reserve()
+        self.requests += 1
+        self.waited_seconds += wait
+        return wait
+
+    def record_response(self, key: Tuple[str, str], status_code: int, retry_after: Optional[str] = None) -> float:
+        """Update the bucket/breaker from a response; returns the back-off for a 429 (0 otherwise)."""
+        breaker = self._breaker(key[0])
+        if status_code == 429:
+            delay = self.parse_retry_after(retry_after, self.default_retry_after)
+            self._bucket(key).pause(delay)
+            self.throttled += 1
+            logger.warning(f"KoboToolbox {key[0]} throttled this token; pausing requests for {delay:.1f}s")
+            return delay
+        if status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return 0.0
+
+    def record_error(self, key: Tuple[str, str]):
+        """A request failed without a response (connection error, timeout)."""
+        self._breaker(key[0]).record_failure()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_second": self.rate_per_second,
+            "burst": self.burst,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "rejected_by_breaker": self.rejected,
+            "waited_seconds": round(self.waited_seconds, 2),
+            "buckets": len(self._buckets),
+            "breakers": {server: breaker.state for server, breaker in self._breakers.items()},
+        }
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str], default: float) -> float:
+        """``Retry-After`` as seconds (delta-seconds or HTTP-date)."""
+        if not value:
+            return default
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return default
+
+    def _bucket(self, key: Tuple[str, str]) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate_per_second, self.burst)
+            return bucket
+
+    def _breaker(self, server: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(server)
+            if breaker is None:
+                breaker = self._breakers[server] = CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+            return breaker
@@ -110,12 +110,8 @@ class CircuitBreaker:
         Raises:
             Exception: Circuit breaker open or function failed
         """
-        if self.state == 'OPEN':
-            if self._should_attempt_reset():
-                self.state = 'HALF_OPEN'
-                logger.info("Circuit breaker moving to HALF_OPEN state")
-            else:
-                raise Exception(f"Circuit breaker OPEN. Last failure: {self.last_failure_time}")
+        if not self.allow_request():
+            raise Exception(f"Circuit breaker OPEN. Last failure: {self.last_failure_time}")
         
         try:
             result = func(*args, **kwargs)
@@ -126,6 +122,28 @@ class CircuitBreaker:
             self._on_failure()
             raise e
     
+    def allow_request(self) -> bool:
+        """True unless the breaker is OPEN (moves to HALF_OPEN once the recovery timeout passed)."""
+        if self.state == 'OPEN':
+            if not self._should_attempt_reset():
+                return False
+            self.state = 'HALF_OPEN'
+            logger.info("Circuit breaker moving to HALF_OPEN state")
+        return True
+    
+    def record_success(self):
+        """Report the outcome of a call made outside ``call()``."""
+        self._on_success()
+    
+    def record_failure(self):
+        self._on_failure()
+    
+    def seconds_until_retry(self) -> float:
+        """Time left before an OPEN breaker lets a trial request through."""
+        if self.state != 'OPEN' or self.last_failure_time is None:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.time() - self.last_failure_time))
+    
     def _should_attempt_reset(self) -> bool:
         """Check if enough time has passed to attempt reset."""
         return (
@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime, timedelta
 from flask import request, jsonify, render_template, session,redirect, url_for
 from sqlalchemy import func
@@ -8,8 +9,15 @@ from webhook_handler import webhook_handler
 from eventstream_client import EventStreamClient, get_eventstream_client
 #from eventstream_client import EventStreamClient
 from config_service import config_service
-from models import WebhookLog, db, User, UserEventStreamConfig
+from config import EventStreamConfig, stream_lease_config
+from models import WebhookLog, db, User, UserEventStreamConfig, BackfillJob, DeadLetterReplay
 from kobo_client import KoboToolboxClient
+from backfill import BackfillManager
+from dead_letters import DeadLetterReplayManager, dead_letter_store
+from health_snapshot import health_registry
+from log_writer import log_writer
+from producer_pool import producer_pool
+from webhook_outbox import webhook_outbox
 #from flask_login import current_user, login_required
 from eventstream_client import get_eventstream_client
 from sqlalchemy.exc import IntegrityError
@@ -20,7 +28,33 @@ def register_routes(app):
     """Register all routes with the Flask application."""
         
     # Initialize KoboToolbox client
-    kobo_client = KoboToolboxClient(config_service)
+    kobo_client = KoboToolboxClient(config_service, app=app)
+
+    # Streaming engine: "threaded" (scheduler + worker pool) or "asyncio"
+    if os.getenv("KOBO_STREAMING_ENGINE", "threaded").lower() == "asyncio":
+        from kobo_async import AsyncKoboStreamer
+        streaming_engine = AsyncKoboStreamer(kobo_client)
+    else:
+        streaming_engine = kobo_client
+
+    # One owner per project stream across gunicorn workers
+    if stream_lease_config.enabled:
+        from stream_lease import LeasedStreamingEngine
+        streaming_engine = LeasedStreamingEngine(streaming_engine, kobo_client)
+        # The heartbeat starts from the serving entry point (main.py), not on import
+        app.extensions["stream_leases"] = streaming_engine
+
+    backfill_manager = BackfillManager(
+        kobo_client, max_concurrency=int(os.getenv("KOBO_BACKFILL_CONCURRENCY", "4"))
+    )
+    replay_manager = DeadLetterReplayManager(app)
+
+    # Webhook payloads are delivered from the durable outbox by background drainers
+    webhook_outbox.init_app(app)
+    # WebhookLog/EventStreamMetrics rows are inserted in group commits by one writer thread
+    log_writer.init_app(app)
+    # EventStream health lives in memory and is written to SystemHealth periodically
+    health_registry.init_app(app)
     
     @app.route("/")
     def home():
@@ -37,7 +71,13 @@ def register_routes(app):
         try:
             success, message, data = webhook_handler.process_webhook(request)
             
-            if success:
+            if success and data.get("queued"):
+                return jsonify({
+                    "status": "accepted",
+                    "message": message,
+                    "data": data
+                }), 202
+            elif success:
                 return jsonify({
                     "status": "success",
                     "message": message,
@@ -122,6 +162,7 @@ def register_routes(app):
                     "max_retries": user.eventstream_config.max_retries,
                     "retry_delay": user.eventstream_config.retry_delay,
                     "timeout": user.eventstream_config.timeout,
+                    "partition_key_field": user.eventstream_config.partition_key_field,
                     "user_id": user.eventstream_config.user_id,
                 }
             
@@ -170,10 +211,8 @@ def register_routes(app):
         session.pop("eventstream_config", None)
         session.clear()
         #logout_user()
-        kobo_client.stop_streaming()
-        # ✅ Shut down EventStream producer to stop retries
-        eventstream_client = get_eventstream_client()
-        eventstream_client.shutdown()
+        streaming_engine.stop_streaming(user_id=current_user.id)
+        # The shared EventStream client keeps serving webhooks for other sessions
         logger.info("@ /logout. REAL-TIME STREAMING STOPPED")
         print("Successfully logged out!")
         return jsonify({"message": "Logged out"})
@@ -217,7 +256,10 @@ def register_routes(app):
                     "success_rate_percent": round(success_rate, 2),
                     "recent_errors_24h": recent_errors
                 },
-                "eventstream": eventstream_health
+                "eventstream": eventstream_health,
+                "system_health": health_registry.get_stats(user_id=current_user.id),
+                "outbox": webhook_outbox.get_stats(),
+                "log_writer": log_writer.get_stats()
             }
             
             return jsonify(health_status), 200
@@ -279,6 +321,9 @@ def register_routes(app):
                 "today_success_rate": round((today_successful / today_webhooks * 100) if today_webhooks > 0 else 0, 2),
                 "average_processing_time_ms": round(avg_processing_time, 2),
                 "eventstream_metrics": eventstream_metrics,
+                "system_health": health_registry.get_stats(user_id=current_user.id),
+                "outbox": webhook_outbox.get_stats(),
+                "log_writer": log_writer.get_stats(),
                 "last_updated": datetime.utcnow().isoformat()
             }
             
@@ -382,7 +427,13 @@ def register_routes(app):
             "max_retries": int(data.get("max_retries", 3)),
             "retry_delay": float(data.get("retry_delay", 1.0)),
             "timeout": int(data.get("timeout", 30)),
+            "partition_key_field": data.get("partition_key_field") or None,
         }
+        try:
+            # Open the hub connection now so the first send doesn't pay for it
+            producer_pool.warm(EventStreamConfig.from_db_or_session(session["eventstream_config"]))
+        except Exception as e:
+            logger.warning(f"Could not pre-connect EventStream producer: {str(e)}")
 
         if data.get("save_to_db"):
             try: 
@@ -398,6 +449,7 @@ def register_routes(app):
                         and cfg.max_retries == int(data.get("max_retries", 3))
                         and cfg.retry_delay == float(data.get("retry_delay", 1.0))
                         and cfg.timeout == int(data.get("timeout", 30))
+                        and cfg.partition_key_field == (data.get("partition_key_field") or None)
                     )
 
                     if same:
@@ -411,6 +463,7 @@ def register_routes(app):
                         cfg.max_retries = int(data.get("max_retries", 3))
                         cfg.retry_delay = float(data.get("retry_delay", 1.0))
                         cfg.timeout = int(data.get("timeout", 30))
+                        cfg.partition_key_field = data.get("partition_key_field") or None
                         db.session.commit()
 
                 else:
@@ -424,6 +477,7 @@ def register_routes(app):
                         max_retries=int(data.get("max_retries", 3)),
                         retry_delay=float(data.get("retry_delay", 1.0)),
                         timeout=int(data.get("timeout", 30)),
+                        partition_key_field=data.get("partition_key_field") or None,
                     )
                     db.session.add(cfg)
                     db.session.commit()
@@ -499,7 +553,8 @@ def register_routes(app):
             }
             
             #success = eventstream_client.send_to_eventstream(test_payload)
-            client = get_eventstream_client(config=eventstream_config)
+            # Webhooks are sent with this config from now on, so they belong to this user
+            client = get_eventstream_client(config=eventstream_config, user_id=current_user.id)
             # Create client from this config
             
             #client = EventStreamClient(eventstream_config)
@@ -552,7 +607,14 @@ def register_routes(app):
                 return jsonify({"error": "Base URL and API token required"}), 400
 
             #success = config_service.update_api_config(server_url, api_token)
+            credentials_changed = (
+                session.get("server_url") != server_url.strip()
+                or session.get("api_token") != api_token.strip()
+            )
             config_service.set_api_config(server_url, api_token)
+            if credentials_changed:
+                user_id = (session.get("eventstream_config") or {}).get("user_id")
+                kobo_client.invalidate_project_cache(user_id)
            
             return jsonify({"status": "success", "message": "KoboToolbox config saved"}), 200
             
@@ -596,7 +658,7 @@ def register_routes(app):
             data = request.json
             session['server_url'] = data.get('server_url')
             session['api_token'] = data.get('api_token')
-            projects = kobo_client.get_projects()
+            projects = kobo_client.get_projects(force_refresh=bool(data.get('refresh')))
             return jsonify({"projects": projects}), 200
         except Exception as e:
             logger.error(f"Failed to fetch projects: {str(e)}")
@@ -604,12 +666,220 @@ def register_routes(app):
         
 
     @app.route("/api/streaming/status", methods=["GET"])
+    @login_required
     def streaming_status():
-        # Example: you can maintain a variable in memory, Redis, or DB
+        status = streaming_engine.get_streaming_status(user_id=current_user.id)
+        status["status"] = "running" if status.get("active") else "stopped"
+        status["last_checked"] = datetime.utcnow().isoformat()
+        return jsonify(status)
+
+    @app.route("/api/kobo/streams", methods=["GET"])
+    @login_required
+    def list_kobo_streams():
+        """Status of the current user's project streams."""
+        return jsonify(streaming_engine.get_streaming_status(user_id=current_user.id)), 200
+
+    @app.route("/api/kobo/streams/<project_uid>", methods=["GET"])
+    @login_required
+    def kobo_stream_status(project_uid):
+        """Status of a single project stream."""
+        return jsonify(streaming_engine.get_streaming_status(project_uid, user_id=current_user.id)), 200
+
+    @app.route("/api/kobo/streams/<project_uid>/start", methods=["POST"])
+    @login_required
+    def start_kobo_stream(project_uid):
+        """Start streaming one project alongside any already running."""
+        try:
+            eventstream_config = config_service.get_eventstream_config()
+            if not eventstream_config:
+                return jsonify({"status": "error", "message": "No EventStream config available"}), 400
+
+            client = EventStreamClient(config=eventstream_config)
+            success, message = streaming_engine.start_streaming(client, project_id=project_uid)
+            return jsonify({
+                "status": "success" if success else "error",
+                "message": message
+            }), 200 if success else 400
+        except Exception as e:
+            logger.error(f"Failed to start stream for {project_uid}: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+    @app.route("/api/kobo/streams/<project_uid>/stop", methods=["POST"])
+    @login_required
+    def stop_kobo_stream(project_uid):
+        """Stop streaming one project."""
+        success, message = streaming_engine.stop_streaming(project_uid, user_id=current_user.id)
+        return jsonify({
+            "status": "success" if success else "error",
+            "message": message
+        }), 200 if success else 400
+
+    @app.route("/api/kobo/backfill", methods=["POST"])
+    @login_required
+    def start_kobo_backfill():
+        """Plan and start a parallel backfill of a project's existing submissions."""
+        try:
+            data = request.get_json() or {}
+            config = kobo_client.get_api_config()
+            project_uid = data.get("project_id") or config.get("project_id")
+            if not config.get("server_url") or not config.get("api_token"):
+                return jsonify({"status": "error", "message": "Missing KoboToolbox configuration"}), 400
+            if not project_uid:
+                return jsonify({"status": "error", "message": "Missing KoboToolbox project ID"}), 400
+
+            eventstream_config = config_service.get_eventstream_config()
+            if not eventstream_config:
+                return jsonify({"status": "error", "message": "No EventStream config available"}), 400
+
+            job = backfill_manager.create_job(
+                current_user.id,
+                config["server_url"],
+                config["api_token"],
+                project_uid,
+                range_start=data.get("start"),
+                range_end=data.get("end"),
+                window_count=int(data.get("windows") or config_service.get_setting("kobo_backfill_windows", "16")),
+            )
+            if job.status == "completed":
+                return jsonify({"status": "success", "message": "Project has no submissions to backfill",
+                                "job": backfill_manager.get_status(job.id)}), 200
+
+            client = EventStreamClient(config=eventstream_config)
+            page_size = int(config_service.get_setting("kobo_backfill_page_size", "500"))
+            success, message = backfill_manager.start_job(job.id, client, config["api_token"], page_size=page_size)
+            return jsonify({
+                "status": "success" if success else "error",
+                "message": message,
+                "job": backfill_manager.get_status(job.id),
+            }), 202 if success else 400
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Failed to start backfill: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+    @app.route("/api/kobo/backfill/<int:job_id>", methods=["GET"])
+    @login_required
+    def kobo_backfill_status(job_id):
+        """Progress and throughput of a backfill job."""
+        job = BackfillJob.query.get(job_id)
+        if not job or job.user_id != current_user.id:
+            return jsonify({"error": "Backfill job not found"}), 404
+        return jsonify(backfill_manager.get_status(job_id)), 200
+
+    @app.route("/api/kobo/backfill/<int:job_id>/resume", methods=["POST"])
+    @login_required
+    def resume_kobo_backfill(job_id):
+        """Resume a paused, failed or interrupted backfill from its saved cursors."""
+        try:
+            job = BackfillJob.query.get(job_id)
+            if not job or job.user_id != current_user.id:
+                return jsonify({"error": "Backfill job not found"}), 404
+
+            config = kobo_client.get_api_config()
+            eventstream_config = config_service.get_eventstream_config()
+            if not config.get("api_token") or not eventstream_config:
+                return jsonify({"status": "error", "message": "Missing KoboToolbox or EventStream configuration"}), 400
+
+            client = EventStreamClient(config=eventstream_config)
+            page_size = int(config_service.get_setting("kobo_backfill_page_size", "500"))
+            success, message = backfill_manager.start_job(job_id, client, config["api_token"], page_size=page_size)
+            return jsonify({
+                "status": "success" if success else "error",
+                "message": message
+            }), 202 if success else 400
+        except Exception as e:
+            logger.error(f"Failed to resume backfill {job_id}: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+    @app.route("/api/kobo/backfill/<int:job_id>/pause", methods=["POST"])
+    @login_required
+    def pause_kobo_backfill(job_id):
+        """Pause a running backfill; progress is kept."""
+        job = BackfillJob.query.get(job_id)
+        if not job or job.user_id != current_user.id:
+            return jsonify({"error": "Backfill job not found"}), 404
+        success, message = backfill_manager.pause_job(job_id)
         return jsonify({
-            "status": "stopped or not sure!",   # or "running"
-            "last_checked": datetime.utcnow().isoformat()
-        })
+            "status": "success" if success else "error",
+            "message": message
+        }), 200 if success else 400
+
+    @app.route("/api/dead-letters", methods=["GET"])
+    @login_required
+    def list_dead_letters():
+        """Undelivered payloads, filterable by form, error type and status."""
+        limit = min(request.args.get("limit", 100, type=int), 1000)
+        offset = request.args.get("offset", 0, type=int)
+        query = dead_letter_store.query(
+            db.session,
+            user_id=current_user.id,
+            form_id=request.args.get("form_id"),
+            error_type=request.args.get("error_type"),
+            status=request.args.get("status", "pending") or None,
+        )
+        letters = query.offset(offset).limit(limit).all()
+        return jsonify({
+            "total": query.count(),
+            "dead_letters": [{
+                "id": letter.id,
+                "source": letter.source,
+                "project_uid": letter.project_uid,
+                "form_id": letter.kobo_form_id,
+                "submission_uuid": letter.submission_uuid,
+                "payload_size": letter.payload_size,
+                "error_type": letter.error_type,
+                "error_message": letter.error_message,
+                "attempts": letter.attempts,
+                "status": letter.status,
+                "first_failed_at": letter.first_failed_at.isoformat() if letter.first_failed_at else None,
+                "last_failed_at": letter.last_failed_at.isoformat() if letter.last_failed_at else None,
+                "replayed_at": letter.replayed_at.isoformat() if letter.replayed_at else None,
+            } for letter in letters],
+        }), 200
+
+    @app.route("/api/dead-letters/replay", methods=["POST"])
+    @login_required
+    def replay_dead_letters():
+        """Start re-sending pending dead letters (by ids or filters) in the background."""
+        try:
+            data = request.get_json() or {}
+            eventstream_config = config_service.get_eventstream_config()
+            if not eventstream_config:
+                return jsonify({"status": "error", "message": "No EventStream config available"}), 400
+
+            client = EventStreamClient(config=eventstream_config)
+            job, message = replay_manager.start_job(
+                current_user.id,
+                client,
+                concurrency=int(data["concurrency"]) if data.get("concurrency") else None,
+                limit=int(data["limit"]) if data.get("limit") else None,
+                form_id=data.get("form_id"),
+                error_type=data.get("error_type"),
+                ids=data.get("ids"),
+            )
+            if job is None:
+                client.shutdown()
+                return jsonify({"status": "error", "message": message}), 409
+            return jsonify({
+                "status": "success",
+                "message": message,
+                "job": replay_manager.get_status(job),
+            }), 202
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to start dead-letter replay: {str(e)}")
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @app.route("/api/dead-letters/replay/<int:job_id>", methods=["GET"])
+    @login_required
+    def dead_letter_replay_status(job_id):
+        """Progress of a dead-letter replay."""
+        job = DeadLetterReplay.query.get(job_id)
+        if not job or job.user_id != current_user.id:
+            return jsonify({"error": "Dead-letter replay not found"}), 404
+        return jsonify(replay_manager.get_status(job)), 200
+
     @app.route("/api/kobo/start", methods=["POST"])
     def start_kobo_streaming():
         """Start KoboToolbox real-time streaming."""
@@ -638,7 +908,7 @@ def register_routes(app):
             #client = get_eventstream_client(eventstream_config)
             client = EventStreamClient(config=eventstream_config)
             #client = eventstream_client(config=eventstream_config)
-            success, message = kobo_client.start_streaming(client)
+            success, message = streaming_engine.start_streaming(client)
 
 
             if success:
@@ -653,7 +923,7 @@ def register_routes(app):
     def stop_kobo_streaming():
         """Stop KoboToolbox real-time streaming."""
         try:
-            kobo_client.stop_streaming()
+            streaming_engine.stop_streaming()
             # ✅ Shut down EventStream producer to stop retries
             eventstream_client = get_eventstream_client()
             eventstream_client.close()
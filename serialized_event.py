@@ -0,0 +1,48 @@
+import json
+import os
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # optional dependency: pip install .[fast-json] (orjson)
+    orjson = None
+
+# "json" forces the standard library encoder even when orjson is installed
+JSON_BACKEND = "orjson" if orjson is not None and os.getenv("EVENTSTREAM_JSON_BACKEND", "auto") != "json" else "json"
+
+
+def dumps(payload: Any) -> bytes:
+    """Encode a payload as UTF-8 JSON (unknown types via ``str``, like ``json.dumps(default=str)``)."""
+    if JSON_BACKEND == "orjson":
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, default=str).encode("utf-8")
+
+
+def loads(body: bytes) -> Any:
+    """Decode JSON produced by ``dumps``."""
+    if JSON_BACKEND == "orjson":
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class SerializedEvent:
+    """
+    A payload encoded once, on the way into the send path.
+
+    The same bytes are used for the event body, the logged/recorded payload
+    size and batching, so a submission is never JSON-encoded twice.
+    """
+
+    __slots__ = ("payload", "body", "size")
+
+    def __init__(self, payload: Dict[str, Any], body: bytes):
+        self.payload = payload
+        self.body = body
+        self.size = len(body)
+
+    @classmethod
+    def of(cls, payload: Union[Dict[str, Any], 'SerializedEvent']) -> 'SerializedEvent':
+        """Serialize a payload (an already serialized event is returned as is)."""
+        if isinstance(payload, cls):
+            return payload
+        return cls(payload, dumps(payload))
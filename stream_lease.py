@@ -0,0 +1,386 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from config import EventStreamConfig, StreamLeaseConfig, stream_lease_config
+from config_service import config_service
+from eventstream_client import EventStreamClient
+from models import StreamLease
+from stream_scheduler import StreamKey
+
+logger = logging.getLogger(__name__)
+
+
+class LeasedStreamingEngine:
+    """
+    Runs each project stream in exactly one process.
+
+    Wraps a streaming engine (the threaded ``KoboToolboxClient`` or the
+    asyncio streamer) with a lease per project in the ``stream_leases``
+    table. Starting a stream records it there with its encrypted
+    credentials; whichever process wins the compare-and-set on the row runs
+    it and renews the lease every ``heartbeat_seconds``. If the owner stops
+    renewing, any other process takes the stream over once the lease has
+    expired (``ttl_seconds``); an owner that cannot renew (database down)
+    stops its streams before that point (``local_ttl_seconds`` after its
+    last renewal attempt started). Stopping a stream flips its desired
+    state, which the owner honours on its next heartbeat. Like the lease
+    rows, local streams are identified by user, server and project.
+
+    The heartbeat, which also adopts orphaned streams, runs only after
+    ``start()``: call it from the serving entry point, so importing the app
+    (``flask db``, scripts) never starts streaming.
+    """
+
+    def __init__(self, engine, kobo_client, lease_config: StreamLeaseConfig = stream_lease_config,
+                 config_service_instance=config_service):
+        self.engine = engine
+        self.kobo_client = kobo_client
+        self.lease_config = lease_config
+        self.config_service = config_service_instance
+        self.owner_id = self._new_owner_id()
+        self._owned: Dict[int, StreamKey] = {}  # lease id -> stream running in this process
+        self._renewed_at: Dict[int, float] = {}  # lease id -> time.monotonic() when its last renewal started
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = False
+        self.takeovers = 0
+
+        if lease_config.local_ttl_seconds <= 0:
+            logger.warning(
+                f"KOBO_LEASE_TTL ({lease_config.ttl_seconds}s) should exceed KOBO_LEASE_HEARTBEAT plus "
+                f"KOBO_LEASE_STOP_MARGIN; streams stop on the first missed renewal"
+            )
+        if not self.config_service.has_shared_key:
+            logger.warning(
+                "CONFIG_ENCRYPTION_KEY is not set: other processes cannot decrypt stream credentials, "
+                "so streams will not fail over between workers"
+            )
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.release_all)
+
+    def start(self):
+        """Start renewing leases and adopting orphaned streams in this process."""
+        if self._started:
+            return
+        self._started = True
+        self._start_heartbeat()
+
+    # ------------------------
+    # Streaming engine interface
+    # ------------------------
+    def start_streaming(
+        self, eventstream_client, webhook_handler=None, project_id: Optional[str] = None,
+        config: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[bool, str]:
+        """Register a project stream and run it here if no live process owns it."""
+        config = config or self.kobo_client.get_api_config()
+        server_url = (config.get("server_url") or "").strip()
+        api_token = (config.get("api_token") or "").strip()
+        project_id = project_id or config.get("project_id")
+
+        if not server_url or not api_token or not project_id:
+            # Let the engine report which setting is missing
+            return self.engine.start_streaming(eventstream_client, project_id=project_id, config=config)
+        if not getattr(eventstream_client, "config", None):
+            return False, "No EventStream config available"
+
+        session = self.kobo_client.db_session
+        lease = self._save_lease(session, config["user_id"], server_url, project_id, api_token,
+                                 eventstream_client.config)
+        if self._try_acquire(lease.id):
+            return self._start_local(lease, eventstream_client, config)
+
+        session.refresh(lease)
+        return True, f"Real-time streaming for project {project_id} is running in worker {lease.owner_id}"
+
+    def stop_streaming(self, project_id: Optional[str] = None, user_id: Optional[int] = None,
+                       server_url: Optional[str] = None) -> Tuple[bool, str]:
+        """Stop a project (or the user's projects; by default the logged-in user's) wherever it runs."""
+        session = self.kobo_client.db_session
+        if user_id is None:
+            user_id = self._current_user_id()
+        query = session.query(StreamLease).filter(StreamLease.desired_state == "running")
+        if project_id:
+            query = query.filter(StreamLease.project_uid == project_id)
+            if user_id is not None:
+                # Users can only stop their own projects
+                query = query.filter(StreamLease.user_id == user_id)
+            if server_url:
+                query = query.filter(StreamLease.server_url == server_url)
+        else:
+            query = query.filter(
+                StreamLease.user_id == user_id if user_id is not None else StreamLease.owner_id == self.owner_id
+            )
+
+        leases = query.all()
+        if not leases:
+            if project_id and session.query(StreamLease.id).filter(StreamLease.project_uid == project_id).first():
+                return False, f"No running stream for project {project_id}"
+            return self.engine.stop_streaming(project_id, user_id=user_id, server_url=server_url)
+
+        for lease in leases:
+            lease.desired_state = "stopped"
+            if lease.id in self._owned:
+                self._stop_local(lease.id)
+                lease.owner_id = None
+                lease.expires_at = None
+        session.commit()
+
+        logger.info(f"Stopped {len(leases)} leased stream(s); remote owners stop within "
+                    f"{self.lease_config.heartbeat_seconds:.0f}s")
+        return True, "Real-time streaming stopped"
+
+    def get_streaming_status(self, project_id: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Local engine status plus the leases (``user_id``'s only when given) wherever they run."""
+        status = self.engine.get_streaming_status(project_id, user_id=user_id)
+        now = datetime.utcnow()
+        query = self.kobo_client.db_session.query(StreamLease)
+        if project_id:
+            query = query.filter(StreamLease.project_uid == project_id)
+        if user_id is not None:
+            query = query.filter(StreamLease.user_id == user_id)
+        leases = [self._lease_status(lease, now) for lease in query.all()]
+
+        if project_id:
+            live = [lease for lease in leases if lease["live"]]
+            if live and not status.get("active"):
+                status.update({"active": True, "owner": live[0]["owner"], "remote": True})
+            return status
+
+        status["owner_id"] = self.owner_id
+        status["takeovers"] = self.takeovers
+        status["leases"] = leases
+        status["active"] = bool(status.get("active")) or any(lease["live"] for lease in leases)
+        return status
+
+    # ------------------------
+    # Lease handling
+    # ------------------------
+    def release_all(self):
+        """Give up every lease held here so other processes take over at once (on shutdown)."""
+        self._stop.set()
+        if not self._owned:
+            return
+        try:
+            with self.kobo_client._app_context():
+                session = self.kobo_client.db_session
+                session.query(StreamLease).filter(StreamLease.owner_id == self.owner_id).update(
+                    {"owner_id": None, "expires_at": None}, synchronize_session=False
+                )
+                session.commit()
+            for lease_id in list(self._owned):
+                self._stop_local(lease_id)
+        except Exception as e:
+            logger.warning(f"Failed to release stream leases: {str(e)}")
+
+    def _save_lease(self, session, user_id, server_url: str, project_uid: str, api_token: str,
+                    eventstream_config: EventStreamConfig) -> StreamLease:
+        """Create or update the project's lease row with the latest credentials."""
+        for _ in range(2):
+            lease = session.query(StreamLease).filter_by(
+                user_id=user_id, server_url=server_url, project_uid=project_uid
+            ).first()
+            if not lease:
+                lease = StreamLease(user_id=user_id, server_url=server_url, project_uid=project_uid)
+                session.add(lease)
+            lease.desired_state = "running"
+            lease.api_token = self.config_service.encrypt(api_token)
+            lease.eventstream_config = self.config_service.encrypt(json.dumps(asdict(eventstream_config)))
+            try:
+                session.commit()
+                return lease
+            except IntegrityError:
+                session.rollback()  # another process created the row first; update it instead
+        raise Exception(f"Could not register stream lease for project {project_uid}")
+
+    def _try_acquire(self, lease_id: int) -> bool:
+        """Atomically take a lease that is free, expired or already ours."""
+        session = self.kobo_client.db_session
+        attempt = time.monotonic()  # taken before the expiry we write, so the local deadline comes first
+        now = datetime.utcnow()
+        updated = session.query(StreamLease).filter(
+            StreamLease.id == lease_id,
+            StreamLease.desired_state == "running",
+            or_(
+                StreamLease.owner_id.is_(None),
+                StreamLease.expires_at.is_(None),
+                StreamLease.expires_at < now,
+                StreamLease.owner_id == self.owner_id,
+            ),
+        ).update({
+            "owner_id": self.owner_id,
+            "expires_at": now + timedelta(seconds=self.lease_config.ttl_seconds),
+            "heartbeat_at": now,
+        }, synchronize_session=False)
+        session.commit()
+        if updated == 1:
+            self._renewed_at[lease_id] = attempt
+        return updated == 1
+
+    def _start_local(self, lease: StreamLease, eventstream_client=None,
+                     config: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        """Run an acquired lease's stream in this process (credentials come from the row on takeover)."""
+        try:
+            if config is None:
+                config = {
+                    "user_id": lease.user_id,
+                    "server_url": lease.server_url,
+                    "api_token": self.config_service.decrypt(lease.api_token),
+                    **self.kobo_client.get_stream_settings(),
+                }
+            if eventstream_client is None:
+                eventstream_config = EventStreamConfig(**json.loads(self.config_service.decrypt(lease.eventstream_config)))
+                eventstream_client = EventStreamClient(config=eventstream_config, user_id=lease.user_id)
+        except Exception as e:
+            self._release(lease.id)
+            logger.error(f"Cannot take over stream {lease.project_uid} (check CONFIG_ENCRYPTION_KEY): {str(e)}")
+            return False, f"Failed to load credentials for project {lease.project_uid}"
+
+        key = (lease.user_id, lease.server_url, lease.project_uid)
+        success, message = self.engine.start_streaming(eventstream_client, project_id=lease.project_uid, config=config)
+        if success or key in self._local_streams():
+            with self._lock:
+                self._owned[lease.id] = key
+            return True, message
+
+        self._release(lease.id)
+        logger.error(f"Failed to start leased stream {lease.project_uid}: {message}")
+        return False, message
+
+    def _release(self, lease_id: int):
+        session = self.kobo_client.db_session
+        session.query(StreamLease).filter(
+            StreamLease.id == lease_id, StreamLease.owner_id == self.owner_id
+        ).update({"owner_id": None, "expires_at": None}, synchronize_session=False)
+        session.commit()
+
+    def _stop_local(self, lease_id: int):
+        with self._lock:
+            key = self._owned.pop(lease_id, None)
+            self._renewed_at.pop(lease_id, None)
+        if key:
+            user_id, server_url, project_uid = key
+            self.engine.stop_streaming(project_uid, user_id=user_id, server_url=server_url)
+
+    def _local_streams(self):
+        streams = self.engine.get_streaming_status().get("streams", {})
+        return {
+            (stream.get("user_id"), stream.get("server_url"), stream.get("project_uid"))
+            for stream in streams.values() if stream.get("active")
+        }
+
+    def _heartbeat(self):
+        """Renew our leases, drop the ones we lost or that were stopped, and adopt orphans."""
+        session = self.kobo_client.db_session
+        attempt = time.monotonic()  # taken before the expiry we write, so the local deadline comes first
+        now = datetime.utcnow()
+
+        held = set()
+        for lease in session.query(StreamLease).filter(StreamLease.owner_id == self.owner_id).all():
+            if lease.desired_state != "running":
+                self._stop_local(lease.id)
+                lease.owner_id = None
+                lease.expires_at = None
+                continue
+            lease.expires_at = now + timedelta(seconds=self.lease_config.ttl_seconds)
+            lease.heartbeat_at = now
+            held.add(lease.id)
+        session.commit()
+        for lease_id in held:
+            self._renewed_at[lease_id] = attempt
+
+        for lease_id, key in list(self._owned.items()):
+            if lease_id not in held:
+                logger.warning(f"Lost lease on {key[2]} (user {key[0]}); stopping it here")
+                self._stop_local(lease_id)
+
+        orphans = session.query(StreamLease.id).filter(
+            StreamLease.desired_state == "running",
+            or_(StreamLease.owner_id.is_(None), StreamLease.expires_at.is_(None), StreamLease.expires_at < now),
+        ).all()
+        for (lease_id,) in orphans:
+            if self._try_acquire(lease_id):
+                lease = session.get(StreamLease, lease_id)
+                self.takeovers += 1
+                logger.info(f"Took over stream {lease.project_uid} (worker {self.owner_id})")
+                self._start_local(lease)
+
+    def _heartbeat_loop(self):
+        while not self._stop.is_set():
+            try:
+                with self.kobo_client._app_context():
+                    self._heartbeat()
+            except Exception as e:
+                logger.error(f"Stream lease heartbeat failed: {str(e)}")
+            self._stop_expired()
+            self._stop.wait(self.lease_config.heartbeat_seconds)
+
+    def _stop_expired(self):
+        """
+        Stop local streams that went unrenewed for ``local_ttl_seconds``.
+
+        This runs once per heartbeat, so stopping at that point (rather than
+        at the database expiry) keeps the stream from running here once
+        another process is allowed to take the lease.
+        """
+        now = time.monotonic()
+        for lease_id, key in list(self._owned.items()):
+            if now >= self._renewed_at.get(lease_id, 0.0) + self.lease_config.local_ttl_seconds:
+                logger.warning(f"Lease on {key[2]} (user {key[0]}) is about to expire unrenewed; stopping it here")
+                self._stop_local(lease_id)
+
+    def _start_heartbeat(self):
+        self._thread = threading.Thread(target=self._heartbeat_loop, name="kobo-lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        """Forked workers (gunicorn --preload) get their own identity and heartbeat thread."""
+        self.owner_id = self._new_owner_id()
+        self._owned = {}
+        self._renewed_at = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if self._started:
+            self._start_heartbeat()
+
+    @staticmethod
+    def _new_owner_id() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def _current_user_id() -> Optional[int]:
+        """Logged-in user of the current request, if any."""
+        try:
+            from flask import has_request_context
+            from flask_login import current_user
+            if has_request_context() and current_user.is_authenticated:
+                return current_user.id
+        except Exception:
+            pass
+        return None
+
+    def _lease_status(self, lease: StreamLease, now: datetime) -> Dict[str, Any]:
+        live = bool(lease.owner_id and lease.expires_at and lease.expires_at > now)
+        return {
+            "project_uid": lease.project_uid,
+            "desired_state": lease.desired_state,
+            "owner": lease.owner_id,
+            "owned_here": lease.id in self._owned,
+            "live": live and lease.desired_state == "running",
+            "expires_in_s": round((lease.expires_at - now).total_seconds(), 1) if live else None,
+            "last_heartbeat": lease.heartbeat_at.isoformat() if lease.heartbeat_at else None,
+        }
@@ -0,0 +1,278 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (user_id, server_url, project_uid): the same project can stream for several users or servers
+StreamKey = Tuple[Optional[int], str, str]
+
+
+@dataclass
+class ProjectStream:
+    """Per-project streaming state tracked by the scheduler."""
+    project_uid: str
+    user_id: int
+    server_url: str
+    api_token: str
+    eventstream_client: Any
+    polling_interval: float = 30
+    batch_size: int = 50
+    policy: Optional[Any] = None  # AdaptivePollingPolicy, when adaptive polling is on
+    avg_response_ms: Optional[float] = None
+    incremental_parse: bool = False  # parse /data/ responses as a stream (needs ijson)
+    pipelined: bool = False  # overlap fetch/transform/send/log in separate stages
+    pipeline: Optional[Any] = None  # SubmissionPipeline of the current/last poll
+    typed_payloads: bool = False  # opt-in: cast/flatten values with the compiled form transformer
+
+    # High-water mark (resumed from SyncCheckpoint on the first poll)
+    checkpoint_id: Optional[int] = None
+    last_submission_id: Optional[int] = None
+    last_submission_time: Optional[str] = None
+    mark_held: bool = False  # a failed send this poll stops the mark advancing past it
+    max_delivery_attempts: int = 5  # polls that retry a failed submission before it is dead-lettered
+    delivery_attempts: Dict[int, int] = field(default_factory=dict)  # submission _id -> failed attempts
+
+    active: bool = True
+    running: bool = False
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    last_sync_time: Optional[datetime] = None
+    last_error: Optional[str] = None
+    polls: int = 0
+    submissions_streamed: int = 0
+    duplicates_skipped: int = 0
+
+    @property
+    def key(self) -> StreamKey:
+        return (self.user_id, self.server_url, self.project_uid)
+
+    def matches(self, project_uid: Optional[str] = None, user_id: Optional[int] = None,
+                server_url: Optional[str] = None) -> bool:
+        """True if the stream is for ``project_uid``, ``user_id`` and ``server_url`` (None matches any)."""
+        return ((project_uid is None or self.project_uid == project_uid)
+                and (user_id is None or self.user_id == user_id)
+                and (server_url is None or self.server_url == server_url))
+
+    def to_status(self) -> Dict[str, Any]:
+        return {
+            "project_uid": self.project_uid,
+            "user_id": self.user_id,
+            "server_url": self.server_url,
+            "active": self.active,
+            "polling": self.running,
+            "polling_interval": self.polling_interval,
+            "batch_size": self.batch_size,
+            "adaptive": self.policy is not None,
+            "typed_payloads": self.typed_payloads,
+            "avg_response_ms": round(self.avg_response_ms, 1) if self.avg_response_ms is not None else None,
+            "started_at": self.started_at.isoformat(),
+            "last_sync": self.last_sync_time.isoformat() if self.last_sync_time else None,
+            "last_submission_id": self.last_submission_id,
+            "last_submission_time": self.last_submission_time,
+            "last_error": self.last_error,
+            "polls": self.polls,
+            "submissions_streamed": self.submissions_streamed,
+            "duplicates_skipped": self.duplicates_skipped,
+            "pipeline": self.pipeline.get_stats() if self.pipeline is not None else None,
+            "eventstream": self.eventstream_client.get_batch_stats()
+            if hasattr(self.eventstream_client, "get_batch_stats") else None,
+        }
+
+
+def stream_status_map(streams: List[ProjectStream], by_project: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Status of each stream, keyed by project uid for one user's view, else by ``user_id:project_uid``."""
+    if by_project:
+        return {s.project_uid: s.to_status() for s in streams}
+    return {f"{s.user_id}:{s.project_uid}": s.to_status() for s in streams}
+
+
+class StreamScheduler:
+    """
+    Polls many Kobo projects from a fixed number of threads.
+
+    Due polls sit in a priority queue ordered by their next run time. A single
+    dispatcher thread pops the ones that are due and hands them to a bounded
+    worker pool, so the thread count is ``max_workers + 1`` no matter how many
+    projects are streaming. At most one poll per project is in flight: a
+    project restarted while its old poll still runs gets its first poll when
+    that one finishes.
+    """
+
+    def __init__(self, poll_fn: Callable[[ProjectStream], int], max_workers: int = 4):
+        self.poll_fn = poll_fn
+        self.max_workers = max_workers
+        self._streams: Dict[StreamKey, ProjectStream] = {}
+        self._queue: List[Tuple[float, int, StreamKey]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._in_flight: Dict[StreamKey, ProjectStream] = {}  # stream key -> stream being polled
+        self._shutdown = False
+
+    # ------------------------
+    # Public API
+    # ------------------------
+    def start_stream(self, stream: ProjectStream) -> Tuple[bool, str]:
+        """Register a project and schedule its first poll immediately."""
+        with self._cond:
+            existing = self._streams.get(stream.key)
+            if existing and existing.active:
+                return False, f"Streaming is already active for project {stream.project_uid}"
+
+            self._ensure_running()
+            stream.active = True
+            self._streams[stream.key] = stream
+            self._schedule(stream.key, time.monotonic())
+
+        logger.info(f"Scheduled streaming for project {stream.project_uid}")
+        return True, f"Real-time streaming started for project {stream.project_uid}"
+
+    def stop_stream(self, project_uid: str, user_id: Optional[int] = None,
+                    server_url: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Stop polling a project (only ``user_id``'s on ``server_url`` when
+        given); an in-flight poll finishes its current page.
+        """
+        with self._cond:
+            keys = [key for key, stream in self._streams.items()
+                    if stream.active and stream.matches(project_uid, user_id, server_url)]
+            if not keys:
+                return False, f"Streaming is not active for project {project_uid}"
+            for key in keys:
+                self._streams.pop(key).active = False
+            self._cond.notify()
+
+        logger.info(f"Stopped streaming for project {project_uid}")
+        return True, f"Real-time streaming stopped for project {project_uid}"
+
+    def stop_all(self, user_id: Optional[int] = None) -> int:
+        """Stop every stream (of ``user_id`` when given); returns how many were active."""
+        with self._cond:
+            keys = [key for key, stream in self._streams.items() if stream.matches(user_id=user_id)]
+            for key in keys:
+                self._streams.pop(key).active = False
+            self._cond.notify()
+        return len(keys)
+
+    def get_stream(self, project_uid: str, user_id: Optional[int] = None,
+                   server_url: Optional[str] = None) -> Optional[ProjectStream]:
+        return next((s for s in list(self._streams.values()) if s.matches(project_uid, user_id, server_url)), None)
+
+    def get_status(self, project_uid: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Status of one project, or of the scheduler and all its projects (``user_id``'s only when given)."""
+        if project_uid is not None:
+            stream = self.get_stream(project_uid, user_id)
+            return stream.to_status() if stream else {"project_uid": project_uid, "active": False}
+
+        streams = [s for s in list(self._streams.values()) if s.matches(user_id=user_id)]
+        return {
+            "active": any(s.active for s in streams),
+            "stream_count": len(streams),
+            "polls_in_flight": len(self._in_flight),
+            "queued_polls": len(self._queue),
+            "max_workers": self.max_workers,
+            "dispatcher_alive": self._dispatcher.is_alive() if self._dispatcher else False,
+            "streams": stream_status_map(streams, by_project=user_id is not None),
+        }
+
+    def shutdown(self, wait: bool = True):
+        """Stop all streams and the dispatcher/worker threads."""
+        self.stop_all()
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify()
+            dispatcher, executor = self._dispatcher, self._executor
+            self._dispatcher = None
+            self._executor = None
+        if dispatcher and dispatcher.is_alive():
+            dispatcher.join(timeout=5)
+        if executor:
+            executor.shutdown(wait=wait)
+
+    # ------------------------
+    # Internals
+    # ------------------------
+    def _ensure_running(self):
+        """Lazily start the dispatcher and pool (caller holds the lock)."""
+        self._shutdown = False
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="kobo-poll"
+            )
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name="kobo-poll-dispatcher", daemon=True
+            )
+            self._dispatcher.start()
+
+    def _schedule(self, key: StreamKey, due: float):
+        """Push a poll onto the queue (caller holds the lock)."""
+        heapq.heappush(self._queue, (due, next(self._seq), key))
+        self._cond.notify()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                # A dispatcher replaced after shutdown() exits too
+                if self._shutdown or self._executor is None or self._dispatcher is not threading.current_thread():
+                    return
+
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+
+                due, _, key = self._queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+
+                heapq.heappop(self._queue)
+                stream = self._streams.get(key)
+                # Dropped streams and projects with a poll still in flight
+                # (possibly a stopped stream's) are skipped; the in-flight
+                # poll schedules the project's current stream when it finishes.
+                if not stream or not stream.active or key in self._in_flight:
+                    continue
+                stream.running = True
+                self._in_flight[key] = stream
+                try:
+                    # Under the lock, so shutdown() cannot close the pool in between
+                    self._executor.submit(self._run_poll, stream)
+                except RuntimeError as e:
+                    stream.running = False
+                    del self._in_flight[key]
+                    logger.warning(f"Poll for project {stream.project_uid} not scheduled: {str(e)}")
+                    return
+
+    def _run_poll(self, stream: ProjectStream):
+        delay = stream.polling_interval
+        try:
+            processed = self.poll_fn(stream)
+            stream.polls += 1
+            stream.submissions_streamed += processed
+            stream.last_sync_time = datetime.utcnow()
+            stream.last_error = None
+        except Exception as e:
+            stream.last_error = str(e)
+            logger.error(f"Error polling project {stream.project_uid}: {str(e)}")
+            # Rate-limit/breaker errors say when the server will take requests again
+            delay = getattr(e, "retry_after", None) or min(stream.polling_interval, 60)
+        finally:
+            with self._cond:
+                stream.running = False
+                if self._in_flight.get(stream.key) is stream:
+                    del self._in_flight[stream.key]
+                current = self._streams.get(stream.key)
+                if current is stream and stream.active:
+                    self._schedule(stream.key, time.monotonic() + delay)
+                elif current is not None and current.active:
+                    # Restarted while this poll ran: the new stream polls now
+                    self._schedule(stream.key, time.monotonic())
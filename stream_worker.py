@@ -0,0 +1,139 @@
+"""
+Standalone KoboToolbox -> EventStream streaming worker.
+
+Runs the same polling engine as the web app in its own process, without
+building the Flask application: only a database engine, the stored
+settings and the worker configuration are loaded.
+
+    KOBO_WORKER_USER_ID=1 KOBO_SERVER_URL=https://kf.kobotoolbox.org \\
+    KOBO_API_TOKEN=... python -m stream_worker <project_uid> [<project_uid> ...]
+
+Projects default to ``KOBO_PROJECT_IDS`` (comma separated). The EventStream
+connection comes from ``EVENTSTREAM_CONNECTION_STRING`` or, when unset, from
+the user's saved EventStream configuration.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from typing import List, Optional
+
+from config import EventStreamConfig, StreamWorkerConfig, stream_lease_config
+from config_service import config_service
+from eventstream_client import EventStreamClient
+from health_snapshot import health_registry
+from kobo_client import KoboToolboxClient
+from models import UserEventStreamConfig
+from producer_pool import producer_pool
+from stream_lease import LeasedStreamingEngine
+from worker_runtime import WorkerRuntime
+
+logger = logging.getLogger(__name__)
+
+
+def load_eventstream_config(runtime: WorkerRuntime, worker_config: StreamWorkerConfig) -> Optional[EventStreamConfig]:
+    """EventStream settings from the environment, else from the user's saved config."""
+    if worker_config.eventstream_connection_string:
+        return EventStreamConfig(
+            connection_string=worker_config.eventstream_connection_string,
+            partition_key_field=worker_config.eventstream_partition_key_field,
+        )
+
+    user_cfg = runtime.session.query(UserEventStreamConfig).filter_by(user_id=worker_config.user_id).first()
+    if not user_cfg:
+        return None
+    return EventStreamConfig.from_db_or_session({
+        "endpoint": user_cfg.endpoint,
+        "sharedaccesskeyname": user_cfg.shared_access_key_name,
+        "sharedaccesskey": user_cfg.shared_access_key,
+        "entitypath": user_cfg.entity_path,
+        "max_retries": user_cfg.max_retries,
+        "retry_delay": user_cfg.retry_delay,
+        "timeout": user_cfg.timeout,
+        "partition_key_field": user_cfg.partition_key_field,
+    })
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stream KoboToolbox projects into EventStream.")
+    parser.add_argument("projects", nargs="*", help="project uids (default: KOBO_PROJECT_IDS)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    worker_config = StreamWorkerConfig.from_env()
+    if args.projects:
+        worker_config.project_ids = args.projects
+    if worker_config.user_id is None or not worker_config.server_url or not worker_config.api_token:
+        logger.error("KOBO_WORKER_USER_ID, KOBO_SERVER_URL and KOBO_API_TOKEN are required")
+        return 2
+    if not worker_config.project_ids:
+        logger.error("No projects to stream (pass project uids or set KOBO_PROJECT_IDS)")
+        return 2
+
+    runtime = WorkerRuntime.from_env()
+    config_service.bind_session(runtime.session)
+    kobo_client = KoboToolboxClient(config_service, runtime=runtime)
+    health_registry.init_app(runtime=runtime)
+
+    if worker_config.engine == "asyncio":
+        from kobo_async import AsyncKoboStreamer
+        engine = AsyncKoboStreamer(kobo_client)
+    else:
+        engine = kobo_client
+    if stream_lease_config.enabled:
+        # Share project ownership with the web workers instead of double-polling
+        engine = LeasedStreamingEngine(engine, kobo_client)
+        engine.start()
+
+    with runtime.session_scope():
+        eventstream_config = load_eventstream_config(runtime, worker_config)
+        if eventstream_config is None:
+            logger.error(f"No EventStream configuration for user {worker_config.user_id}")
+            return 2
+
+        config = {
+            "user_id": worker_config.user_id,
+            "server_url": worker_config.api_url,
+            "api_token": worker_config.api_token,
+            **kobo_client.get_stream_settings(),
+        }
+        eventstream_client = EventStreamClient(config=eventstream_config, user_id=worker_config.user_id)
+        started = 0
+        for project_uid in worker_config.project_ids:
+            success, message = engine.start_streaming(eventstream_client, project_id=project_uid, config=config)
+            (logger.info if success else logger.error)(message)
+            started += int(success)
+
+    if not started:
+        runtime.dispose()
+        return 1
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    logger.info(f"Streaming worker running for {started} project(s) ({worker_config.engine} engine)")
+    stop.wait()
+
+    logger.info("Shutting down streaming worker")
+    if isinstance(engine, LeasedStreamingEngine):
+        engine.release_all()  # hand the projects over instead of stopping them
+    else:
+        engine.stop_streaming()
+    if kobo_client.scheduler is not None:
+        kobo_client.scheduler.shutdown()
+    eventstream_client.shutdown()
+    producer_pool.close_all()
+    health_registry.shutdown()  # last health snapshot, before the engine goes away
+    runtime.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
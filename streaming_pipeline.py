@@ -0,0 +1,171 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_END = object()  # end-of-stream marker passed down the queues
+
+
+class PipelineStage:
+    """
+    One pipeline stage: a thread that reads items from a bounded queue,
+    applies ``handler`` and forwards non-None results to the next stage.
+
+    ``on_end`` runs once after the last item (e.g. to flush a partial batch).
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Any], maxsize: int,
+                 on_end: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.handler = handler
+        self.on_end = on_end
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self.downstream: Optional['PipelineStage'] = None
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.error: Optional[str] = None
+
+    def get_stats(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            "stage": self.name,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "processed": self.processed,
+            "throughput_per_s": round(self.processed / elapsed, 2) if elapsed > 0 else 0,
+            "busy_percent": round(self.busy_seconds / elapsed * 100, 1) if elapsed > 0 else 0,
+            "error": self.error,
+        }
+
+
+class SubmissionPipeline:
+    """
+    Runs fetch -> stage 1 -> ... -> stage N concurrently over bounded queues.
+
+    The fetcher iterates ``source`` in its own thread, so the next Kobo page
+    is downloaded while earlier submissions are still being sent. When a
+    queue fills up the stage feeding it blocks, which propagates
+    backpressure all the way to the fetcher. Every stage is a single thread,
+    so item order is preserved end to end.
+    """
+
+    def __init__(self, source: Iterator[Any], stages: List[Tuple[str, Callable, Optional[Callable]]],
+                 queue_size: int = 100, context_factory: Optional[Callable[[], Any]] = None):
+        self.source = source
+        self.stages = [PipelineStage(name, handler, queue_size, on_end) for name, handler, on_end in stages]
+        for upstream, downstream in zip(self.stages, self.stages[1:]):
+            upstream.downstream = downstream
+        self.context_factory = context_factory or nullcontext
+        self.fetched = 0
+        self.fetch_busy_seconds = 0.0
+        self.fetch_error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._abort = threading.Event()
+
+    def run(self, should_stop: Callable[[], bool] = lambda: False):
+        """Run to completion; raises if any stage failed."""
+        self.started_at = time.monotonic()
+        threads = [threading.Thread(target=self._fetch, args=(should_stop,), name="pipeline-fetch", daemon=True)]
+        threads += [
+            threading.Thread(target=self._work, args=(stage,), name=f"pipeline-{stage.name}", daemon=True)
+            for stage in self.stages
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.finished_at = time.monotonic()
+
+        errors = [e for e in [self.fetch_error] + [s.error for s in self.stages] if e]
+        if errors:
+            raise Exception(f"Streaming pipeline failed: {errors[0]}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        if self.started_at is None:
+            return {"running": False, "stages": []}
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        fetch = {
+            "stage": "fetch",
+            "queue_depth": None,
+            "queue_capacity": None,
+            "processed": self.fetched,
+            "throughput_per_s": round(self.fetched / elapsed, 2) if elapsed > 0 else 0,
+            "busy_percent": round(self.fetch_busy_seconds / elapsed * 100, 1) if elapsed > 0 else 0,
+            "error": self.fetch_error,
+        }
+        return {
+            "running": self.finished_at is None,
+            "elapsed_s": round(elapsed, 3),
+            "stages": [fetch] + [stage.get_stats(elapsed) for stage in self.stages],
+        }
+
+    # ------------------------
+    # Internals
+    # ------------------------
+    def _put(self, stage: PipelineStage, item: Any) -> bool:
+        """Blocking put; gives up once the pipeline is aborted, except for the end marker."""
+        while True:
+            try:
+                stage.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                # Every stage keeps reading until it sees _END, so that put always lands
+                if self._abort.is_set() and item is not _END:
+                    return False
+
+    def _fetch(self, should_stop: Callable[[], bool]):
+        first = self.stages[0]
+        try:
+            start = time.monotonic()
+            for item in self.source:
+                self.fetch_busy_seconds += time.monotonic() - start
+                if should_stop() or self._abort.is_set() or not self._put(first, item):
+                    break
+                self.fetched += 1
+                start = time.monotonic()
+        except Exception as e:
+            self.fetch_error = str(e)
+            self._abort.set()
+            logger.error(f"Pipeline fetch stage failed: {str(e)}")
+        finally:
+            close = getattr(self.source, "close", None)
+            if close:
+                close()
+            self._put(first, _END)
+
+    def _work(self, stage: PipelineStage):
+        ended = False
+        with self.context_factory():
+            try:
+                while True:
+                    item = stage.queue.get()
+                    if item is _END:
+                        ended = True
+                        break
+                    if self._abort.is_set() and stage.downstream is not None:
+                        continue  # drain without doing work
+
+                    start = time.monotonic()
+                    output = stage.handler(item)
+                    stage.busy_seconds += time.monotonic() - start
+                    stage.processed += 1
+
+                    if output is not None and stage.downstream is not None:
+                        self._put(stage.downstream, output)
+
+                if stage.on_end:
+                    stage.on_end()
+            except Exception as e:
+                stage.error = str(e)
+                self._abort.set()
+                logger.error(f"Pipeline {stage.name} stage failed: {str(e)}")
+                # Keep consuming so upstream puts never block forever
+                while not ended and stage.queue.get() is not _END:
+                    pass
+            finally:
+                if stage.downstream is not None:
+                    self._put(stage.downstream, _END)
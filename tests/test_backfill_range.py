@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import pytest
+
+from backfill import parse_range_end, parse_submission_time, split_time_range
+
+
+def test_date_only_end_covers_the_whole_day():
+    assert parse_range_end("2024-01-31") == datetime(2024, 2, 1)
+
+
+@pytest.mark.parametrize("value", ["2024-01-31T23:59:59", "2024-01-31T23:59:59.750Z", "2024-01-31T23:59:59+00:00"])
+def test_timestamp_end_covers_its_second(value):
+    assert parse_range_end(value) == datetime(2024, 2, 1)
+
+
+def test_windows_are_half_open_and_contiguous():
+    windows = split_time_range(parse_submission_time("2024-01-01"), parse_range_end("2024-01-31"), 4)
+
+    assert windows[0]["start"] == "2024-01-01T00:00:00"
+    assert windows[-1]["end"] == "2024-02-01T00:00:00"
+    assert all(a["end"] == b["start"] for a, b in zip(windows, windows[1:]))
+    assert not any(window.get("inclusive_end") for window in windows)
@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+
+import pytest
+from flask import Flask
+
+from config import kobo_http_config
+from dead_letters import DeadLetterReplayManager, DeadLetterStore
+from models import DeadLetter, DeadLetterReplay, db
+from serialized_event import SerializedEvent
+
+
+class FakeClient:
+    """Stands in for EventStreamClient: payloads whose ``_uuid`` is in ``failing`` fail."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.closed = False
+
+    def submit(self, event):
+        future = Future()
+        if event.payload["_uuid"] in self.failing:
+            future.set_exception(RuntimeError("EventStream down"))
+        else:
+            future.set_result(True)
+        return future
+
+    def shutdown(self):
+        self.closed = True
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        for uuid in ("a", "b", "c"):
+            DeadLetterStore.add(db.session, SerializedEvent.of({"_uuid": uuid}), RuntimeError("boom"), "webhook",
+                                user_id=1)
+        # Another user's webhook payload and one whose owner was never known
+        DeadLetterStore.add(db.session, SerializedEvent.of({"_uuid": "theirs"}), RuntimeError("boom"), "webhook",
+                            user_id=2)
+        DeadLetterStore.add(db.session, SerializedEvent.of({"_uuid": "ownerless"}), RuntimeError("boom"), "webhook")
+        db.session.commit()
+        yield app
+
+
+def run_job(app, client, **kwargs):
+    manager = DeadLetterReplayManager(app, DeadLetterStore(replay_chunk_size=2))
+    job, _ = manager.start_job(1, client, **kwargs)
+    manager._threads[job.id].join(5)
+    db.session.expire_all()
+    return manager, db.session.get(DeadLetterReplay, job.id)
+
+
+def test_replay_runs_in_the_background_and_records_progress(app):
+    client = FakeClient(failing={"b"})
+    manager, job = run_job(app, client)
+
+    assert manager.get_status(job)["status"] == "completed"
+    assert (job.replayed, job.failed) == (2, 1)
+    assert client.closed
+    statuses = {letter.submission_uuid: letter.status for letter in DeadLetter.query.all()}
+    assert statuses == {"a": "replayed", "b": "pending", "c": "replayed", "theirs": "pending", "ownerless": "pending"}
+
+
+def test_users_only_see_their_own_dead_letters(app):
+    listed = DeadLetterStore.query(db.session, user_id=1).all()
+
+    assert [letter.submission_uuid for letter in listed] == ["a", "b", "c"]
+
+
+def test_replay_filters_are_kept_on_the_job(app):
+    _, job = run_job(app, FakeClient(), limit=1, form_id=None)
+
+    assert job.replayed == 1
+    assert job.filters["limit"] == 1
+
+
+def test_replay_concurrency_defaults_to_the_rate_limiter_burst(app):
+    _, job = run_job(app, FakeClient())
+
+    assert job.filters["concurrency"] == kobo_http_config.rate_limit_burst
+
+
+def test_only_one_replay_runs_at_a_time(app):
+    pending = Future()
+
+    class Held(FakeClient):
+        def submit(self, event):
+            return pending
+
+    manager = DeadLetterReplayManager(app)
+    first, _ = manager.start_job(1, Held())
+    try:
+        second, message = manager.start_job(1, FakeClient())
+        assert second is None
+        assert f"{first.id} is already running" in message
+    finally:
+        pending.set_result(True)
+        manager._threads[first.id].join(5)
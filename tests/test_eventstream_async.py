@@ -0,0 +1,20 @@
+import eventstream_async
+from eventstream_async import AsyncEventStreamClient
+
+
+def record_batch(client, monkeypatch):
+    written = []
+    monkeypatch.setattr(eventstream_async.log_writer, "write", written.append)
+    client.app = object()  # persisting is only attempted with an app
+    client._record_metrics(3, 12.5, None)
+    return written
+
+
+def test_metrics_rows_carry_the_user(monkeypatch):
+    written = record_batch(AsyncEventStreamClient(None, user_id=7), monkeypatch)
+
+    assert [(row.user_id, row.success, row.payload_preview) for row in written] == [(7, True, {"batch_events": 3})]
+
+
+def test_shared_client_without_a_user_keeps_no_metrics_rows(monkeypatch):
+    assert record_batch(AsyncEventStreamClient(None), monkeypatch) == []
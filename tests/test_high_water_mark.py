@@ -0,0 +1,138 @@
+import asyncio
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from backfill import BackfillManager, BackfillRun
+from kobo_async import AsyncKoboStreamer
+from kobo_client import DeliveryResult, KoboToolboxClient
+from models import DeadLetter
+from serialized_event import SerializedEvent
+from stream_scheduler import ProjectStream
+
+
+class FakeSession:
+    def __init__(self):
+        self.added = []
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    def commit(self):
+        pass
+
+
+class FakeRuntime:
+    def __init__(self):
+        self.session = FakeSession()
+
+    @contextmanager
+    def session_scope(self):
+        yield self.session
+
+
+def result(submission_id, success, duplicate=False):
+    return DeliveryResult(
+        submission_id, f"2024-01-01T00:00:0{submission_id}", f"uuid-{submission_id}", "form", success,
+        duplicate=duplicate, event=None if success else SerializedEvent.of({"_id": submission_id}),
+    )
+
+
+def make_stream(**overrides):
+    return ProjectStream("project", 1, "https://kf.example.org", "token", None, **overrides)
+
+
+def test_mark_stops_at_the_first_failure_for_the_whole_poll():
+    client = KoboToolboxClient(runtime=FakeRuntime())
+    stream = make_stream()
+
+    client._record_page(stream, [result(1, True), result(2, False), result(3, True)])
+    assert stream.last_submission_id == 1
+    client._record_page(stream, [result(4, True)])  # next page of the same poll
+    assert stream.last_submission_id == 1
+
+
+def test_failed_submission_is_retried_then_mark_moves_on():
+    client = KoboToolboxClient(runtime=FakeRuntime())
+    stream = make_stream()
+    client._record_page(stream, [result(1, True), result(2, False), result(3, True)])
+
+    stream.mark_held = False  # next poll
+    client._record_page(stream, [result(2, True), result(3, True, duplicate=True)])
+    assert stream.last_submission_id == 3
+    assert stream.delivery_attempts == {}
+
+
+def test_submission_is_dead_lettered_after_max_attempts():
+    runtime = FakeRuntime()
+    client = KoboToolboxClient(runtime=runtime)
+    stream = make_stream(max_delivery_attempts=2)
+
+    client._record_page(stream, [result(1, False)])
+    assert stream.last_submission_id is None
+    assert not any(isinstance(obj, DeadLetter) for obj in runtime.session.added)
+
+    stream.mark_held = False
+    client._record_page(stream, [result(1, False), result(2, True)])
+    assert stream.last_submission_id == 2
+    assert sum(isinstance(obj, DeadLetter) for obj in runtime.session.added) == 1
+
+
+def test_failure_without_payload_is_never_passed():
+    client = KoboToolboxClient(runtime=FakeRuntime())
+    stream = make_stream(max_delivery_attempts=1)
+    failed = result(1, False)
+    failed.event = None
+
+    client._record_page(stream, [failed, result(2, True)])
+    assert stream.last_submission_id is None
+
+
+def test_async_poll_keeps_duplicates_in_id_order():
+    client = KoboToolboxClient(runtime=FakeRuntime())
+    streamer = AsyncKoboStreamer(client)
+    stream = make_stream()
+    page = [{"_id": 1, "_uuid": "uuid-1"}, {"_id": 2, "_uuid": "uuid-2"}, {"_id": 3, "_uuid": "uuid-3"}]
+
+    async def pages(stream, timings=None):
+        yield page
+
+    async def send_page(stream, submissions):
+        return [result(s["_id"], False) for s in submissions]
+
+    streamer._load_checkpoint_id = lambda stream: 1
+    streamer._iter_submission_pages = pages
+    # uuid-3 (the highest _id) was delivered before; 1 and 2 fail to send
+    streamer._split_duplicates = lambda stream, subs: (
+        [s for s in subs if s["_id"] != 3], [result(3, True, duplicate=True)]
+    )
+    streamer._send_page = send_page
+    streamer._record_page = lambda stream, results, checkpoint_id: client._record_page(stream, results)
+
+    asyncio.run(streamer._poll_project(stream))
+    assert stream.last_submission_id is None
+    assert set(stream.delivery_attempts) == {1, 2}
+
+
+class FailingClient:
+    def submit(self, event):
+        future = Future()
+        future.set_exception(RuntimeError("EventStream down"))
+        return future
+
+
+def test_backfill_dead_letters_a_failed_send_at_once():
+    runtime = FakeRuntime()
+    client = KoboToolboxClient(runtime=runtime)
+    client.delivered_filter.seeded = True
+    client._iter_submission_pages = lambda *args, **kwargs: iter([[
+        {"_id": 1, "_uuid": "uuid-1"}, {"_id": 2, "_uuid": "uuid-2"},
+    ]])
+    manager = BackfillManager(client)
+    manager._save_progress = lambda run, status=None: None
+    window = {"start": "2024-01-01T00:00:00", "end": "2024-01-02T00:00:00", "last_id": None, "fetched": 0, "done": False}
+    run = BackfillRun(1, 1, "https://kf.example.org", "token", "project", FailingClient(), [window])
+
+    manager._run_window(run, 0)
+    assert window["done"]
+    assert window["last_id"] == 2
+    assert sum(isinstance(obj, DeadLetter) for obj in runtime.session.added) == 2
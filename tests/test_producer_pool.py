@@ -0,0 +1,59 @@
+import threading
+import time
+
+import producer_pool as producer_pool_module
+from config import EventStreamConfig
+from producer_pool import ProducerPool
+
+
+class FakeProducer:
+    """Records sends that overlap, as two threads inside the SDK at once would."""
+
+    def __init__(self):
+        self.inside = 0
+        self.overlaps = 0
+        self.sent = 0
+        self._count = threading.Lock()
+
+    def _enter(self):
+        with self._count:
+            self.inside += 1
+            if self.inside > 1:
+                self.overlaps += 1
+        time.sleep(0.01)
+        with self._count:
+            self.inside -= 1
+
+    def create_batch(self, **kwargs):
+        self._enter()
+        return []
+
+    def send_batch(self, batch, **kwargs):
+        self._enter()
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+def test_threads_sharing_a_producer_do_not_overlap(monkeypatch):
+    fake = FakeProducer()
+    monkeypatch.setattr(producer_pool_module.EventHubProducerClient, "from_connection_string",
+                        staticmethod(lambda conn_str: fake))
+    pool = ProducerPool()
+    config = EventStreamConfig(connection_string="Endpoint=sb://hub/;EntityPath=events")
+
+    def send():
+        producer = pool.acquire(config)
+        producer.send_batch(producer.create_batch())
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    pool.close_all()
+
+    assert pool.created == 1
+    assert fake.sent == 8
+    assert fake.overlaps == 0
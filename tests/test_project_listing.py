@@ -0,0 +1,63 @@
+from kobo_client import KoboToolboxClient
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data or {}
+        self.headers = headers or {}
+        self.text = ""
+
+    def json(self):
+        return self._data
+
+
+def asset(uid):
+    return {"uid": uid, "name": uid, "asset_type": "survey"}
+
+
+def make_client(pages):
+    """A client whose listing requests are answered from ``pages`` (a list of responses per call)."""
+    client = KoboToolboxClient(runtime=object())
+    client.get_api_config = lambda: {"user_id": 1, "server_url": "https://kf.example.org", "api_token": "t"}
+    client.config_service = type("Settings", (), {"get_setting": staticmethod(lambda name, default: "0")})()
+    client.requests = []
+
+    def request(method, url, headers=None, **kwargs):
+        client.requests.append(dict(headers or {}))
+        return pages.pop(0)
+
+    client._request = request
+    return client
+
+
+def test_single_page_listing_is_revalidated():
+    client = make_client([
+        FakeResponse(200, {"results": [asset("a")], "next": None}, {"ETag": '"v1"'}),
+        FakeResponse(304),
+    ])
+    assert [p["uid"] for p in client.get_projects()] == ["a"]
+    assert [p["uid"] for p in client.get_projects()] == ["a"]
+    assert client.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_multi_page_listing_is_refetched_without_validators():
+    client = make_client([
+        FakeResponse(200, {"results": [asset("a")], "next": "https://kf.example.org/assets/?page=2"}, {"ETag": '"v1"'}),
+        FakeResponse(200, {"results": [asset("b")], "next": None}),
+        FakeResponse(200, {"results": [asset("a")], "next": None}),
+    ])
+    assert [p["uid"] for p in client.get_projects()] == ["a", "b"]
+    assert [p["uid"] for p in client.get_projects()] == ["a"]
+    assert "If-None-Match" not in client.requests[2]
+
+
+def test_force_refresh_skips_validators():
+    client = make_client([
+        FakeResponse(200, {"results": [asset("a")], "next": None}, {"ETag": '"v1"', "Last-Modified": "yesterday"}),
+        FakeResponse(200, {"results": [asset("b")], "next": None}),
+    ])
+    client.get_projects()
+    assert [p["uid"] for p in client.get_projects(force_refresh=True)] == ["b"]
+    assert "If-None-Match" not in client.requests[1]
+    assert "If-Modified-Since" not in client.requests[1]
@@ -0,0 +1,45 @@
+import time
+
+from config import StreamLeaseConfig
+from stream_lease import LeasedStreamingEngine
+
+
+class FakeEngine:
+    def __init__(self):
+        self.stopped = []
+
+    def stop_streaming(self, project_id=None, user_id=None, server_url=None):
+        self.stopped.append((user_id, server_url, project_id))
+        return True, "stopped"
+
+
+class SharedKey:
+    has_shared_key = True
+
+
+def make_engine(**overrides):
+    settings = dict(ttl_seconds=15.0, heartbeat_seconds=5.0, stop_margin_seconds=1.0)
+    settings.update(overrides)
+    engine = LeasedStreamingEngine(FakeEngine(), None, StreamLeaseConfig(**settings), SharedKey())
+    engine._owned = {7: (1, "https://kf.example.org", "project")}
+    return engine
+
+
+def test_unrenewed_stream_stops_a_heartbeat_before_the_lease_expires():
+    engine = make_engine()
+    # Last renewal attempt started 8.9s ago: one more heartbeat (5s) still ends before the 15s expiry
+    engine._renewed_at = {7: time.monotonic() - 8.9}
+    engine._stop_expired()
+    assert engine.engine.stopped == []
+
+    # 9s: the next check would come at 14s, within the 1s margin of the expiry
+    engine._renewed_at = {7: time.monotonic() - 9.0}
+    engine._stop_expired()
+    assert engine.engine.stopped == [(1, "https://kf.example.org", "project")]
+    assert engine._owned == {}
+
+
+def test_local_stop_targets_the_leased_user_only():
+    engine = make_engine()
+    engine._stop_local(7)
+    assert engine.engine.stopped == [(1, "https://kf.example.org", "project")]
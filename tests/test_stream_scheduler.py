@@ -0,0 +1,71 @@
+import threading
+import time
+
+from stream_scheduler import ProjectStream, StreamScheduler
+
+
+def make_stream(polling_interval=60):
+    return ProjectStream("project", 1, "https://kf.example.org", "token", None, polling_interval=polling_interval)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met")
+        time.sleep(0.01)
+
+
+def test_restart_waits_for_the_old_poll():
+    release = threading.Event()
+    running = []
+    overlaps = []
+
+    def poll(stream):
+        if running:
+            overlaps.append(stream)
+        running.append(stream)
+        try:
+            if len(running) == 1 and stream is old:
+                release.wait(5)
+        finally:
+            running.remove(stream)
+        return 0
+
+    scheduler = StreamScheduler(poll, max_workers=4)
+    old = make_stream()
+    scheduler.start_stream(old)
+    wait_for(lambda: old in running)
+
+    scheduler.stop_stream("project")
+    new = make_stream()
+    scheduler.start_stream(new)
+    time.sleep(0.2)
+    assert new.polls == 0  # not polled alongside the old stream
+
+    release.set()
+    wait_for(lambda: new.polls == 1)
+    assert overlaps == []
+    scheduler.shutdown()
+
+
+def test_shutdown_while_polls_are_due_does_not_break_the_dispatcher():
+    scheduler = StreamScheduler(lambda stream: 0, max_workers=2)
+    for _ in range(20):
+        scheduler.start_stream(make_stream(polling_interval=0))
+        scheduler.shutdown()
+    assert scheduler.get_status()["dispatcher_alive"] is False
+
+
+def test_same_project_of_two_users_streams_and_stops_separately():
+    scheduler = StreamScheduler(lambda stream: 0, max_workers=2)
+    mine, theirs = make_stream(), make_stream()
+    theirs.user_id = 2
+    assert scheduler.start_stream(mine)[0]
+    assert scheduler.start_stream(theirs)[0]
+
+    assert scheduler.stop_stream("project", user_id=2)[0]
+    assert mine.active and not theirs.active
+    assert scheduler.get_status(user_id=1)["streams"]["project"]["active"]
+    assert scheduler.get_status("project", user_id=2)["active"] is False
+    scheduler.shutdown()
@@ -0,0 +1,218 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from config import EventStreamConfig, WebhookOutboxConfig
+from serialized_event import SerializedEvent
+from webhook_outbox import WebhookOutbox
+
+
+class FakeClient:
+    """Stands in for EventStreamClient.submit(): every send succeeds, or fails with ``fail``."""
+
+    def __init__(self, fail=False, hold=None):
+        self.fail = fail
+        self.hold = hold  # threading.Event keeping futures pending until set
+        self.sent = []
+
+    def submit(self, event):
+        future = Future()
+        self.sent.append(event.payload)
+
+        def finish():
+            if self.hold is not None:
+                self.hold.wait(5)
+            if self.fail:
+                future.set_exception(RuntimeError("EventStream down"))
+            else:
+                future.set_result(True)
+
+        threading.Thread(target=finish, daemon=True).start()
+        return future
+
+
+HUB = EventStreamConfig(connection_string="endpoint=sb://hub/;entitypath=kobo")
+
+
+def make_outbox(tmp_path, client, default_config=None, **overrides):
+    settings = dict(enabled=True, path=str(tmp_path / "outbox.db"), drainers=1, batch_size=10,
+                    claim_seconds=3.0, max_backoff_seconds=300.0, max_attempts=3)
+    settings.update(overrides)
+    outbox = WebhookOutbox(WebhookOutboxConfig(**settings), client_factory=lambda config: client)
+    outbox._ensure_drainers = lambda: None  # tests drive _drain_once themselves
+    outbox._default_config = lambda: default_config  # this process's shared client is not configured
+    return outbox
+
+
+def claim(outbox):
+    return outbox._claim(outbox._deliverable_keys())
+
+
+def rows(outbox):
+    return outbox._connect().execute(
+        "SELECT id, attempts, last_error, next_attempt_at, claimed_by FROM outbox ORDER BY id"
+    ).fetchall()
+
+
+def test_delivered_rows_are_deleted(tmp_path):
+    client = FakeClient()
+    outbox = make_outbox(tmp_path, client)
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+    outbox.append(SerializedEvent.of({"_uuid": "b"}), eventstream_config=HUB)
+
+    assert outbox._drain_once() == 2
+    assert [p["_uuid"] for p in client.sent] == ["a", "b"]
+    assert rows(outbox) == []
+    assert outbox.get_stats()["delivered"] == 2
+
+
+def test_failed_rows_back_off_and_are_released(tmp_path):
+    outbox = make_outbox(tmp_path, FakeClient(fail=True))
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+
+    before = time.time()
+    assert outbox._drain_once() == 1
+    (_, attempts, last_error, next_attempt_at, claimed_by), = rows(outbox)
+    assert attempts == 1
+    assert "EventStream down" in last_error
+    assert next_attempt_at >= before + outbox._backoff(1)
+    assert claimed_by is None
+    # Not due yet: nothing is claimed again
+    assert outbox._drain_once() == 0
+
+
+def test_backoff_is_capped():
+    outbox = WebhookOutbox(WebhookOutboxConfig(max_backoff_seconds=30.0))
+    assert outbox._backoff(2) == 4.0
+    assert outbox._backoff(20) == 30.0
+
+
+def test_claimed_rows_are_not_claimed_twice(tmp_path):
+    outbox = make_outbox(tmp_path, FakeClient())
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+
+    token, claimed = claim(outbox)
+    assert len(claimed) == 1
+    assert claim(outbox)[1] == []
+
+
+def test_expired_claim_is_picked_up_again(tmp_path):
+    outbox = make_outbox(tmp_path, FakeClient())
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+    claim(outbox)  # a drainer that then dies
+    outbox._connect().execute("UPDATE outbox SET claimed_until = ?", (time.time() - 1,))
+
+    assert len(claim(outbox)[1]) == 1
+
+
+def test_claim_is_renewed_while_sends_are_in_flight(tmp_path):
+    hold = threading.Event()
+    outbox = make_outbox(tmp_path, FakeClient(hold=hold), claim_seconds=3.0)
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+
+    drain = threading.Thread(target=outbox._drain_once)
+    drain.start()
+    time.sleep(4.5)  # longer than the claim; renewed every second
+    try:
+        assert claim(outbox)[1] == []
+    finally:
+        hold.set()
+        drain.join(5)
+    assert rows(outbox) == []
+
+
+def test_resume_starts_drainers_only_for_leftover_rows(tmp_path):
+    outbox = make_outbox(tmp_path, FakeClient())
+    started = []
+    outbox._ensure_drainers = lambda: started.append(True)
+
+    assert outbox.resume() == 0
+    assert started == []
+
+    outbox._connect().execute(
+        "INSERT INTO outbox (body, enqueued_at, next_attempt_at) VALUES (?, ?, ?)",
+        (b'{"_uuid": "left-over"}', time.time(), time.time()),
+    )
+    assert outbox.resume() == 1
+    assert started == [True]
+
+
+def test_init_app_keeps_the_outbox_in_the_instance_folder(tmp_path):
+    class App:
+        instance_path = str(tmp_path / "instance")
+
+    outbox = WebhookOutbox(WebhookOutboxConfig(path="webhook_outbox.db"))
+    outbox.init_app(App())
+    assert outbox.path == str(tmp_path / "instance" / "webhook_outbox.db")
+    assert (tmp_path / "instance" / "webhook_outbox.db").exists()
+
+
+@pytest.mark.parametrize("attempts, exhausted", [(1, False), (3, True)])
+def test_rows_are_dead_lettered_after_max_attempts(tmp_path, attempts, exhausted):
+    outbox = make_outbox(tmp_path, FakeClient(fail=True), max_attempts=3)
+    outbox.app = object()  # a database is attached
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+    outbox._connect().execute("UPDATE outbox SET attempts = ?", (attempts - 1,))
+    recorded = {}
+
+    def update_logs(delivered, retrying, dead):
+        recorded.update(retrying=retrying, dead=dead)
+        return True
+
+    outbox._update_logs = update_logs
+    outbox._drain_once()
+    assert bool(recorded["dead"]) is exhausted
+    assert (rows(outbox) == []) is exhausted
+
+
+def test_rows_are_delivered_with_their_own_config_in_any_process(tmp_path):
+    client = FakeClient()
+    used = []
+    outbox = make_outbox(tmp_path, client)
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+
+    # Another worker: nothing cached, no configured shared client
+    other = make_outbox(tmp_path, client)
+    other.client_factory = lambda config: used.append(config) or client
+    assert other._drain_once() == 1
+    assert used == [HUB]
+    assert rows(other) == []
+
+
+def test_rows_without_config_wait_for_a_configured_process(tmp_path):
+    client = FakeClient()
+    outbox = make_outbox(tmp_path, client)
+    outbox.append(SerializedEvent.of({"_uuid": "a"}))
+
+    assert outbox._drain_once() == 0
+    assert len(rows(outbox)) == 1
+
+    configured = make_outbox(tmp_path, client, default_config=HUB)
+    assert configured._drain_once() == 1
+    assert rows(configured) == []
+
+
+def test_rows_sealed_with_another_key_are_not_claimed(tmp_path):
+    outbox = make_outbox(tmp_path, FakeClient())
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+    outbox._connect().execute("UPDATE outbox SET config = 'not-a-token'")
+
+    other = make_outbox(tmp_path, FakeClient())
+    assert other._drain_once() == 0
+    (_, attempts, _, _, claimed_by), = rows(other)
+    assert (attempts, claimed_by) == (0, None)
+
+
+def test_outbox_files_from_before_configs_are_upgraded(tmp_path):
+    path = tmp_path / "outbox.db"
+    sqlite3.connect(path).execute(
+        "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, webhook_log_id INTEGER, body BLOB NOT NULL,"
+        " enqueued_at REAL NOT NULL, next_attempt_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+        " last_error TEXT, first_failed_at REAL, claimed_by TEXT, claimed_until REAL)"
+    )
+    outbox = make_outbox(tmp_path, FakeClient(), default_config=HUB)
+    outbox.append(SerializedEvent.of({"_uuid": "a"}), eventstream_config=HUB)
+    assert outbox._drain_once() == 1
@@ -1,6 +1,6 @@
-import json
 import logging
 import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from typing import Dict, Any, Tuple, Optional
 from flask import request
@@ -10,6 +10,10 @@ import hmac
 from config import webhook_config
 from validators import PayloadValidator
 from eventstream_client import get_eventstream_client
+from dead_letters import dead_letter_store
+from log_writer import log_writer
+from serialized_event import SerializedEvent
+from webhook_outbox import webhook_outbox
 from models import WebhookLog, db
 print("Hey Hey here@webhook_handler:",WebhookLog.query.count())
 
@@ -33,30 +37,29 @@ class WebhookHandler:
             Tuple of (success, message, response_data)
         """
         start_time = time.time()
-        webhook_log = None
+        # Built in memory and handed to the group-commit writer once its outcome is known
+        webhook_log = WebhookLog()
+        webhook_log.source_ip = request.remote_addr
+        webhook_log.user_agent = request.headers.get('User-Agent', '')
+        webhook_log.status = 'processing'
+        log_saved = False
+        webhook_id = None
         
         try:
-            # Create initial log entry
-            webhook_log = WebhookLog()
-            webhook_log.source_ip = request.remote_addr
-            webhook_log.user_agent = request.headers.get('User-Agent', '')
-            webhook_log.status = 'processing'
-            db.session.add(webhook_log)
-            db.session.flush()  # Get the ID without committing
-            
             # Validate request
             is_valid, validation_errors = self._validate_request(request_data)
             if not is_valid:
-                webhook_log.status = 'failed'
-                webhook_log.error_message = '; '.join(validation_errors)
-                db.session.commit()
+                log_saved = True
+                self._save_log(webhook_log, start_time, 'failed', '; '.join(validation_errors))
                 
                 logger.warning(f"Webhook validation failed: {'; '.join(validation_errors)}")
                 return False, f"Validation failed: {'; '.join(validation_errors)}", {}
             
             # Parse and validate payload
             payload = request_data.get_json()
-            webhook_log.payload_size = len(json.dumps(payload, default=str))
+            # Size of the received body; the payload itself is encoded once, when it is sent
+            payload_size = request_data.content_length or len(request_data.get_data())
+            webhook_log.payload_size = payload_size
             
             # Extract KoboToolbox metadata
             webhook_log.kobo_form_id = payload.get('_xform_id_string')
@@ -65,9 +68,8 @@ class WebhookHandler:
             # Validate payload structure
             is_valid_payload, payload_errors = self.validator.validate_kobo_payload(payload)
             if not is_valid_payload:
-                webhook_log.status = 'failed'
-                webhook_log.error_message = '; '.join(payload_errors)
-                db.session.commit()
+                log_saved = True
+                self._save_log(webhook_log, start_time, 'failed', '; '.join(payload_errors))
                 
                 logger.warning(f"Payload validation failed: {'; '.join(payload_errors)}")
                 return False, f"Payload validation failed: {'; '.join(payload_errors)}", {}
@@ -75,61 +77,86 @@ class WebhookHandler:
             # Sanitize payload
             sanitized_payload = self.validator.sanitize_payload(payload)
             
+            event = SerializedEvent.of(sanitized_payload)
+            # The user whose EventStream config the webhook goes to owns its log and dead letter
+            owner_id = get_eventstream_client().user_id
+            webhook_log.user_id = owner_id
+            if webhook_outbox.enabled:
+                # Durable hand-off: the drainers deliver it, so the request doesn't wait on EventStream
+                log_saved = True
+                processing_time = (time.time() - start_time) * 1000
+                webhook_id = self._save_log(webhook_log, start_time, 'queued', processing_time=processing_time).result()
+                webhook_outbox.append(event, webhook_id, get_eventstream_client().config)
+
+                return True, "Webhook accepted for delivery", {
+                    'webhook_id': webhook_id,
+                    'queued': True,
+                    'processing_time_ms': processing_time,
+                    'payload_size': payload_size
+                }
+
             # Send to EventStream
-            '''try:
-                success = eventstream_client.send_to_eventstream(
-                    sanitized_payload, 
-                    webhook_log.id
-                )'''
             try:
                 client = get_eventstream_client()
-                success = client.send_to_eventstream(
-                    sanitized_payload,
-                    webhook_log.id
-                )
-                
-                if success:
-                    webhook_log.status = 'success'
-                    webhook_log.eventstream_sent = True
-                    processing_time = (time.time() - start_time) * 1000
-                    webhook_log.processing_time_ms = processing_time
-                    
-                    logger.info(f"Webhook processed successfully in {processing_time:.2f}ms")
-                    db.session.commit() 
-                    
-                    return True, "Webhook processed successfully", {
-                        'webhook_id': webhook_log.id,
-                        'processing_time_ms': processing_time,
-                        'payload_size': webhook_log.payload_size
-                    }
-                else:
-                    webhook_log.status = 'failed'
-                    webhook_log.error_message = 'EventStream transmission failed'
-                    
+                timeout = client.config.timeout if client.config else None
+                # Concurrent webhooks share EventHub batches; wait for ours to go out
+                try:
+                    success = client.submit(event).result(timeout=timeout)
+                except FutureTimeoutError:
+                    raise FutureTimeoutError(f"EventStream did not confirm the send within {timeout}s")
             except Exception as e:
-                webhook_log.status = 'failed'
-                webhook_log.error_message = str(e)
+                log_saved = True
+                webhook_id = self._save_log(webhook_log, start_time, 'failed', str(e)).result()
+                log_writer.write(dead_letter_store.build(
+                    event, e, source="webhook", webhook_log_id=webhook_id, user_id=owner_id
+                ))
                 logger.error(f"EventStream transmission failed: {str(e)}")
                 return False, f"EventStream transmission failed: {str(e)}", {}
             
-        except Exception as e:
-            if webhook_log:
-                webhook_log.status = 'failed'
-                webhook_log.error_message = str(e)
+            log_saved = True
+            if not success:
+                self._save_log(webhook_log, start_time, 'failed', 'EventStream transmission failed')
+                return False, "Unknown error", {}
             
-            logger.error(f"Webhook processing failed: {str(e)}")
-            return False, f"Processing failed: {str(e)}", {}
-        
-        finally:
-            # Always save the log
+            webhook_log.eventstream_sent = True
+            processing_time = (time.time() - start_time) * 1000
+            webhook_id = self._save_log(webhook_log, start_time, 'success', processing_time=processing_time).result()
+            
+            logger.info(f"Webhook processed successfully in {processing_time:.2f}ms")
+            return True, "Webhook processed successfully", {
+                'webhook_id': webhook_id,
+                'processing_time_ms': processing_time,
+                'payload_size': payload_size
+            }
+            
+        except Exception as e:
             try:
-                if webhook_log:
-                    webhook_log.processing_time_ms = webhook_log.processing_time_ms or (time.time() - start_time) * 1000
+                if not log_saved:
+                    self._save_log(webhook_log, start_time, 'failed', str(e))
+                elif webhook_id:
+                    # Saved as queued, but the outbox append failed
+                    WebhookLog.query.filter_by(id=webhook_id).update(
+                        {'status': 'failed', 'error_message': str(e)}, synchronize_session=False
+                    )
                     db.session.commit()
             except Exception as db_error:
                 logger.error(f"Failed to save webhook log: {str(db_error)}")
-        
-        return False, "Unknown error", {}
+            
+            logger.error(f"Webhook processing failed: {str(e)}")
+            return False, f"Processing failed: {str(e)}", {}
+    
+    @staticmethod
+    def _save_log(webhook_log: WebhookLog, start_time: float, status: str,
+                  error_message: Optional[str] = None, processing_time: Optional[float] = None) -> Future:
+        """
+        Queue the finished log for the group-commit writer; the future resolves to its id.
+
+        The writer thread owns the instance from here on, so callers must not read it back.
+        """
+        webhook_log.status = status
+        webhook_log.error_message = error_message
+        webhook_log.processing_time_ms = processing_time if processing_time is not None else (time.time() - start_time) * 1000
+        return log_writer.write(webhook_log)
     
     def _validate_request(self, request_data: Any) -> Tuple[bool, list]:
         """Validate the incoming request."""
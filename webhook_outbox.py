@@ -0,0 +1,405 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import EventStreamConfig, WebhookOutboxConfig, webhook_outbox_config
+from config_service import config_service
+from dead_letters import dead_letter_store
+from eventstream_client import EventStreamClient, get_eventstream_client
+from models import WebhookLog, db
+from serialized_event import SerializedEvent, loads
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_log_id INTEGER,
+    body BLOB NOT NULL,
+    enqueued_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    first_failed_at REAL,
+    claimed_by TEXT,
+    claimed_until REAL,
+    config_key TEXT,
+    config TEXT
+)
+"""
+
+# Added after the first release; existing outbox files get them on open
+_ADDED_COLUMNS = {"config_key": "TEXT", "config": "TEXT"}
+
+
+class WebhookOutbox:
+    """
+    Durable hand-off between ``/kobo-webhook`` and EventStream.
+
+    The webhook appends the validated payload to a local SQLite file in WAL
+    mode and returns; background drainers claim rows in batches, send them
+    through the client's batching producer and delete them only after the
+    send succeeded (at-least-once). Failed rows are retried with back-off
+    and move to the dead-letter store after ``max_attempts``. A drainer
+    renews its claim while sends are in flight; rows claimed by a drainer
+    that died are picked up again once the claim expires, so several worker
+    processes can share one outbox file. Drainers start with the app when
+    rows are left over from a previous run.
+
+    Each row carries the EventStream config it was accepted under (encrypted
+    with the configuration key), and drainers send through clients of their
+    own built from it, so any worker can deliver any row. A drainer only
+    claims rows whose config it can decrypt; rows accepted before any config
+    was known go out with the process's configured client, and are left to
+    other workers while this one has none.
+    """
+
+    def __init__(self, outbox_config: WebhookOutboxConfig = webhook_outbox_config,
+                 client_factory: Callable[[EventStreamConfig], Any] = EventStreamClient):
+        self.config = outbox_config
+        self.path = outbox_config.path
+        self.client_factory = client_factory
+        self.app = None
+        self._configs: Dict[str, EventStreamConfig] = {}  # config_key -> decrypted config
+        self._unreadable: set = set()  # config keys this process cannot decrypt
+        self._clients: Dict[str, Any] = {}  # config_key -> drainer-owned client
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead_lettered = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    def init_app(self, app):
+        """
+        Remember the app whose database holds the WebhookLog rows.
+
+        The outbox file lives in the app's instance folder (unless the
+        configured path is absolute), and drainers start right away if a
+        previous run left payloads behind; otherwise on the first append.
+        """
+        self.app = app
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.path = os.path.join(app.instance_path, self.config.path)
+        self._local = threading.local()
+        if self.enabled:
+            self.resume()
+
+    def resume(self) -> int:
+        """Start the drainers if undelivered rows are waiting; returns their number."""
+        try:
+            depth = self._connect().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"Cannot open webhook outbox {self.path}: {str(e)}")
+            return 0
+        if depth:
+            logger.info(f"Resuming delivery of {depth} payloads left in the webhook outbox")
+            self._ensure_drainers()
+        return depth
+
+    def append(self, event: SerializedEvent, webhook_log_id: Optional[int] = None,
+               eventstream_config: Optional[EventStreamConfig] = None) -> int:
+        """Durably store a payload (and the config to deliver it with); returns its outbox id."""
+        self._ensure_drainers()
+        config_key = sealed = None
+        if eventstream_config is not None:
+            config_key = self._config_key(eventstream_config)
+            sealed = config_service.encrypt(json.dumps(asdict(eventstream_config)))
+            self._configs.setdefault(config_key, eventstream_config)
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO outbox (webhook_log_id, body, enqueued_at, next_attempt_at, config_key, config)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (webhook_log_id, sqlite3.Binary(event.body), now, now, config_key, sealed),
+        )
+        self.enqueued += 1
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Outbox depth and age of the oldest undelivered payload."""
+        try:
+            depth, oldest, retrying = self._connect().execute(
+                "SELECT COUNT(*), MIN(enqueued_at), SUM(attempts > 0) FROM outbox"
+            ).fetchone()
+        except sqlite3.Error as e:
+            return {"enabled": self.enabled, "error": str(e)}
+        return {
+            "enabled": self.enabled,
+            "depth": depth,
+            "retrying": retrying or 0,
+            "oldest_age_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "failed_attempts": self.failed_attempts,
+            "dead_lettered": self.dead_lettered,
+            "drainers_alive": sum(1 for t in self._threads if t.is_alive()),
+        }
+
+    def shutdown(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.shutdown()
+
+    # ------------------------
+    # Draining
+    # ------------------------
+    def _ensure_drainers(self):
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            if self._pid != os.getpid():
+                # Forked worker: threads, SQLite connections and producers do not survive fork
+                self._local = threading.local()
+                self._clients = {}
+                self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.config.drainers):
+                thread = threading.Thread(target=self._drain_loop, name=f"webhook-outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _drain_loop(self):
+        while not self._stop.is_set():
+            try:
+                drained = self._drain_once()
+            except Exception as e:
+                logger.error(f"Webhook outbox drain failed: {str(e)}")
+                drained = 0
+            if drained < self.config.batch_size:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+
+    def _drain_once(self) -> int:
+        default_config = self._default_config()
+        token, rows = self._claim(self._deliverable_keys(), include_unkeyed=default_config is not None)
+        if not rows:
+            return 0
+
+        sends = []
+        for outbox_id, webhook_log_id, body, attempts, first_failed_at, config_key in rows:
+            body = bytes(body)
+            event = SerializedEvent(loads(body), body)
+            try:
+                future = self._client_for(config_key, default_config).submit(event)
+            except Exception as e:
+                future = e
+            sends.append((outbox_id, webhook_log_id, attempts, first_failed_at, event, future))
+        self._wait_renewing(token, [f for *_, f in sends if not isinstance(f, Exception)])
+
+        delivered: List[Tuple[int, Optional[int]]] = []
+        failed = []
+        for outbox_id, webhook_log_id, attempts, first_failed_at, event, future in sends:
+            error = future if isinstance(future, Exception) else future.exception()
+            if error is None:
+                delivered.append((outbox_id, webhook_log_id))
+            else:
+                failed.append((outbox_id, webhook_log_id, attempts + 1, first_failed_at, event, error))
+
+        # Out of attempts: hand over to the dead-letter store (needs the app database)
+        exhausted = [f for f in failed if f[2] >= self.config.max_attempts] if self.app is not None else []
+        retrying = [f for f in failed if f not in exhausted]
+
+        # WebhookLog first: a crash before the outbox delete only causes a redelivery
+        if not self._update_logs(delivered, retrying, exhausted):
+            exhausted, retrying = [], failed
+        conn = self._connect()
+        now = time.time()
+        with self._transaction(conn):
+            conn.executemany(
+                "DELETE FROM outbox WHERE id = ?",
+                [(outbox_id,) for outbox_id, _ in delivered] + [(f[0],) for f in exhausted],
+            )
+            conn.executemany(
+                "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ?, "
+                "first_failed_at = COALESCE(first_failed_at, ?), claimed_by = NULL, claimed_until = NULL WHERE id = ?",
+                [(attempts, str(error)[:1000], now + self._backoff(attempts), now, outbox_id)
+                 for outbox_id, _, attempts, _, _, error in retrying],
+            )
+        self.delivered += len(delivered)
+        self.failed_attempts += len(failed)
+        self.dead_lettered += len(exhausted)
+        if failed:
+            logger.warning(
+                f"Webhook outbox: {len(failed)} of {len(rows)} payloads failed "
+                f"({len(exhausted)} moved to dead letters)"
+            )
+        return len(rows)
+
+    def _claim(self, config_keys: List[str], include_unkeyed: bool = False
+               ) -> Tuple[str, List[Tuple[int, Optional[int], bytes, int, Optional[float], Optional[str]]]]:
+        """
+        Atomically claim the next due rows this drainer can deliver: those
+        with one of ``config_keys``, plus the ones without a config when
+        ``include_unkeyed``. Returns the claim token and the rows.
+        """
+        token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        conditions = []
+        if config_keys:
+            conditions.append(f"config_key IN ({', '.join('?' * len(config_keys))})")
+        if include_unkeyed:
+            conditions.append("config_key IS NULL")
+        if not conditions:
+            return token, []
+
+        now = time.time()
+        conn = self._connect()
+        with self._transaction(conn):
+            conn.execute(
+                "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE id IN ("
+                f" SELECT id FROM outbox WHERE next_attempt_at <= ? AND ({' OR '.join(conditions)})"
+                " AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY id LIMIT ?)",
+                (token, now + self.config.claim_seconds, now, *config_keys, now, self.config.batch_size),
+            )
+        return token, conn.execute(
+            "SELECT id, webhook_log_id, body, attempts, first_failed_at, config_key FROM outbox"
+            " WHERE claimed_by = ? ORDER BY id",
+            (token,),
+        ).fetchall()
+
+    def _deliverable_keys(self) -> List[str]:
+        """Config keys of waiting rows this process can decrypt (new ones are decrypted once)."""
+        known = list(self._configs) + list(self._unreadable)
+        new = self._connect().execute(
+            "SELECT config_key, MIN(config) FROM outbox WHERE config_key IS NOT NULL"
+            f" AND config_key NOT IN ({', '.join('?' * len(known))}) GROUP BY config_key",
+            known,
+        ).fetchall()
+        for config_key, sealed in new:
+            try:
+                self._configs[config_key] = EventStreamConfig(**json.loads(config_service.decrypt(sealed)))
+            except Exception as e:
+                # Sealed with another process's key (no shared CONFIG_ENCRYPTION_KEY): leave the rows to it
+                self._unreadable.add(config_key)
+                logger.warning(f"Webhook outbox rows for config {config_key[:12]} are not readable here: {str(e)}")
+        return list(self._configs)
+
+    def _client_for(self, config_key: Optional[str], default_config: Optional[EventStreamConfig]):
+        """The drainers' own client for a row's config (the process's config for rows without one)."""
+        config = self._configs.get(config_key) if config_key else default_config
+        if config is None:
+            raise Exception("No EventStream configuration for this payload")
+        key = config_key or self._config_key(config)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self.client_factory(config)
+        return client
+
+    @staticmethod
+    def _default_config() -> Optional[EventStreamConfig]:
+        """Config of this process's shared client (set once EventStream is configured here), if any."""
+        return get_eventstream_client().config
+
+    @staticmethod
+    def _config_key(eventstream_config: EventStreamConfig) -> str:
+        return hashlib.sha256(json.dumps(asdict(eventstream_config), sort_keys=True).encode()).hexdigest()
+
+    def _wait_renewing(self, token: str, futures: List[Any]):
+        """Wait for the sends, extending the claim so slow retries are not re-claimed by another drainer."""
+        interval = max(1.0, self.config.claim_seconds / 3)
+        pending = futures
+        while pending:
+            _, pending = wait(pending, timeout=interval)
+            if pending:
+                now = time.time()
+                self._connect().execute(
+                    "UPDATE outbox SET claimed_until = ? WHERE claimed_by = ?",
+                    (now + self.config.claim_seconds, token),
+                )
+
+    def _update_logs(self, delivered, retrying, exhausted) -> bool:
+        """Record outcomes on the WebhookLog rows (and dead letters); False if nothing was saved."""
+        if self.app is None:
+            return True
+        with self.app.app_context():
+            try:
+                delivered_ids = [log_id for _, log_id in delivered if log_id]
+                if delivered_ids:
+                    WebhookLog.query.filter(WebhookLog.id.in_(delivered_ids)).update(
+                        {"status": "success", "eventstream_sent": True, "error_message": None},
+                        synchronize_session=False,
+                    )
+                for _, log_id, attempts, _, _, error in retrying:
+                    if log_id:
+                        WebhookLog.query.filter_by(id=log_id).update(
+                            {"status": "retry", "retry_count": attempts, "error_message": str(error)[:1000]},
+                            synchronize_session=False,
+                        )
+                for _, log_id, attempts, first_failed_at, event, error in exhausted:
+                    owner_id = db.session.query(WebhookLog.user_id).filter_by(id=log_id).scalar() if log_id else None
+                    dead_letter_store.add(
+                        db.session, event, error, source="webhook", attempts=attempts, webhook_log_id=log_id,
+                        user_id=owner_id,
+                        first_failed_at=datetime.utcfromtimestamp(first_failed_at) if first_failed_at else None,
+                    )
+                    if log_id:
+                        WebhookLog.query.filter_by(id=log_id).update(
+                            {"status": "failed", "retry_count": attempts, "error_message": str(error)[:1000]},
+                            synchronize_session=False,
+                        )
+                db.session.commit()
+                return True
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to update webhook logs from outbox: {str(e)}")
+                return False
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.config.max_backoff_seconds, 2.0 ** attempts)
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # a 202 means the payload is on disk
+            conn.execute(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_due ON outbox (next_attempt_at, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_claim ON outbox (claimed_by)")
+            self._local.conn = conn
+        return conn
+
+
+# Global outbox instance
+webhook_outbox = WebhookOutbox()
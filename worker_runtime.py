@@ -0,0 +1,59 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerRuntime:
+    """
+    Database access for background workers without a Flask application.
+
+    Holds one engine and a thread-local session registry over the same
+    models the web tier uses. ``session_scope()`` plays the role of an app
+    context: the calling thread's session is removed when the outermost
+    scope exits, so pool threads never leak sessions between jobs.
+    """
+
+    def __init__(self, database_url: str, engine_options: Optional[Dict[str, Any]] = None):
+        self.database_url = database_url
+        options = {"pool_recycle": 300, "pool_pre_ping": True}
+        options.update(engine_options or {})
+        self.engine = create_engine(database_url, **options)
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> 'WorkerRuntime':
+        """Use ``DATABASE_URL``, falling back to the same SQLite file as the web app."""
+        return cls(os.environ.get("DATABASE_URL") or Config.SQLALCHEMY_DATABASE_URI)
+
+    @property
+    def session(self):
+        """The current thread's session."""
+        return self.Session
+
+    @contextmanager
+    def session_scope(self):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        try:
+            yield self.Session
+        except Exception:
+            self.Session.rollback()
+            raise
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self.Session.remove()
+
+    def dispose(self):
+        self.Session.remove()
+        self.engine.dispose()